@@ -1,139 +1,2690 @@
 import streamlit as st
 import re
+import argparse
+import base64
+import bisect
+import codecs
+import collections
+import concurrent.futures
+import copy
+import cProfile
+import datetime
+import difflib
+import gc
 import hashlib # Importamos la librería hashlib para calcular los hashes
+import hmac
+import html
+import io
+import itertools
+import logging
+import marshal
+import mmap
+import os
+import platform
+import posixpath
+import pstats
+import queue
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import unicodedata
+import weakref
+import zipfile
+from array import array
+import numpy as np
 import json # Necesario para parsear la configuración de Firebase
 import streamlit.components.v1 as components # Para incrustar el componente HTML/JS
 
-def parse_chat_content(chat_content):
+# Tamaño de bloque para la lectura incremental de los archivos (1 MiB)
+CHUNK_SIZE = 1024 * 1024
+# Cantidad máxima de chats procesados que se conservan en memoria entre re-ejecuciones
+INGEST_CACHE_MAX_ENTRIES = 8
+# Almacén persistente de los chats procesados (SQLite), para reabrirlos sin volver a procesarlos
+# aunque termine la sesión. La ubicación y el tamaño máximo (en MB, 0 lo desactiva) se pueden
+# cambiar con las variables de entorno WHATSAPP_CHAT_STORE y WHATSAPP_CHAT_STORE_MAX_MB
+CHAT_STORE_PATH = os.environ.get(
+    "WHATSAPP_CHAT_STORE", os.path.join(os.path.expanduser("~"), ".cache", "visualizador-whatsapp", "chats.sqlite3")
+)
+CHAT_STORE_MAX_BYTES = int(os.environ.get("WHATSAPP_CHAT_STORE_MAX_MB", "2048")) * 1024 * 1024
+# Mensajes por bloque de textos en el almacén, y bloques que se conservan en memoria por chat
+STORE_TEXT_BLOCK_SIZE = 1024
+STORE_CACHED_TEXT_BLOCKS = 256
+# Carpeta del servidor con exportaciones de causas (p. ej. un recurso compartido montado), cuyos
+# archivos se abren con mmap en lugar de subirlos. Sin la variable WHATSAPP_CASE_DIR no se ofrece
+CASE_FILES_DIR = os.environ.get("WHATSAPP_CASE_DIR")
+# Tamaños de página disponibles en el visor de la conversación
+PAGE_SIZES = [100, 250, 500, 1000]
+# Fases del procesamiento en segundo plano, cada cuántos mensajes informan su avance y cada
+# cuántos segundos la página consulta ese avance
+INGEST_PHASES = {
+    "hash": "Lectura y cálculo de hashes",
+    "parse": "Análisis de los mensajes",
+    "index": "Índice de búsqueda",
+    "merkle": "Árbol de Merkle",
+}
+PROGRESS_INTERVAL = 1000
+INGEST_POLL_SECONDS = 0.5
+# Prefijos del estado de sesión de cada archivo que se procesa (ver ingest_upload): el chat
+# cargado y la exportación anterior con la que se compara
+UPLOAD_STATE_PREFIXES = ("", "previous_")
+# Cantidad máxima de resultados de búsqueda que se muestran
+SEARCH_RESULTS_LIMIT = 50
+# Panel de diagnóstico de rendimiento (tiempos por fase y perfiles descargables): con la variable
+# de entorno WHATSAPP_DEBUG=1 se muestra siempre; con WHATSAPP_DEBUG_TOKEN, solo en la página
+# abierta con ?debug=<token>. Sin ninguna de las dos no se ofrece
+DEBUG_PANEL = os.environ.get("WHATSAPP_DEBUG") == "1"
+DEBUG_TOKEN = os.environ.get("WHATSAPP_DEBUG_TOKEN")
+# Cantidad de funciones y de líneas de asignación de memoria que lista el informe de un perfil
+PROFILE_REPORT_LINES = 40
+# Algoritmos de hash disponibles (nombre en hashlib -> nombre visible). Algunos tribunales
+# exigen SHA-1, SHA-512 o BLAKE2 además de los habituales SHA256 y MD5
+HASH_ALGORITHMS = {"sha256": "SHA256", "md5": "MD5", "sha1": "SHA-1", "sha512": "SHA-512", "blake2b": "BLAKE2b"}
+DEFAULT_HASH_ALGORITHMS = ("sha256", "md5")
+
+# Cantidad de líneas iniciales que se analizan para detectar el formato de la exportación
+FORMAT_SAMPLE_LINES = 200
+
+# Invisible marks that some exports put before the date or the text (LTR/RTL marks, BOM)
+_INVISIBLE_MARKS = "[\u200e\u200f\u202a-\u202e\ufeff]*"
+_DATE_PROBE = r"(\d{1,2})([/.-])(\d{1,2})\2(\d{2,4}),? (\d{1,2}):(\d{2})(:\d{2})?(\s?[AaPp]\.?\s?[Mm]\.?)?"
+# Generic regexes used only on the first lines of a file to recognize its layout:
+# 1. Android: DATE, TIME - SENDER: MESSAGE (e.g., "2/7/2025, 20:13 - Marcelo G. Montiel: Hola flor")
+#    or DATE, TIME - MESSAGE for system messages (e.g., "2/7/2025, 20:13 - Los mensajes...")
+# 2. iOS: [DATE, TIME] SENDER: MESSAGE (e.g., "[02/07/25, 20:13:05] Marcelo G. Montiel: Hola flor")
+_FORMAT_PROBES = {
+    "Android": re.compile("^" + _INVISIBLE_MARKS + _DATE_PROBE + " - "),
+    "iOS": re.compile("^" + _INVISIBLE_MARKS + r"\[" + _DATE_PROBE + r"\] "),
+}
+
+# A detected export layout: readable name, compiled message header regex and date order
+ChatFormat = collections.namedtuple("ChatFormat", ["name", "regex", "day_first"])
+
+def compile_chat_format(family="Android", date_separator="/", year_digits=4, has_seconds=False, has_ampm=False, day_first=True):
+    """
+    Compiles the message header regex of one specific export layout.
+    The regex always has the same groups: full date, the three date numbers, hour, minute,
+    seconds and AM/PM marker (empty when the layout has none), sender (None for system messages)
+    and text. Only one specialized regex is tried per line during the full parse.
+    """
+    separator = re.escape(date_separator)
+    date = rf"((\d{{1,2}}){separator}(\d{{1,2}}){separator}(\d{{{year_digits}}}))"
+    time = r"(\d{1,2}):(\d{2})" + (r":(\d{2})" if has_seconds else "()")
+    time += r"\s?([AaPp])\.?\s?[Mm]\.?" if has_ampm else "()"
+    if family == "iOS":
+        header = rf"\[{date},? {time}\] "
+    else:
+        header = rf"{date},? {time} - "
+    regex = re.compile("^" + _INVISIBLE_MARKS + header + r"(?:([^:]+): )?" + _INVISIBLE_MARKS + "(.*)")
+    date_order = "d/m" if day_first else "m/d"
+    year_format = "aaaa" if year_digits == 4 else "aa"
+    name = f"{family} · {date_order}/{year_format} · {'12 h (AM/PM)' if has_ampm else '24 h'}{' con segundos' if has_seconds else ''}"
+    return ChatFormat(name, regex, day_first)
+
+# Formato clásico de Android en español, usado si no se reconoce ningún otro
+DEFAULT_CHAT_FORMAT = compile_chat_format()
+
+def detect_chat_format(sample_lines):
+    """
+    Picks the known layout that matches most of the sample lines (the first lines of the file)
+    and compiles the specialized header regex for it. The date order is day first unless a
+    number greater than 12 shows up in the first position but never in the second.
+    """
+    sample_lines = list(sample_lines)
+    best_family, best_matches = None, []
+    for family, probe in _FORMAT_PROBES.items():
+        matches = [match for match in map(probe.match, sample_lines) if match]
+        if len(matches) > len(best_matches):
+            best_family, best_matches = family, matches
+    if not best_matches:
+        return DEFAULT_CHAT_FORMAT
+
+    date_separator = collections.Counter(match.group(2) for match in best_matches).most_common(1)[0][0]
+    year_digits = collections.Counter(len(match.group(4)) for match in best_matches).most_common(1)[0][0]
+    has_seconds = any(match.group(7) for match in best_matches)
+    has_ampm = any(match.group(8) for match in best_matches)
+    first_over_12 = any(int(match.group(1)) > 12 for match in best_matches)
+    second_over_12 = any(int(match.group(3)) > 12 for match in best_matches)
+    day_first = first_over_12 or not second_over_12
+    return compile_chat_format(best_family, date_separator, year_digits, has_seconds, has_ampm, day_first)
+
+def iter_chat_lines(stream, chunk_size=CHUNK_SIZE):
+    """
+    Reads a binary stream in fixed-size chunks and yields its lines as bytes, each with its newline
+    (only a last line without one comes out bare), so the line lengths add up to byte offsets.
+    Only the unfinished tail of each chunk is carried over to the next one, so memory stays
+    bounded by the chunk size plus the longest line instead of the size of the whole file.
+    """
+    tail = []
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        lines = chunk.split(b"\n")
+        if len(lines) == 1:
+            # No line break in this chunk: keep accumulating the current line
+            tail.append(chunk)
+            continue
+        if tail:
+            tail.append(lines[0])
+            lines[0] = b"".join(tail)
+        last = lines.pop()
+        tail = [last] if last else []
+        for line in lines:
+            yield line + b"\n"
+    if tail:
+        yield b"".join(tail)
+
+# Ordinal of 1/1/1970: timestamps are seconds since then, taking the export's local time as UTC
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+SECONDS_PER_DAY = 86400
+
+def export_date(first, second, year, day_first=True):
+    """
+    Converts the three numbers of an exported date into a datetime.date, in the detected order.
+    Two-digit years are taken as 20yy. Falls back to the other order and returns None if
+    neither is a valid date.
+    """
+    if year < 100:
+        year += 2000
+    orders = ((first, second), (second, first)) if day_first else ((second, first), (first, second))
+    for day, month in orders:
+        try:
+            return datetime.date(year, month, day)
+        except ValueError:
+            pass
+    return None
+
+def date_to_timestamp(date):
+    """
+    Returns the timestamp of the first second of a datetime.date.
+    """
+    return (date.toordinal() - EPOCH_ORDINAL) * SECONDS_PER_DAY
+
+def format_timestamp(timestamp):
+    """
+    Formats a message timestamp as "d/m/yyyy HH:MM", adding ":SS" only when the seconds are not zero.
+    """
+    day = datetime.date.fromordinal(EPOCH_ORDINAL + timestamp // SECONDS_PER_DAY)
+    seconds = timestamp % SECONDS_PER_DAY
+    formatted = f"{day.day}/{day.month}/{day.year} {seconds // 3600:02d}:{seconds // 60 % 60:02d}"
+    return formatted + f":{seconds % 60:02d}" if seconds % 60 else formatted
+
+def format_timestamp_iso(timestamp):
+    """
+    Formats a message timestamp as ISO 8601 (export's local time, without time zone).
+    """
+    return (datetime.datetime(1970, 1, 1) + datetime.timedelta(seconds=timestamp)).isoformat()
+
+# --- Clasificación de los mensajes ---
+# Tipos de mensaje (clave -> nombre visible); el código de cada tipo es su posición
+MESSAGE_TYPES = {
+    "text": "Texto",
+    "media": "Multimedia omitida",
+    "attachment": "Archivo adjunto",
+    "deleted": "Mensaje eliminado",
+    "link": "Enlace",
+    "location": "Ubicación",
+    "contact": "Contacto",
+    "system": "Evento del sistema",
+}
+(
+    TEXT_MESSAGE, MEDIA_MESSAGE, ATTACHMENT_MESSAGE, DELETED_MESSAGE,
+    LINK_MESSAGE, LOCATION_MESSAGE, CONTACT_MESSAGE, SYSTEM_MESSAGE,
+) = range(len(MESSAGE_TYPES))
+# Dominios cuyos enlaces se muestran como video de YouTube
+YOUTUBE_DOMAINS = ("youtube.com", "m.youtube.com", "youtu.be")
+
+# References to attached files inside a message, as written by iOS ("<adjunto: 00000012-PHOTO-2025-07-02-20-13-05.jpg>")
+# and by Android at the start of the text, with the original name of a document, spaces included
+# ("IMG-20250702-WA0001.jpg (archivo adjunto)", "Contrato final.pdf (archivo adjunto)")
+_IOS_ATTACHMENT_PATTERN = r"<(?:adjunto|attached|anexo): ([^>]+)>"
+_ANDROID_ATTACHMENT_PATTERN = r"(.+?\.\w{2,5}) \((?:archivo adjunto|file attached|arquivo anexado)\)"
+ATTACHMENT_REGEX = re.compile(_IOS_ATTACHMENT_PATTERN + "|^" + _ANDROID_ATTACHMENT_PATTERN)
+# Texts written by WhatsApp in place of the message (Spanish, English and Portuguese exports),
+# matched at the start of the text with their exact case; the group that matches is the type
+_MESSAGE_MARKERS_PATTERN = (
+    r"(?P<deleted>(?:Se eliminó este mensaje|Eliminaste este mensaje|Este mensaje fue eliminado"
+    r"|This message was deleted|You deleted this message|Mensagem apagada|Você apagou esta mensagem)\.?\s*\Z)"
+    r"|(?P<contact>(?:[Tt]arjeta de contacto omitida|[Cc]ontact card omitted|[Cc]artão de contato omitido)\s*\Z|BEGIN:VCARD)"
+    r"|(?P<location>(?:[Uu]bicación|[Ll]ocation|[Ll]ocalização): https?://|https?://maps\.google\.com/\?q="
+    r"|Ubicación en tiempo real compartida|Live location shared)"
+    r"|(?P<media><?(?:Multimedia omitido|Media omitted|Mídia oculta|arquivo de mídia oculto)>?\s*\Z"
+    r"|(?:imagen|video|audio|sticker|GIF|documento) omitid[oa]\s*\Z|(?:image|video|audio|sticker|GIF|document) omitted\s*\Z)"
+)
+# Attachments and links anywhere in the text (the first one found decides the type), after an
+# Android attachment at its start. These regexes only run on the texts where the plain
+# alternation of the hints finds something, much faster
+_MESSAGE_CONTENT_PATTERN = (
+    "(?P<attachment>" + _IOS_ATTACHMENT_PATTERN + ")"
+    r"|(?P<link>https?://(?:www\.)?([^/\s?#:>]+)|\bwww\.([^/\s?#:>]+))"
+)
+_MESSAGE_CONTENT_HINTS = r"://|www\.|WWW\.|<|adjunto\)|attached\)|anexado\)"
+_MESSAGE_TYPE_CODES = {name: code for code, name in enumerate(MESSAGE_TYPES)}
+# Compiled for str texts and for raw UTF-8 texts (see MappedTexts)
+_MESSAGE_MARKERS = {
+    str: re.compile(_MESSAGE_MARKERS_PATTERN),
+    bytes: re.compile(_MESSAGE_MARKERS_PATTERN.encode("utf-8")),
+}
+# (hints, Android attachment matched at the start of the text, content searched in it)
+_MESSAGE_CONTENT = {
+    str: (
+        re.compile(_MESSAGE_CONTENT_HINTS),
+        re.compile(_ANDROID_ATTACHMENT_PATTERN, re.IGNORECASE),
+        re.compile(_MESSAGE_CONTENT_PATTERN, re.IGNORECASE),
+    ),
+    bytes: (
+        re.compile(_MESSAGE_CONTENT_HINTS.encode("utf-8")),
+        re.compile(_ANDROID_ATTACHMENT_PATTERN.encode("utf-8"), re.IGNORECASE),
+        re.compile(_MESSAGE_CONTENT_PATTERN.encode("utf-8"), re.IGNORECASE),
+    ),
+}
+
+def classify_message(text, start=0, end=sys.maxsize):
+    """
+    Classifies the text of a (non-system) message: returns (type code, domain), domain being
+    the host of the first link for LINK_MESSAGE and None otherwise. text is a str, or a buffer
+    (bytes, mmap) with the raw UTF-8 text between start and end, classified in place.
+    """
+    text_type = str if isinstance(text, str) else bytes
+    match = _MESSAGE_MARKERS[text_type].match(text, start, end)
+    if match:
+        return _MESSAGE_TYPE_CODES[match.lastgroup], None
+    hints_regex, android_attachment_regex, content_regex = _MESSAGE_CONTENT[text_type]
+    if hints_regex.search(text, start, end) is None:
+        return TEXT_MESSAGE, None
+    # match() anchors at start, which "^" in a search from start would not do on a buffer
+    match = android_attachment_regex.match(text, start, end) or content_regex.search(text, start, end)
+    if match is None:
+        return TEXT_MESSAGE, None
+    if match.re is android_attachment_regex or match.lastgroup == "attachment":
+        # A shared contact is attached as a .vcf file
+        name = match.group(1) if match.re is android_attachment_regex else match.group(match.lastindex + 1)
+        return (CONTACT_MESSAGE if name.strip().lower().endswith((".vcf", b".vcf")[text_type is bytes]) else ATTACHMENT_MESSAGE), None
+    domain = match.group(match.lastindex + 1) or match.group(match.lastindex + 2)
+    if text_type is bytes:
+        domain = domain.decode("utf-8", "replace")
+    return LINK_MESSAGE, domain.rstrip(".,;!)\"'").lower()
+
+class MessageStore:
+    """
+    Column-oriented storage of the parsed messages.
+    Each message takes an epoch timestamp (parsed once at ingestion), a sender ID pointing into
+    an interned participant table and its text, instead of a dict of four strings. Sender IDs
+    let the viewer compare integers instead of names, and the day index (first position of
+    each day) lets it jump to a date with a bisect.
+    Each message also keeps the byte range it spans in the chat text and its Merkle leaf hash
+    (see MerkleTree), so a single message can be cited and verified on its own.
+    Messages are classified once, as they are appended (see classify_message): a type code per
+    message, the positions of each type, and the domain of each link (interned like the
+    senders), so the viewer filters and formats them without looking at the texts again.
+    """
+    SYSTEM_SENDER_ID = 0
+
+    __slots__ = (
+        "chat_format", "timestamps", "sender_ids", "texts", "senders", "sender_ids_by_name",
+        "day_numbers", "day_starts", "byte_starts", "byte_ends", "leaf_hashes",
+        "message_types", "type_positions", "link_domain_ids", "domains", "domain_ids_by_name",
+    )
+
+    def __init__(self, chat_format=DEFAULT_CHAT_FORMAT):
+        self.chat_format = chat_format
+        self.timestamps = array("q")
+        self.sender_ids = array("I")
+        self.texts = []
+        # Interned participant table: ID 0 is always "Sistema"
+        self.senders = ["Sistema"]
+        self.sender_ids_by_name = {"Sistema": self.SYSTEM_SENDER_ID}
+        # Days since the epoch that have messages (ascending) and position of their first message
+        self.day_numbers = array("i")
+        self.day_starts = array("I")
+        # Byte range [start, end) of each message in the chat text, and the concatenated
+        # 32-byte Merkle leaf hashes (one per message)
+        self.byte_starts = array("Q")
+        self.byte_ends = array("Q")
+        self.leaf_hashes = bytearray()
+        # Type code of each message, ascending positions of each type, and the domain ID of each
+        # link (aligned with the positions of LINK_MESSAGE)
+        self.message_types = array("B")
+        self.type_positions = [array("I") for _ in MESSAGE_TYPES]
+        self.link_domain_ids = array("I")
+        self.domains = []
+        self.domain_ids_by_name = {}
+
+    def __len__(self):
+        return len(self.texts)
+
+    @property
+    def participants(self):
+        """Participant names (excluding "Sistema") in order of appearance."""
+        return self.senders[1:]
+
+    def append(self, timestamp, sender, text, byte_start=0, byte_end=0, leaf_hash=None):
+        sender_id = self.sender_ids_by_name.get(sender)
+        if sender_id is None:
+            sender_id = self.sender_ids_by_name[sender] = len(self.senders)
+            self.senders.append(sender)
+        position = len(self.timestamps)
+        day_number = timestamp // SECONDS_PER_DAY
+        # Out-of-order days are left out of the day index to keep it sorted
+        if not self.day_numbers or day_number > self.day_numbers[-1]:
+            self.day_numbers.append(day_number)
+            self.day_starts.append(position)
+        if sender_id == self.SYSTEM_SENDER_ID:
+            message_type, domain = SYSTEM_MESSAGE, None
+        else:
+            # A MappedTexts text is a byte range: it is classified in place, in the mapped buffer
+            message_type, domain = classify_message(self.texts.buffer, *text) if isinstance(text, tuple) else classify_message(text)
+        self.message_types.append(message_type)
+        self.type_positions[message_type].append(position)
+        if domain is not None:
+            domain_id = self.domain_ids_by_name.get(domain)
+            if domain_id is None:
+                domain_id = self.domain_ids_by_name[domain] = len(self.domains)
+                self.domains.append(domain)
+            self.link_domain_ids.append(domain_id)
+        self.timestamps.append(timestamp)
+        self.sender_ids.append(sender_id)
+        self.texts.append(text)
+        self.byte_starts.append(byte_start)
+        self.byte_ends.append(byte_end)
+        self.leaf_hashes += leaf_hash or bytes(MERKLE_HASH_SIZE)
+
+    def position_of_date(self, date):
+        """
+        Returns the position of the first message of the given date (or of the next date with
+        messages, or of the last day if the date is after the end of the chat).
+        """
+        if not self.day_numbers:
+            return 0
+        day_number = date.toordinal() - EPOCH_ORDINAL
+        index = bisect.bisect_left(self.day_numbers, day_number)
+        return self.day_starts[min(index, len(self.day_starts) - 1)]
+
+    def first_date(self):
+        return datetime.date.fromordinal(EPOCH_ORDINAL + self.day_numbers[0]) if self.day_numbers else None
+
+    def last_date(self):
+        return datetime.date.fromordinal(EPOCH_ORDINAL + self.day_numbers[-1]) if self.day_numbers else None
+
+    def prefix(self, count):
+        """
+        Returns a new MessageStore with copies of the first count messages, to be extended with
+        further messages (e.g. the new tail of a later export of the same chat).
+        """
+        store = MessageStore(self.chat_format)
+        store.timestamps = self.timestamps[:count]
+        store.sender_ids = self.sender_ids[:count]
+        store.texts = self.texts[:count]
+        # IDs are interned in order of appearance: the first count messages use IDs 0 to max
+        sender_count = max(store.sender_ids, default=self.SYSTEM_SENDER_ID) + 1
+        store.senders = self.senders[:sender_count]
+        store.sender_ids_by_name = {sender: sender_id for sender_id, sender in enumerate(store.senders)}
+        day_count = bisect.bisect_left(self.day_starts, count)
+        store.day_numbers = self.day_numbers[:day_count]
+        store.day_starts = self.day_starts[:day_count]
+        store.byte_starts = self.byte_starts[:count]
+        store.byte_ends = self.byte_ends[:count]
+        store.leaf_hashes = self.leaf_hashes[:count * MERKLE_HASH_SIZE]
+        store.message_types = self.message_types[:count]
+        store.type_positions = [positions[:bisect.bisect_left(positions, count)] for positions in self.type_positions]
+        store.link_domain_ids = self.link_domain_ids[:len(store.type_positions[LINK_MESSAGE])]
+        store.domains = self.domains[:max(store.link_domain_ids, default=-1) + 1]
+        store.domain_ids_by_name = {domain: domain_id for domain_id, domain in enumerate(store.domains)}
+        return store
+
+    def positions_of_type(self, message_type, domain=None):
+        """
+        Ascending positions of the messages of a type code; for LINK_MESSAGE, only those whose
+        link is to domain if given.
+        """
+        positions = self.type_positions[message_type]
+        if message_type != LINK_MESSAGE or domain is None:
+            return positions
+        domain_id = self.domain_ids_by_name.get(domain)
+        return array("I", (position for position, link_domain_id in zip(positions, self.link_domain_ids) if link_domain_id == domain_id))
+
+    def link_domain(self, position):
+        """Domain of the link of a LINK_MESSAGE message (None for other types)."""
+        if self.message_types[position] != LINK_MESSAGE:
+            return None
+        links = self.type_positions[LINK_MESSAGE]
+        return self.domains[self.link_domain_ids[bisect.bisect_left(links, position)]]
+
+    def domain_counts(self):
+        """(domain, number of links) of the chat, the most linked first."""
+        counts = collections.Counter(self.link_domain_ids)
+        return [(self.domains[domain_id], count) for domain_id, count in counts.most_common()]
+
+    def texts_at(self, positions):
+        """
+        Texts of the messages at the given ascending positions (read in blocks from a ChatStore).
+        """
+        if isinstance(self.texts, StoredTexts):
+            return self.texts.select(positions)
+        texts = self.texts
+        return [texts[p] for p in positions]
+
+    def leaf_hash(self, position):
+        """
+        Merkle leaf hash (32 bytes) of the message at the given position.
+        """
+        offset = position * MERKLE_HASH_SIZE
+        return bytes(self.leaf_hashes[offset:offset + MERKLE_HASH_SIZE])
+
+    def message(self, position):
+        """
+        Returns one message as a dict (ISO 8601 timestamp, sender name, type, text, byte range in
+        the chat text and Merkle leaf hash, and the domain of links), for export.
+        """
+        record = {
+            "timestamp": format_timestamp_iso(self.timestamps[position]),
+            "sender": self.senders[self.sender_ids[position]],
+            "type": list(MESSAGE_TYPES)[self.message_types[position]],
+            "text": self.texts[position],
+            "byte_start": self.byte_starts[position],
+            "byte_end": self.byte_ends[position],
+            "leaf_sha256": self.leaf_hash(position).hex(),
+        }
+        if self.message_types[position] == LINK_MESSAGE:
+            record["domain"] = self.link_domain(position)
+        return record
+
+def iter_chat_messages(raw_lines, chat_format=DEFAULT_CHAT_FORMAT, start_offset=0):
+    """
+    Parses the lines of a WhatsApp export (as bytes, with their newlines) and yields one
+    (timestamp, sender, text, byte_start, byte_end, leaf_hash) tuple per message, using the
+    header regex of the detected chat_format. byte_start/byte_end delimit the raw bytes of the
+    message (header and continuation lines) and leaf_hash is their Merkle leaf hash, both
+    computed in the same pass. start_offset is the byte offset of the first line, when parsing
+    starts in the middle of the chat text.
+    A message is yielded as soon as the next message header (or the end of the file) closes it.
+    Continuation lines are buffered in a list and joined once per message, which keeps
+    parsing linear even for very long multi-line messages (pasted documents, etc.).
+    Each distinct date is converted to a timestamp only once.
+    """
+    match_header = chat_format.regex.match
+    day_first = chat_format.day_first
+    day_epochs = {}
+    current_message = None
+    text_lines = []
+    raw_parts = []
+    sha256 = hashlib.sha256
+    offset = start_offset
+    for raw_line in raw_lines:
+        # Invalid UTF-8 bytes become U+FFFD, as in parse_mapped_chat: both paths stay equivalent
+        line = raw_line.decode("utf-8", "replace")
+        match = match_header(line)
+        if match:
+            date_text, first, second, year, hour, minute, seconds, meridiem, sender_group, text = match.groups()
+            if date_text not in day_epochs:
+                day = export_date(int(first), int(second), int(year), day_first)
+                day_epochs[date_text] = None if day is None else date_to_timestamp(day)
+            if day_epochs[date_text] is None:
+                # Not a real date: keep the line as text of the previous message
+                match = None
+        if match:
+            # If it's the start of a new message, the previous one is complete
+            if current_message:
+                yield current_message[0], current_message[1], "\n".join(text_lines), current_message[2], offset, sha256(b"".join(raw_parts)).digest()
+
+            # Determine the actual sender
+            sender = sender_group.strip() if sender_group else "Sistema"
+            hour = int(hour)
+            if meridiem:
+                hour = hour % 12 + (12 if meridiem in "pP" else 0)
+            timestamp = day_epochs[date_text] + hour * 3600 + int(minute) * 60 + (int(seconds) if seconds else 0)
+
+            current_message = (timestamp, sender, offset)
+            text_lines = [text.strip()]
+            raw_parts = [MERKLE_LEAF_PREFIX, raw_line]
+        elif current_message:
+            # If it's not a new message, it's a continuation of the previous message
+            text_lines.append(line.strip())
+            raw_parts.append(raw_line)
+        offset += len(raw_line)
+
+    # Yield the last message if it exists
+    if current_message:
+        yield current_message[0], current_message[1], "\n".join(text_lines), current_message[2], offset, sha256(b"".join(raw_parts)).digest()
+
+def append_messages(messages, parsed_messages, progress=None):
+    """
+    Appends the tuples of iter_chat_messages to a MessageStore, calling progress(messages,
+    bytes_parsed) every PROGRESS_INTERVAL messages if given.
+    """
+    append = messages.append
+    if progress is None:
+        for message in parsed_messages:
+            append(*message)
+        return
+    for count, message in enumerate(parsed_messages, 1):
+        append(*message)
+        if count % PROGRESS_INTERVAL == 0:
+            progress(messages, message[4])
+
+def parse_chat_content(chat_source, chat_format=None, progress=None):
+    """
+    Parses the chat content and returns a MessageStore with all the messages.
+    It also returns the unique participants (excluding "Sistema"), in order of appearance.
+    chat_source: a binary file-like object (e.g. the Streamlit upload) or the raw bytes of the export.
+    chat_format: the export layout; by default it is detected from the first lines of the file.
+    progress: optional callable(messages, bytes_parsed), called every PROGRESS_INTERVAL messages
+    with the MessageStore filled so far.
+    """
+    if isinstance(chat_source, (bytes, bytearray)):
+        chat_source = io.BytesIO(chat_source)
+
+    raw_lines = iter_chat_lines(chat_source)
+    sample = list(itertools.islice(raw_lines, FORMAT_SAMPLE_LINES))
+    if chat_format is None:
+        chat_format = detect_chat_format(line.decode("utf-8", "replace") for line in sample)
+
+    messages = MessageStore(chat_format)
+    append_messages(messages, iter_chat_messages(itertools.chain(sample, raw_lines), chat_format), progress)
+
+    # Return messages and the list of detected participants
+    return messages, messages.participants
+
+# Versiones en bytes (UTF-8) de las partes no ASCII de las expresiones de encabezado, para
+# analizar el chat sin decodificarlo (ver parse_mapped_chat)
+_INVISIBLE_MARKS_UTF8 = "(?:\xe2\x80[\x8e\x8f\xaa-\xae]|\xef\xbb\xbf)*"
+_OPTIONAL_SPACE_UTF8 = "(?:[ \t]|\xc2\xa0|\xe2\x80\xaf)?"
+
+def bytes_header_regex(chat_format):
+    """
+    The header regex of chat_format for UTF-8 bytes, matching at every line start of a whole
+    buffer (re.MULTILINE) instead of one decoded line at a time. The text group is left empty:
+    only where the text starts is needed, since it ends at the next header.
+    """
+    pattern = (
+        (chat_format.regex.pattern.removesuffix("(.*)") + "()")
+        .replace(_INVISIBLE_MARKS, _INVISIBLE_MARKS_UTF8)
+        .replace(r"\s?", _OPTIONAL_SPACE_UTF8)
+        .replace("[^:]+", "[^:\\n]+")
+    )
+    return re.compile(pattern.encode("latin-1"), re.MULTILINE)
+
+class MappedTexts:
+    """
+    Texts column of a MessageStore filled by parse_mapped_chat: only the byte range of each text
+    in the mapped buffer is kept, and a text is decoded when it is read (shown, searched,
+    indexed), so the chat is never held as Python strings. The lines are stripped and joined as
+    iter_chat_messages does.
+    """
+    __slots__ = ("buffer", "starts", "ends")
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.starts = array("Q")
+        self.ends = array("Q")
+
+    def __len__(self):
+        return len(self.starts)
+
+    def append(self, text_range):
+        start, end = text_range
+        self.starts.append(start)
+        self.ends.append(end)
+
+    def _decode(self, start, end):
+        text = self.buffer[start:end].decode("utf-8", "replace")
+        if text.endswith("\n"):
+            text = text[:-1]
+        return "\n".join(line.strip() for line in text.split("\n"))
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self._decode(self.starts[index], self.ends[index]) for index in range(*position.indices(len(self)))]
+        return self._decode(self.starts[position], self.ends[position])
+
+    def __iter__(self):
+        for start, end in zip(self.starts, self.ends):
+            yield self._decode(start, end)
+
+def iter_mapped_messages(buffer, chat_format):
+    """
+    Like iter_chat_messages, over a whole chat text in a buffer (an mmap or bytes): the header
+    regex runs in bytes mode over the buffer itself, so lines are never split nor decoded, and
+    the leaf hashes are computed over memoryview slices. Only the dates and the senders are
+    decoded; the text of each message is yielded as its (start, end) byte range (see MappedTexts).
+    """
+    header_matches = bytes_header_regex(chat_format).finditer(buffer)
+    day_first = chat_format.day_first
+    day_epochs = {}
+    senders = {}
+    current_message = None
+    view = memoryview(buffer)
+    sha256 = hashlib.sha256
+    for match in header_matches:
+        date_text, first, second, year, hour, minute, seconds, meridiem, sender_group = match.group(1, 2, 3, 4, 5, 6, 7, 8, 9)
+        if date_text not in day_epochs:
+            day = export_date(int(first), int(second), int(year), day_first)
+            day_epochs[date_text] = None if day is None else date_to_timestamp(day)
+        if day_epochs[date_text] is None:
+            # Not a real date: the line stays in the text of the previous message
+            continue
+        start = match.start()
+        if current_message:
+            leaf_hash = sha256(MERKLE_LEAF_PREFIX)
+            leaf_hash.update(view[current_message[3]:start])
+            yield current_message[0], current_message[1], (current_message[2], start), current_message[3], start, leaf_hash.digest()
+
+        if sender_group not in senders:
+            senders[sender_group] = sender_group.decode("utf-8", "replace").strip() if sender_group else "Sistema"
+        hour = int(hour)
+        if meridiem:
+            hour = hour % 12 + (12 if meridiem in b"pP" else 0)
+        timestamp = day_epochs[date_text] + hour * 3600 + int(minute) * 60 + (int(seconds) if seconds else 0)
+        current_message = (timestamp, senders[sender_group], match.start(10), start)
+
+    if current_message:
+        end = len(buffer)
+        leaf_hash = sha256(MERKLE_LEAF_PREFIX)
+        leaf_hash.update(view[current_message[3]:end])
+        yield current_message[0], current_message[1], (current_message[2], end), current_message[3], end, leaf_hash.digest()
+
+def parse_mapped_chat(buffer, chat_format=None, progress=None):
+    """
+    Zero-copy counterpart of parse_chat_content for a chat text mapped in memory (see
+    MappedFile): same result, but the texts stay in the buffer (MappedTexts) and only the
+    first lines are decoded to detect the format.
+    """
+    if chat_format is None:
+        sample_end = 0
+        for _ in range(FORMAT_SAMPLE_LINES):
+            sample_end = buffer.find(b"\n", sample_end) + 1
+            if not sample_end:
+                sample_end = len(buffer)
+                break
+        chat_format = detect_chat_format(buffer[:sample_end].decode("utf-8", "replace").split("\n"))
+
+    messages = MessageStore(chat_format)
+    messages.texts = MappedTexts(buffer)
+    append_messages(messages, iter_mapped_messages(buffer, chat_format), progress)
+    return messages, messages.participants
+
+def parse_chat_stream(chat_stream, progress=None):
+    """
+    parse_chat_content for the chat text returned by open_chat_export, parsed in place with
+    parse_mapped_chat when it is a MappedFile (recognized by its map: a MappedFile kept in the
+    session state may come from an earlier run of the script, with an earlier MappedFile class).
+    """
+    if hasattr(chat_stream, "map"):
+        return parse_mapped_chat(chat_stream.map, progress=progress)
+    return parse_chat_content(chat_stream, progress=progress)
+
+# --- Árbol de Merkle de los mensajes ---
+# Prefijos de dominio de RFC 6962: distinguen el hash de una hoja del de un nodo interno
+MERKLE_LEAF_PREFIX = b"\x00"
+MERKLE_NODE_PREFIX = b"\x01"
+MERKLE_HASH_SIZE = 32
+
+def merkle_leaf_hash(message_bytes):
+    """
+    Leaf hash of a message: SHA256(0x00 || raw bytes of the message in the chat text).
+    """
+    return hashlib.sha256(MERKLE_LEAF_PREFIX + message_bytes).digest()
+
+def merkle_node_hash(left, right):
+    """
+    Hash of an inner node: SHA256(0x01 || left child || right child).
+    """
+    return hashlib.sha256(MERKLE_NODE_PREFIX + left + right).digest()
+
+class MerkleTree:
+    """
+    Merkle tree (RFC 6962 style, SHA256) over the leaf hashes of the messages, in chat order.
+    A node that is left without a pair at the end of a level is promoted unchanged to the next
+    one. The root commits to every message, and a single message can be proven to belong to
+    the chat with log2(n) sibling hashes instead of the whole file.
+    Each level is kept as one bytes object of concatenated 32-byte hashes.
+    base/shared_leaves: a tree whose first shared_leaves leaves are the same as these (e.g. the
+    one of an earlier export of the chat). Nodes that only cover those leaves are copied from
+    it instead of hashed again, so only the path of the new leaves is computed.
+    """
+    __slots__ = ("levels",)
+
+    def __init__(self, leaf_hashes, base=None, shared_leaves=0):
+        level = bytes(leaf_hashes)
+        self.levels = [level]
+        sha256 = hashlib.sha256
+        pair_size = 2 * MERKLE_HASH_SIZE
+        depth = 0
+        while len(level) > MERKLE_HASH_SIZE:
+            depth += 1
+            # Nodes of this level that only cover shared leaves (2**depth leaves per node)
+            reused = base.levels[depth][:(shared_leaves >> depth) * MERKLE_HASH_SIZE] if base is not None and depth < len(base.levels) else b""
+            # Both children are adjacent in the level, so each node hashes one slice of it
+            next_level = [reused] + [
+                sha256(MERKLE_NODE_PREFIX + level[offset:offset + pair_size]).digest()
+                for offset in range(2 * len(reused), len(level) - MERKLE_HASH_SIZE, pair_size)
+            ]
+            if len(level) // MERKLE_HASH_SIZE % 2:
+                next_level.append(level[-MERKLE_HASH_SIZE:])
+            level = b"".join(next_level)
+            self.levels.append(level)
+
+    @classmethod
+    def from_levels(cls, levels):
+        """Tree with already computed levels (leaves first), e.g. read from the ChatStore."""
+        tree = cls.__new__(cls)
+        tree.levels = levels
+        return tree
+
+    def __len__(self):
+        return len(self.levels[0]) // MERKLE_HASH_SIZE
+
+    @property
+    def root(self):
+        """
+        Root hash (32 bytes). An empty chat has the hash of the empty string as root.
+        """
+        return self.levels[-1] if self.levels[-1] else hashlib.sha256(b"").digest()
+
+    def proof(self, position):
+        """
+        Inclusion proof of the leaf at the given position: the sibling hashes from the leaf up to
+        the root, as a list of {"side": "left"|"right", "sha256": hex} (side of the sibling).
+        """
+        proof = []
+        for level in self.levels[:-1]:
+            sibling = position ^ 1
+            if sibling * MERKLE_HASH_SIZE < len(level):
+                proof.append({
+                    "side": "left" if sibling < position else "right",
+                    "sha256": level[sibling * MERKLE_HASH_SIZE:(sibling + 1) * MERKLE_HASH_SIZE].hex(),
+                })
+            position //= 2
+        return proof
+
+def verify_merkle_proof(leaf_hash, proof, root):
+    """
+    Recomputes the root from a leaf hash and its inclusion proof (see MerkleTree.proof) and
+    compares it with the expected root. leaf_hash and root are bytes.
+    """
+    node = leaf_hash
+    for step in proof:
+        sibling = bytes.fromhex(step["sha256"])
+        node = merkle_node_hash(sibling, node) if step["side"] == "left" else merkle_node_hash(node, sibling)
+    return node == root
+
+def build_message_proof(messages, merkle_tree, position, file_name, file_sha256, chat_member=None, encoding="utf-8"):
+    """
+    Inclusion proof of one message as a JSON-serializable dict: the message with its byte range
+    and leaf hash, the Merkle root of the chat and the sibling hashes up to it. Together with
+    the export file (identified by name and SHA256) it can be checked with "verify".
+    chat_member: for .zip exports, the chat file inside the archive the byte range refers to.
+    encoding: of the export; for "utf-16" the byte range refers to its UTF-8 conversion (see
+    MappedFile).
+    """
+    proof = {
+        "file": file_name,
+        "file_sha256": file_sha256,
+        "encoding": encoding,
+        "message_number": position + 1,
+        **messages.message(position),
+        "merkle_root": merkle_tree.root.hex(),
+        "leaf_count": len(merkle_tree),
+        "proof": merkle_tree.proof(position),
+    }
+    if chat_member is not None:
+        proof["chat_member"] = chat_member
+    return proof
+
+def verify_message_proof(proof, export_stream):
+    """
+    Checks a message proof (see build_message_proof) against an export, opened as ingestion
+    opens it (a MappedFile for a file on disk, so a UTF-16 export is read through its UTF-8
+    conversion); for a .zip export, the chat member named in the proof is read. Only the cited
+    bytes of the chat text are read and hashed, then the proof is walked up to the root.
+    Returns (leaf_matches, root_matches, encoding), encoding being that of the chat text read
+    (see chat_text_encoding). Raises KeyError if the archive lacks the chat member.
+    """
+    chat_stream, archive = open_chat_export(export_stream)
+    if archive is not None and "chat_member" in proof:
+        chat_stream = decode_chat_text(archive.zip_file.open(proof["chat_member"]), proof["chat_member"])
+    chat_stream.seek(proof["byte_start"])
+    leaf_hash = merkle_leaf_hash(chat_stream.read(proof["byte_end"] - proof["byte_start"]))
+    return (
+        leaf_hash.hex() == proof["leaf_sha256"],
+        verify_merkle_proof(leaf_hash, proof["proof"], bytes.fromhex(proof["merkle_root"])),
+        chat_text_encoding(chat_stream),
+    )
+
+# --- Comparación de exportaciones sucesivas del mismo chat ---
+# Cantidad máxima de diferencias que se muestran en la tabla (el JSON descargable tiene todas)
+DIFF_ROWS_LIMIT = 1000
+
+def shared_message_count(messages, chat_stream, text_sha256=None):
+    """
+    Counts the leading messages of an earlier export (messages) that are found unchanged, at
+    the same byte offsets, in the chat text of a later export (chat_stream). Only the leaf
+    hashes of those byte ranges are computed: nothing is decoded or parsed.
+    text_sha256: the SHA256 of the earlier chat text, if known (the file hash of a .txt export).
+    The common case, a later export that only adds messages, is then confirmed with a single
+    hash over the same number of bytes instead of one hash per message.
+    """
+    if text_sha256 is not None and len(messages):
+        # The last message ends where the chat text ends
+        remaining = messages.byte_ends[-1]
+        prefix_hasher = hashlib.sha256()
+        while remaining:
+            chunk = chat_stream.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            prefix_hasher.update(chunk)
+            remaining -= len(chunk)
+        if not remaining and prefix_hasher.hexdigest() == text_sha256:
+            return len(messages)
+        chat_stream.seek(0)
+    byte_starts = messages.byte_starts
+    byte_ends = messages.byte_ends
+    leaf_hashes = messages.leaf_hashes
+    sha256 = hashlib.sha256
+    buffer = bytearray()
+    buffer_start = 0
+    for position in range(len(messages)):
+        start = byte_starts[position]
+        end = byte_ends[position]
+        # Drop the bytes of the messages already checked
+        if start - buffer_start > CHUNK_SIZE:
+            del buffer[:start - buffer_start]
+            buffer_start = start
+        while buffer_start + len(buffer) < end:
+            chunk = chat_stream.read(CHUNK_SIZE)
+            if not chunk:
+                return position
+            buffer += chunk
+        leaf_offset = position * MERKLE_HASH_SIZE
+        if sha256(MERKLE_LEAF_PREFIX + buffer[start - buffer_start:end - buffer_start]).digest() != leaf_hashes[leaf_offset:leaf_offset + MERKLE_HASH_SIZE]:
+            return position
+    return len(messages)
+
+def update_chat_content(base_messages, chat_stream, base_text_sha256=None, progress=None):
+    """
+    Parses a later export of the chat of base_messages (an earlier export) reusing their shared
+    prefix: the leading messages found unchanged are copied and only the rest of the file is
+    parsed. Returns (messages, start): the MessageStore of the later export and the number of
+    leading messages taken from base_messages.
+    base_text_sha256: the SHA256 of the earlier chat text, if known (see shared_message_count).
+    progress: as in parse_chat_content, for the parsed part.
+    """
+    shared = shared_message_count(base_messages, chat_stream, base_text_sha256)
+    # The last shared message is parsed again: in the later export it may go on with more lines
+    start = max(shared - 1, 0)
+    chat_stream.seek(base_messages.byte_starts[start] if start else 0)
+    if not start:
+        return parse_chat_content(chat_stream, progress=progress)[0], 0
+    messages = base_messages.prefix(start)
+    append_messages(messages, iter_chat_messages(iter_chat_lines(chat_stream), messages.chat_format, base_messages.byte_starts[start]), progress)
+    return messages, start
+
+def diff_chat_messages(old_messages, new_messages, start=0):
+    """
+    Compares two exports of the same chat message by message, by their leaf hashes, from
+    position start on (the messages before it are known to be the same in both).
+    Returns a list of (change, old_position, new_position), change being "added", "missing" or
+    "altered"; the position is None on the side where the message does not exist.
+    """
+    old_leaves = [old_messages.leaf_hash(position) for position in range(start, len(old_messages))]
+    new_leaves = [new_messages.leaf_hash(position) for position in range(start, len(new_messages))]
+    changes = []
+    matcher = difflib.SequenceMatcher(None, old_leaves, new_leaves, autojunk=False)
+    for tag, old_first, old_last, new_first, new_last in matcher.get_opcodes():
+        if tag == "equal":
+            continue
+        # Replaced blocks are paired one to one as altered messages, the rest are missing or added
+        paired = min(old_last - old_first, new_last - new_first) if tag == "replace" else 0
+        for offset in range(paired):
+            changes.append(("altered", start + old_first + offset, start + new_first + offset))
+        for old_position in range(old_first + paired, old_last):
+            changes.append(("missing", start + old_position, None))
+        for new_position in range(new_first + paired, new_last):
+            changes.append(("added", None, start + new_position))
+    return changes
+
+def diff_record(change, old_messages, new_messages):
+    """
+    One change of diff_chat_messages as a dict (numbers are 1-based, as shown in the viewer).
+    """
+    kind, old_position, new_position = change
+    message = new_messages.message(new_position) if new_position is not None else old_messages.message(old_position)
+    record = {
+        "change": kind,
+        "old_number": None if old_position is None else old_position + 1,
+        "new_number": None if new_position is None else new_position + 1,
+        **message,
+    }
+    if kind == "altered":
+        record["old_text"] = old_messages.texts[old_position]
+    return record
+
+@st.cache_resource(max_entries=INGEST_CACHE_MAX_ENTRIES)
+def diff_rows(sha256_hash, base_sha256_hash, _changes, _old_messages, _new_messages):
+    """
+    diff_record of the first DIFF_ROWS_LIMIT changes of a comparison (the rows of its table),
+    once per pair of file hashes: the other changes are not built on every rerun.
+    """
+    return [diff_record(change, _old_messages, _new_messages) for change in _changes[:DIFF_ROWS_LIMIT]]
+
+@st.cache_resource(max_entries=INGEST_CACHE_MAX_ENTRIES, show_spinner=False)
+def diff_json(sha256_hash, base_sha256_hash, _changes, _old_messages, _new_messages):
+    """Every change of a comparison as a JSON list of diff_record, once per pair of file hashes."""
+    records = [diff_record(change, _old_messages, _new_messages) for change in _changes]
+    return json.dumps(records, ensure_ascii=False, indent=2)
+
+def _build_accent_table():
+    """
+    Builds the str.translate table that removes accents and diaeresis (á -> a, ü -> u). Ñ is a
+    letter of its own in Spanish, not an accented n, so it is kept ("año" is not "ano").
+    Only one-to-one replacements are kept, so normalized text has the same length as the original.
+    """
+    table = {}
+    for code in range(0xC0, 0x250):
+        char = chr(code)
+        if char in "ñÑ":
+            continue
+        base = "".join(c for c in unicodedata.normalize("NFD", char) if not unicodedata.combining(c))
+        if len(base) == 1 and base != char:
+            table[code] = base
+    return table
+
+_ACCENT_TABLE = _build_accent_table()
+TOKEN_REGEX = re.compile(r"\w+")
+# Frases entre comillas dentro de una búsqueda
+_QUOTED_PHRASE_REGEX = re.compile(r'"([^"]*)"')
+
+def _build_accent_variants():
+    """
+    Maps each base letter to a regex character class with its accented variants ("a" -> "[aáàâä...]").
+    """
+    variants = {}
+    for code, base in _ACCENT_TABLE.items():
+        variants.setdefault(base, [base]).append(chr(code))
+    return {base: "[" + "".join(chars) + "]" for base, chars in variants.items()}
+
+_ACCENT_VARIANTS = _build_accent_variants()
+
+def normalize_search_text(text):
+    """
+    Lower-cases text and removes accents, for accent-insensitive search in Spanish.
+    """
+    text = text.lower()
+    return text if text.isascii() else text.translate(_ACCENT_TABLE)
+
+def parse_search_query(query):
+    """
+    Splits a search query into terms. Each term is a list of normalized tokens plus a prefix flag:
+    quoted text ("transferencia bancaria") and words made of several tokens (1.500,50 or
+    381-555-1234) are phrases, and a single word ending in * matches every token starting with it.
+    """
+    terms = []
+    for phrase in _QUOTED_PHRASE_REGEX.findall(query):
+        tokens = TOKEN_REGEX.findall(normalize_search_text(phrase))
+        if tokens:
+            terms.append((tokens, False))
+    for word in _QUOTED_PHRASE_REGEX.sub(" ", query).split():
+        tokens = TOKEN_REGEX.findall(normalize_search_text(word))
+        if tokens:
+            terms.append((tokens, word.endswith("*") and len(tokens) == 1))
+    return terms
+
+def search_terms_regex(terms):
+    """
+    Compiles a regex that finds any of the parsed search terms directly in the original text,
+    ignoring case and accents. Tokens of a phrase may be separated by any non-word characters
+    (spaces, dots, dashes...) except NUL, which SearchIndex uses to separate messages.
+    """
+    alternatives = []
+    for tokens, prefix in terms:
+        token_patterns = ["".join(_ACCENT_VARIANTS.get(char, re.escape(char)) for char in token) for token in tokens]
+        alternatives.append(r"[^\w\x00]+".join(token_patterns) + (r"\w*" if prefix else ""))
+    return re.compile(r"(?<!\w)(?:" + "|".join(alternatives) + r")(?!\w)", re.IGNORECASE)
+
+class SearchIndex:
+    """
+    Inverted index over the texts of a MessageStore, built once at ingestion.
+    It maps each normalized token to the ascending positions of the messages that contain it,
+    so a query only intersects a few position arrays and checks phrases on the candidates.
+    """
+    __slots__ = ("messages", "postings", "_sorted_tokens")
+
+    def __init__(self, messages):
+        self.messages = messages
+        self.postings = {}
+        self._sorted_tokens = None
+
+    @classmethod
+    def build(cls, messages, progress=None):
+        """
+        Indexes every message. progress: optional callable(messages_indexed), called every
+        PROGRESS_INTERVAL messages.
+        """
+        index = cls(messages)
+        for position, text in enumerate(messages.texts):
+            index.add(position, text)
+            if progress is not None and position % PROGRESS_INTERVAL == 0:
+                progress(position)
+        return index
+
+    @classmethod
+    def extend_from(cls, base, messages, start):
+        """
+        Index of a MessageStore whose first start messages are those of base's one (see
+        update_chat_content): their postings are copied and only the rest is indexed.
+        """
+        index = cls(messages)
+        postings = index.postings
+        for token, positions in base.postings.items():
+            if positions[-1] < start:
+                postings[token] = positions[:]
+            else:
+                cut = bisect.bisect_left(positions, start)
+                if cut:
+                    postings[token] = positions[:cut]
+        texts = messages.texts
+        for position in range(start, len(messages)):
+            index.add(position, texts[position])
+        return index
+
+    def add(self, position, text):
+        """Indexes one message. Positions must be added in ascending order."""
+        postings = self.postings
+        # Accents are removed per distinct token, which is much cheaper than per character
+        tokens = {token if token.isascii() else token.translate(_ACCENT_TABLE) for token in TOKEN_REGEX.findall(text.lower())}
+        for token in tokens:
+            positions = postings.get(token)
+            if positions is None:
+                positions = postings[token] = array("I")
+            positions.append(position)
+        self._sorted_tokens = None
+
+    def _prefix_positions(self, prefix):
+        """Returns the ascending positions of the messages with a token that starts with prefix."""
+        if self._sorted_tokens is None:
+            self._sorted_tokens = sorted(self.postings)
+        tokens = self._sorted_tokens
+        matches = set()
+        for i in range(bisect.bisect_left(tokens, prefix), len(tokens)):
+            if not tokens[i].startswith(prefix):
+                break
+            matches.update(self.postings[tokens[i]])
+        return array("I", sorted(matches))
+
+    def search(self, query, sender_id=None, start_timestamp=None, end_timestamp=None):
+        """
+        Returns the ascending positions of the messages that contain every term of the query,
+        optionally only from one sender and within [start_timestamp, end_timestamp).
+        """
+        terms = parse_search_query(query)
+        if not terms:
+            return []
+        position_lists = []
+        for tokens, prefix in terms:
+            for token in tokens:
+                positions = self._prefix_positions(token) if prefix else self.postings.get(token)
+                if not positions:
+                    return []
+                position_lists.append(positions)
+        position_lists.sort(key=len)
+        candidates = position_lists[0]
+        if len(position_lists) > 1:
+            matching = set(candidates)
+            for positions in position_lists[1:]:
+                matching.intersection_update(positions)
+            candidates = sorted(matching)
+
+        messages = self.messages
+        if sender_id is not None:
+            sender_ids = messages.sender_ids
+            candidates = [p for p in candidates if sender_ids[p] == sender_id]
+        if start_timestamp is not None:
+            timestamps = messages.timestamps
+            candidates = [p for p in candidates if timestamps[p] >= start_timestamp]
+        if end_timestamp is not None:
+            timestamps = messages.timestamps
+            candidates = [p for p in candidates if timestamps[p] < end_timestamp]
+        phrase_terms = [term for term in terms if len(term[0]) > 1]
+        if phrase_terms and candidates:
+            # The index only knows tokens: phrases are checked on the candidate texts, joined
+            # with NUL separators so each phrase regex scans all of them in a single pass
+            candidate_texts = messages.texts_at(candidates)
+            joined = "\x00".join(candidate_texts)
+            starts = list(itertools.accumulate((len(text) + 1 for text in candidate_texts), initial=0))
+            matching = None
+            for term in phrase_terms:
+                found = {bisect.bisect_right(starts, match.start()) - 1 for match in search_terms_regex([term]).finditer(joined)}
+                matching = found if matching is None else matching & found
+            candidates = [candidates[i] for i in sorted(matching)]
+        return list(candidates)
+
+def build_search_snippet(text, terms_regex, context=60):
+    """
+    Returns an HTML snippet of a message around the first match, with every match in <mark>.
+    """
+    first = terms_regex.search(text)
+    start = max(0, first.start() - context) if first else 0
+    end = min(len(text), (first.end() if first else 0) + context)
+    parts = ["…" if start > 0 else ""]
+    cursor = start
+    for match in terms_regex.finditer(text, start, end):
+        parts.append(html.escape(text[cursor:match.start()]))
+        parts.append("<mark>" + html.escape(match.group()) + "</mark>")
+        cursor = match.end()
+    parts.append(html.escape(text[cursor:end]))
+    parts.append("…" if end < len(text) else "")
+    return "".join(parts).replace("\n", " ")
+
+class MultiHasher:
+    """
+    Computes several digests over a single read of the data.
+    With more than one algorithm, each digest runs in its own thread fed through a small
+    bounded queue: hashlib releases the GIL while hashing large buffers, so the digests run
+    in parallel with each other and with the reading of the next chunk.
+    """
+    # Chunks waiting per algorithm (bounds the memory used while a digest falls behind)
+    QUEUE_SIZE = 4
+
+    def __init__(self, algorithms=DEFAULT_HASH_ALGORITHMS):
+        self._hashers = {name: hashlib.new(name) for name in algorithms}
+        self._queues = []
+        self._threads = []
+        if len(self._hashers) > 1:
+            for hasher in self._hashers.values():
+                chunks = queue.Queue(self.QUEUE_SIZE)
+                thread = threading.Thread(target=self._consume, args=(hasher, chunks), daemon=True)
+                thread.start()
+                self._queues.append(chunks)
+                self._threads.append(thread)
+
+    @staticmethod
+    def _consume(hasher, chunks):
+        for chunk in iter(chunks.get, None):
+            hasher.update(chunk)
+
+    def update(self, chunk):
+        """Feeds a chunk (bytes or any read-only buffer) to every digest."""
+        if self._queues:
+            for chunks in self._queues:
+                chunks.put(chunk)
+        else:
+            for hasher in self._hashers.values():
+                hasher.update(chunk)
+
+    def close(self):
+        """Stops the digest threads once they have consumed the queued chunks."""
+        for chunks in self._queues:
+            chunks.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._queues = []
+        self._threads = []
+
+    def hexdigests(self):
+        """Waits for every digest to finish and returns them as {algorithm: hex digest}."""
+        self.close()
+        return {name: hasher.hexdigest() for name, hasher in self._hashers.items()}
+
+def compute_file_hashes(stream, algorithms=DEFAULT_HASH_ALGORITHMS, progress=None):
+    """
+    Calculates the selected hashes of a binary stream in a single chunked read, so the file is
+    never fully copied in memory. SHA256 is always included, since it identifies the file in the
+    caches. Returns a dict {algorithm: hex digest}, algorithm being the hashlib name ("sha256", ...).
+    The position of an in-memory upload or a MappedFile is left untouched.
+    progress: optional callable(bytes_read), called after each chunk.
+    """
+    hasher = MultiHasher(dict.fromkeys(("sha256",) + tuple(algorithms)))
+    if hasattr(stream, "original") or hasattr(stream, "getvalue"):
+        # A MappedFile (its mapped pages) or an in-memory upload: hashed in place, without copying
+        # it into chunks nor moving its position, so an ingestion can read it at the same time.
+        # getvalue() returns the bytes the upload was made from; getbuffer() would copy them
+        view = memoryview(stream.original if hasattr(stream, "original") else stream.getvalue())
+        chunks = (view[start:start + CHUNK_SIZE] for start in range(0, len(view), CHUNK_SIZE))
+    else:
+        stream.seek(0)
+        chunks = iter(lambda: stream.read(CHUNK_SIZE), b"")
+    bytes_read = 0
+    try:
+        for chunk in chunks:
+            hasher.update(chunk)
+            bytes_read += len(chunk)
+            if progress is not None:
+                progress(bytes_read)
+    finally:
+        # Also when progress raises (a cancelled ingestion): no digest thread is left waiting
+        hasher.close()
+    return hasher.hexdigests()
+
+# Lado mayor (en píxeles) de las miniaturas de imágenes adjuntas
+THUMBNAIL_SIZE = 240
+
+class ChatArchive:
+    """
+    Attachments of a WhatsApp .zip export, read straight from the archive when needed.
+    Ingestion only reads the zip's central directory and streams the chat text out of it:
+    nothing is extracted to disk. Attachments are indexed by file name and linked to the
+    messages that mention them; then close() drops the zip, so the ingested chat kept in the
+    caches holds only this metadata, not the upload. To read attachments again, a session
+    uses reading(its upload): an attachment is hashed when its message is on the visible page
+    (or by hash_attachments, after the chat is shown) and an image is turned into a thumbnail
+    only then. The SHA256 go to digests, by (sha256 of the export, name), a dict that may be
+    shared by every archive of the same export.
+    """
+    IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif", ".webp")
+
+    def __init__(self, zip_file, chat_member):
+        self.zip_file = zip_file
+        self.chat_member = chat_member
+        self.members = {
+            posixpath.basename(info.filename): info
+            for info in zip_file.infolist()
+            if not info.is_dir() and info.filename != chat_member.filename
+        }
+        # Position of a message -> name of the attachment it mentions
+        self.by_position = {}
+        # SHA256 of the export (set by ingestion) and {(sha256, name): SHA256 of the attachment}
+        self.sha256 = None
+        self.digests = {}
+        self._thumbnails = {}
+
+    def link_messages(self, messages):
+        """
+        Finds, once, which messages mention a file that is present in the archive (only the
+        attachments, contacts and links can: a link may come before the file name).
+        """
+        members = self.members
+        search = ATTACHMENT_REGEX.search
+        positions = sorted(itertools.chain(*(messages.type_positions[message_type] for message_type in (ATTACHMENT_MESSAGE, CONTACT_MESSAGE, LINK_MESSAGE))))
+        for position, text in zip(positions, messages.texts_at(positions)):
+            match = search(text)
+            if match:
+                name = (match.group(1) or match.group(2)).strip()
+                if name in members:
+                    self.by_position[position] = name
+
+    def _hash_member(self, name):
+        sha256 = hashlib.sha256()
+        with self.zip_file.open(self.members[name]) as member:
+            for chunk in iter(lambda: member.read(CHUNK_SIZE), b""):
+                sha256.update(chunk)
+        self.digests[self.sha256, name] = digest = sha256.hexdigest()
+        return digest
+
+    def hash_attachments(self):
+        """Computes the SHA256 of the attachments not hashed yet, in one pass over the archive."""
+        for name in self.members:
+            if (self.sha256, name) not in self.digests:
+                self._hash_member(name)
+
+    def digest(self, name):
+        """
+        SHA256 of an attachment: hashed now if it was not yet, or None if the archive is closed.
+        """
+        digest = self.digests.get((self.sha256, name))
+        if digest is None and self.zip_file is not None:
+            digest = self._hash_member(name)
+        return digest
+
+    def known_digests(self):
+        """{name: SHA256} of the attachments hashed so far."""
+        return {name: self.digests[self.sha256, name] for name in self.members if (self.sha256, name) in self.digests}
+
+    def close(self):
+        """Drops the zip (and with it the upload): the metadata and digests stay."""
+        self.zip_file = None
+
+    def reading(self, stream):
+        """
+        This archive, reading its attachments from stream (an upload of the same export, read
+        through upload_reader, so other threads can read it meanwhile) instead of the dropped
+        zip. The metadata, digests and thumbnails are shared.
+        """
+        reader = copy.copy(self)
+        reader.zip_file = zipfile.ZipFile(upload_reader(stream))
+        return reader
+
+    def thumbnail(self, name):
+        """
+        Returns a data: URI with a JPEG thumbnail of an image attachment, or None if it is not
+        an image, Pillow is not available or the archive is closed.
+        """
+        if not name.lower().endswith(self.IMAGE_EXTENSIONS):
+            return None
+        if name not in self._thumbnails:
+            if self.zip_file is None:
+                return None
+            try:
+                from PIL import Image
+            except ImportError:
+                return None
+            try:
+                with self.zip_file.open(self.members[name]) as member:
+                    image = Image.open(io.BytesIO(member.read()))
+                    image.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+                    output = io.BytesIO()
+                    image.convert("RGB").save(output, format="JPEG", quality=75)
+                self._thumbnails[name] = "data:image/jpeg;base64," + base64.b64encode(output.getvalue()).decode("ascii")
+            except Exception:
+                # A damaged image is shown as a plain attachment
+                self._thumbnails[name] = None
+        return self._thumbnails[name]
+
+# Marcas de orden de bytes con las que empieza una exportación en UTF-16
+UTF16_BOMS = (codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)
+
+class MappedFile:
+    """
+    A chat export already on the server (e.g. in the case share), mapped in memory with mmap
+    instead of read: the hashes (compute_file_hashes) and the parsing (parse_mapped_chat) work
+    on the mapped pages, so ingesting it adds little more than the parsed columns to the memory
+    in use. It is also a read-only binary file (read/seek/tell, name, size and file_id like an
+    upload), for the .zip exports and the comparison with an earlier export.
+    A UTF-16 export (detected by its byte order mark) is converted once to UTF-8 in an anonymous
+    temporary file, mapped in turn: map (the chat text) is then the conversion, and its byte
+    offsets refer to it, while original (the hashed bytes) is still the file as is.
+    """
+    def __init__(self, path):
+        self.name = os.path.basename(path)
+        status = os.stat(path)
+        self.size = status.st_size
+        self.file_id = f"{os.path.abspath(path)}:{status.st_size}:{status.st_mtime_ns}"
+        with open(path, "rb") as mapped_file:
+            self.original = self._map(mapped_file)
+        self.utf16 = self.original[:2] in UTF16_BOMS
+        if self.utf16:
+            view = memoryview(self.original)
+            self.map = self._transcode_utf16(view[start:start + CHUNK_SIZE] for start in range(0, len(view), CHUNK_SIZE))
+        else:
+            self.map = self.original
+        self.position = 0
+
+    @staticmethod
+    def _map(mapped_file):
+        # An empty file cannot be mapped
+        if os.fstat(mapped_file.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(mapped_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @classmethod
+    def _transcode_utf16(cls, chunks):
+        decoder = codecs.getincrementaldecoder("utf-16")()
+        with tempfile.TemporaryFile() as converted:
+            for chunk in chunks:
+                converted.write(decoder.decode(chunk).encode("utf-8"))
+            converted.write(decoder.decode(b"", final=True).encode("utf-8"))
+            converted.flush()
+            return cls._map(converted)
+
+    def read(self, size=-1):
+        end = len(self.map) if size is None or size < 0 else self.position + size
+        data = self.map[self.position:end]
+        self.position += len(data)
+        return data
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += len(self.map)
+        self.position = max(offset, 0)
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def seekable(self):
+        return True
+
+    def close(self):
+        for mapped in {id(self.original): self.original, id(self.map): self.map}.values():
+            if isinstance(mapped, mmap.mmap):
+                mapped.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class Utf16ChatText(MappedFile):
+    """
+    The chat text of a UTF-16 export that is not mapped from disk (an upload, or the chat of a
+    .zip export), read like the map of a UTF-16 MappedFile: converted to UTF-8 in an anonymous
+    temporary file and mapped, the same conversion with the same byte offsets. The conversion is
+    made when the text is first read, so a chat reopened from the store is not converted.
+    """
+    utf16 = True
+
+    def __init__(self, stream, name):
+        self.name = name
+        self.stream = stream
+        self.position = 0
+        self._converted = None
+
+    @property
+    def map(self):
+        if self._converted is None:
+            self.stream.seek(0)
+            self._converted = self._transcode_utf16(iter(lambda: self.stream.read(CHUNK_SIZE), b""))
+            self.stream = None
+        return self._converted
+
+    def close(self):
+        if isinstance(self._converted, mmap.mmap):
+            self._converted.close()
+
+def upload_reader(upload):
+    """
+    A stream over the bytes of an upload (an in-memory upload or a MappedFile) with a position
+    of its own, so that two threads can read it at once. Nothing is copied: an in-memory upload
+    shares the bytes it was made from (see compute_file_hashes) and a MappedFile its map.
+    """
+    if hasattr(upload, "map"):
+        reader = copy.copy(upload)
+        reader.position = 0
+        return reader
+    return io.BytesIO(upload.getvalue())
+
+def list_case_files(directory):
+    """Chat exports (.txt and .zip) under a server directory, as paths relative to it."""
+    case_files = []
+    for root, _, names in os.walk(directory):
+        case_files.extend(
+            os.path.relpath(os.path.join(root, name), directory)
+            for name in names if name.lower().endswith(EXPORT_EXTENSIONS)
+        )
+    return sorted(case_files)
+
+def decode_chat_text(chat_stream, name):
+    """
+    The chat text to parse for chat_stream: itself, or a Utf16ChatText when it starts with a
+    UTF-16 byte order mark (a MappedFile has already converted its own).
+    """
+    if getattr(chat_stream, "utf16", False):
+        return chat_stream
+    is_utf16 = chat_stream.read(2) in UTF16_BOMS
+    chat_stream.seek(0)
+    return Utf16ChatText(chat_stream, name) if is_utf16 else chat_stream
+
+def open_chat_export(stream):
+    """
+    Returns (chat_stream, archive) for an uploaded export. For a .zip export, the chat text is
+    streamed out of the archive (the member named _chat.txt, or else the largest .txt file) and
+    archive is a ChatArchive with its attachments. For a plain .txt export, archive is None.
+    A UTF-16 chat text is read through its UTF-8 conversion (see decode_chat_text).
+    """
+    stream.seek(0)
+    if not zipfile.is_zipfile(stream):
+        stream.seek(0)
+        return decode_chat_text(stream, getattr(stream, "name", None)), None
+    zip_file = zipfile.ZipFile(stream)
+    text_members = [info for info in zip_file.infolist() if info.filename.lower().endswith(".txt")]
+    if not text_members:
+        return io.BytesIO(b""), None
+    chat_member = max(text_members, key=lambda info: (posixpath.basename(info.filename) == "_chat.txt", info.file_size))
+    return decode_chat_text(zip_file.open(chat_member), chat_member.filename), ChatArchive(zip_file, chat_member)
+
+def chat_text_encoding(chat_stream):
+    """Encoding of the export of a chat text returned by open_chat_export: "utf-16" or "utf-8"."""
+    return "utf-16" if getattr(chat_stream, "utf16", False) else "utf-8"
+
+# --- Estadísticas de actividad ---
+# Tramos de la distribución de tiempos de respuesta (límite superior en segundos, nombre visible)
+RESPONSE_TIME_BUCKETS = (
+    (60, "< 1 min"),
+    (5 * 60, "1–5 min"),
+    (30 * 60, "5–30 min"),
+    (3600, "30–60 min"),
+    (6 * 3600, "1–6 h"),
+    (SECONDS_PER_DAY, "6–24 h"),
+    (None, "> 1 día"),
+)
+# Cantidad de silencios más largos que se informan
+ACTIVITY_GAPS_SHOWN = 10
+WEEKDAY_NAMES = ("Lunes", "Martes", "Miércoles", "Jueves", "Viernes", "Sábado", "Domingo")
+
+def compute_chat_analytics(messages):
+    """
+    Activity statistics of a chat, computed with vectorized NumPy operations over the timestamp
+    and sender columns of its MessageStore (read in place, without copying them). Returns a dict:
+    "per_sender": messages of each sender ID ("Sistema" included),
+    "active_days": days with messages,
+    "heatmap": 7×24 message counts by weekday (Monday first) and hour of the day,
+    "response_counts": senders × RESPONSE_TIME_BUCKETS counts of the response times of each sender,
+    "response_medians", "response_p90": median and 90th percentile (nearest rank) of the response
+    times of each sender, in seconds (NaN for senders without responses),
+    "gaps": the ACTIVITY_GAPS_SHOWN longest silences between consecutive messages, longest first,
+    as (position of the message before, position of the message after, seconds).
+    A response is a message whose previous participant message (system messages are skipped) is
+    from someone else, and its response time is the time since that message.
+    """
+    timestamps = np.frombuffer(messages.timestamps, dtype=np.int64)
+    sender_ids = np.frombuffer(messages.sender_ids, dtype=np.uint32).astype(np.int64)
+    sender_count = len(messages.senders)
+
+    days = timestamps // SECONDS_PER_DAY
+    # 1/1/1970 (day 0) was a Thursday
+    weekdays = (days + 3) % 7
+    hours = timestamps % SECONDS_PER_DAY // 3600
+    heatmap = np.bincount(weekdays * 24 + hours, minlength=7 * 24).reshape(7, 24)
+
+    participant = sender_ids != MessageStore.SYSTEM_SENDER_ID
+    participant_times = timestamps[participant]
+    participant_senders = sender_ids[participant]
+    answers = np.flatnonzero(participant_senders[1:] != participant_senders[:-1]) + 1
+    delays = participant_times[answers] - participant_times[answers - 1]
+    responders = participant_senders[answers]
+    # Out-of-order messages have no response time
+    in_order = delays >= 0
+    delays = delays[in_order]
+    responders = responders[in_order]
+    bucket_limits = np.array([limit for limit, _ in RESPONSE_TIME_BUCKETS[:-1]])
+    buckets = np.searchsorted(bucket_limits, delays, side="right")
+    bucket_count = len(RESPONSE_TIME_BUCKETS)
+    response_counts = np.bincount(responders * bucket_count + buckets, minlength=sender_count * bucket_count).reshape(sender_count, bucket_count)
+
+    # Percentiles of each sender, from the delays sorted by sender and then by delay
+    sorted_delays = delays[np.lexsort((delays, responders))]
+    counts = np.bincount(responders, minlength=sender_count)
+    starts = np.cumsum(counts) - counts
+    answered = counts > 0
+    response_medians = np.full(sender_count, np.nan)
+    response_p90 = np.full(sender_count, np.nan)
+    response_medians[answered] = sorted_delays[starts[answered] + (counts[answered] - 1) // 2]
+    response_p90[answered] = sorted_delays[starts[answered] + np.ceil(counts[answered] * 0.9).astype(np.int64) - 1]
+
+    intervals = np.diff(timestamps)
+    gap_count = min(ACTIVITY_GAPS_SHOWN, len(intervals))
+    longest = np.argpartition(intervals, -gap_count)[-gap_count:] if gap_count else np.empty(0, dtype=np.int64)
+    longest = longest[np.argsort(intervals[longest], kind="stable")[::-1]]
+
+    return {
+        "per_sender": np.bincount(sender_ids, minlength=sender_count),
+        "active_days": len(np.unique(days)),
+        "heatmap": heatmap,
+        "response_counts": response_counts,
+        "response_medians": response_medians,
+        "response_p90": response_p90,
+        "gaps": [(int(position), int(position) + 1, int(intervals[position])) for position in longest],
+    }
+
+@st.cache_resource(max_entries=INGEST_CACHE_MAX_ENTRIES, show_spinner="Calculando estadísticas...")
+def chat_analytics(sha256_hash, _messages):
+    """compute_chat_analytics of an ingested chat, once per file hash."""
+    return compute_chat_analytics(_messages)
+
+def format_duration(seconds):
+    """
+    Formats a duration in seconds with its two largest units: "2 d 5 h", "3 h 12 min", "4 min",
+    "35 s" ("—" for NaN).
+    """
+    if seconds != seconds:
+        return "—"
+    days, seconds = divmod(int(seconds), SECONDS_PER_DAY)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    units = [(days, "d"), (hours, "h"), (minutes, "min"), (seconds, "s")]
+    first = next((index for index, (amount, _) in enumerate(units) if amount), len(units) - 1)
+    return " ".join(f"{amount} {unit}" for amount, unit in units[first:first + 2] if amount) or "0 s"
+
+def build_activity_heatmap_html(heatmap):
+    """
+    HTML table of the weekday × hour message counts of compute_chat_analytics, each cell shaded
+    in proportion to the busiest one.
+    """
+    busiest = max(int(heatmap.max()), 1)
+    rows = ['<table class="activity-heatmap"><tr><th></th>' + "".join(f"<th>{hour}</th>" for hour in range(24)) + "</tr>"]
+    for weekday, counts in zip(WEEKDAY_NAMES, heatmap.tolist()):
+        cells = "".join(
+            f'<td style="background: rgba(37, 211, 102, {count / busiest:.2f})" title="{weekday} {hour}:00–{hour}:59: {count} mensajes">{count or ""}</td>'
+            for hour, count in enumerate(counts)
+        )
+        rows.append(f"<tr><th>{weekday}</th>{cells}</tr>")
+    rows.append("</table>")
+    return "".join(rows)
+
+# --- Medición de tiempos por fase ---
+# Cada fase medida se registra como una línea JSON en stderr (nivel INFO, que se cambia con la
+# variable de entorno WHATSAPP_LOG_LEVEL, p. ej. WARNING para no registrarlas)
+TIMING_LOGGER = logging.getLogger("visualizador_whatsapp.timing")
+if not TIMING_LOGGER.handlers:
+    # The logger outlives the reruns of the script: one handler only
+    _timing_handler = logging.StreamHandler()
+    _timing_handler.setFormatter(logging.Formatter("%(asctime)s %(name)s %(message)s"))
+    TIMING_LOGGER.addHandler(_timing_handler)
+    TIMING_LOGGER.propagate = False
+TIMING_LOGGER.setLevel(os.environ.get("WHATSAPP_LOG_LEVEL", "INFO").upper())
+
+def _memory_in_use():
+    """Resident memory of the process in bytes, or None where /proc is not available."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+class PhaseTimings:
+    """
+    Wall time and memory of the phases of a rerun of the app or of an ingestion.
+    start(phase, **details) ends the running phase, if any, and starts the next one; stop()
+    ends the running one. Each ended phase is appended to records and logged as one JSON line:
+    the context (scope and the keyword arguments, e.g. file), the phase and its details,
+    seconds, and the resident memory of the process at its end and its change (MiB).
+    traced is set only for the rerun that holds profiling_lock with tracemalloc on (see
+    run_app): its phases also get the traced allocations kept and the peak reached during the
+    phase, measured from the start of the phase. tracemalloc is process-wide, so no other
+    PhaseTimings touches it.
+    """
+    def __init__(self, scope, **context):
+        self.context = {"scope": scope, **context}
+        self.records = []
+        self.phase = None
+        self.traced = False
+
+    def start(self, phase, **details):
+        self.stop()
+        self.phase = phase
+        self._details = details
+        self._memory = _memory_in_use()
+        if self.traced:
+            tracemalloc.reset_peak()
+            self._traced = tracemalloc.get_traced_memory()[0]
+        self._started = time.perf_counter()
+
+    def stop(self):
+        if self.phase is None:
+            return
+        seconds = time.perf_counter() - self._started
+        memory = _memory_in_use()
+        record = {**self.context, "phase": self.phase, **self._details, "seconds": round(seconds, 6)}
+        if memory is not None:
+            record["rss_mib"] = round(memory / 1048576, 1)
+            if self._memory is not None:
+                record["rss_delta_mib"] = round((memory - self._memory) / 1048576, 1)
+        if self.traced:
+            traced, traced_peak = tracemalloc.get_traced_memory()
+            record["traced_mib"] = round((traced - self._traced) / 1048576, 1)
+            record["traced_peak_mib"] = round((traced_peak - self._traced) / 1048576, 1)
+        self.records.append(record)
+        self.phase = None
+        TIMING_LOGGER.info(json.dumps(record, ensure_ascii=False))
+
+    def total(self):
+        return sum(record["seconds"] for record in self.records)
+
+@st.cache_resource
+def profiling_lock():
+    """
+    Lock held by the rerun being profiled (see run_app), shared by every session: cProfile and
+    tracemalloc are process-wide, so only one rerun at a time is profiled.
+    """
+    return threading.Lock()
+
+def debug_panel_enabled():
+    """Whether this page shows the performance panel (see DEBUG_PANEL and DEBUG_TOKEN)."""
+    if DEBUG_PANEL:
+        return True
+    token = st.query_params.get("debug")
+    return bool(DEBUG_TOKEN) and token is not None and hmac.compare_digest(token.encode("utf-8"), DEBUG_TOKEN.encode("utf-8"))
+
+def build_profile_report(profiler, snapshot, timings):
+    """
+    Downloadable report of a profiled rerun: the cProfile statistics in the binary format of
+    pstats ("prof", e.g. for snakeviz or pstats.Stats), and a text summary ("text") with the
+    phase timings, the PROFILE_REPORT_LINES functions of largest cumulative time and the source
+    lines that allocated the most memory still in use at the end (tracemalloc snapshot).
+    """
+    created = datetime.datetime.now()
+    text = io.StringIO()
+    text.write(f"Re-ejecución perfilada: {created:%Y-%m-%d %H:%M:%S}\n\n")
+    for record in timings.records:
+        text.write(
+            f"{record['phase']:<20} {record['seconds']:10.3f} s  {record.get('traced_mib', 0):9.1f} MiB asignados"
+            f"  {record.get('traced_peak_mib', 0):9.1f} MiB (pico)\n"
+        )
+    text.write("\nFunciones con mayor tiempo acumulado (cProfile)\n")
+    stats = pstats.Stats(profiler, stream=text)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(PROFILE_REPORT_LINES)
+    text.write("Líneas con más memoria asignada al final de la re-ejecución (tracemalloc)\n")
+    for statistic in snapshot.statistics("lineno")[:PROFILE_REPORT_LINES]:
+        text.write(f"{statistic}\n")
+    return {
+        "created": created,
+        "timings": timings.records,
+        # Same bytes as pstats.Stats.dump_stats (the Stats took over the profiler's statistics)
+        "prof": marshal.dumps(stats.stats),
+        "text": text.getvalue(),
+    }
+
+# --- Almacén persistente de chats procesados ---
+STORE_LOGGER = logging.getLogger("visualizador_whatsapp.store")
+_CHAT_STORE_SCHEMA = """
+PRAGMA auto_vacuum = INCREMENTAL;
+CREATE TABLE chats (
+    sha256 TEXT PRIMARY KEY,
+    format_name TEXT NOT NULL,
+    format_pattern TEXT NOT NULL,
+    format_flags INTEGER NOT NULL,
+    day_first INTEGER NOT NULL,
+    message_count INTEGER NOT NULL,
+    senders TEXT NOT NULL,
+    attachments TEXT NOT NULL,
+    file_hashes TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE TABLE columns (sha256 TEXT NOT NULL, name TEXT NOT NULL, data BLOB NOT NULL, PRIMARY KEY (sha256, name));
+CREATE TABLE texts (sha256 TEXT NOT NULL, block INTEGER NOT NULL, data TEXT NOT NULL, PRIMARY KEY (sha256, block));
+CREATE TABLE postings (sha256 TEXT NOT NULL, token TEXT NOT NULL, positions BLOB NOT NULL, PRIMARY KEY (sha256, token));
+"""
+
+class _ChatTooLarge(Exception):
+    """Stops ChatStore.save once the chat turns out larger than the whole store."""
+
+class ChatStore:
+    """
+    Persistent on-disk store (SQLite) of ingested chats, keyed by the SHA256 of the upload, so a
+    known chat is reopened without parsing it again, from any session and after a restart.
+    It keeps the message columns, the participants, the day, type, search and Merkle indexes,
+    the attachment links and the file hashes. Opening a chat only reads its columns: texts and
+    postings are read on demand (see StoredTexts and StoredSearchIndex). When the store grows
+    past max_bytes, the least recently opened chats are deleted, except the ones still open in
+    this process (a StoredTexts of theirs is alive, e.g. in a session or a cache), which would
+    fail to read their texts; the store may then stay over its size until they are closed.
+    One connection is shared by every session (Streamlit runs each one in its own thread),
+    so every query holds the lock.
+    """
+    SCHEMA_VERSION = 4
+    TABLES = ("chats", "columns", "texts", "postings")
+    # MessageStore columns saved as raw arrays
+    COLUMNS = ("timestamps", "sender_ids", "day_numbers", "day_starts", "byte_starts", "byte_ends", "message_types", "link_domain_ids")
+
+    def __init__(self, path, max_bytes):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        # StoredTexts of the chats opened from this store and still in use
+        self.open_texts = weakref.WeakSet()
+        existing = os.path.exists(path) and os.path.getsize(path) > 0
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        if version != self.SCHEMA_VERSION:
+            # New file or another layout: the store is only a cache, so it starts over
+            if existing:
+                STORE_LOGGER.warning(
+                    "El almacén %s tiene la versión de esquema %s (se esperaba %s): se borra y se vuelve a crear.",
+                    path, version, self.SCHEMA_VERSION,
+                )
+            self.connection.close()
+            if os.path.exists(path):
+                os.remove(path)
+            self.connection = sqlite3.connect(path, check_same_thread=False)
+            self.connection.executescript(_CHAT_STORE_SCHEMA)
+            self.connection.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+
+    def _delete(self, sha256_hash):
+        for table in self.TABLES:
+            self.connection.execute(f"DELETE FROM {table} WHERE sha256 = ?", (sha256_hash,))
+
+    def save(self, sha256_hash, chat_data, file_hashes=None):
+        """
+        Stores an ingested chat (the dict returned by load_chat) and evicts old chats if the
+        store is over its size. Chats larger than the whole store are not saved.
+        The rows are produced one at a time as they are inserted (the columns and postings
+        straight from their arrays), so saving holds no copy of the chat: its size is added up
+        on the way, and the insertion is rolled back as soon as it goes over max_bytes.
+        """
+        messages = chat_data["messages"]
+        archive = chat_data["archive"]
+        size = 0
+
+        def counted(rows):
+            # (key, data, bytes) -> (sha256, key, data), adding up the size of the chat
+            nonlocal size
+            for key, data, row_size in rows:
+                size += row_size
+                if size > self.max_bytes:
+                    raise _ChatTooLarge()
+                yield sha256_hash, key, data
+
+        def column_rows():
+            for name in self.COLUMNS:
+                column = getattr(messages, name)
+                yield name, column, len(column) * column.itemsize
+            yield "leaf_hashes", messages.leaf_hashes, len(messages.leaf_hashes)
+            domains = json.dumps(messages.domains, ensure_ascii=False).encode("utf-8")
+            yield "domains", domains, len(domains)
+            for name, positions in zip(MESSAGE_TYPES, messages.type_positions):
+                yield f"type_{name}", positions, len(positions) * positions.itemsize
+            for depth, level in enumerate(chat_data["merkle_tree"].levels[1:], 1):
+                yield f"merkle_{depth}", level, len(level)
+            if archive is not None:
+                digests = json.dumps(archive.known_digests(), ensure_ascii=False).encode("utf-8")
+                yield "attachment_digests", digests, len(digests)
+
+        def text_rows():
+            for block, start in enumerate(range(0, len(messages), STORE_TEXT_BLOCK_SIZE)):
+                data = json.dumps(messages.texts[start:start + STORE_TEXT_BLOCK_SIZE], ensure_ascii=False)
+                yield block, data, len(data)
+
+        def posting_rows():
+            for token, positions in chat_data["search_index"].postings.items():
+                yield token, positions, len(token) + len(positions) * positions.itemsize
+
+        chat_format = messages.chat_format
+        try:
+            with self.lock, self.connection:
+                self._delete(sha256_hash)
+                self.connection.execute(
+                    "INSERT INTO chats VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        sha256_hash, chat_format.name, chat_format.regex.pattern, chat_format.regex.flags,
+                        chat_format.day_first, len(messages), json.dumps(messages.senders, ensure_ascii=False),
+                        json.dumps(archive.by_position if archive is not None else {}, ensure_ascii=False),
+                        json.dumps(file_hashes or {}), 0, time.time(),
+                    ),
+                )
+                self.connection.executemany("INSERT INTO columns VALUES (?, ?, ?)", counted(column_rows()))
+                self.connection.executemany("INSERT INTO texts VALUES (?, ?, ?)", counted(text_rows()))
+                self.connection.executemany("INSERT INTO postings VALUES (?, ?, ?)", counted(posting_rows()))
+                self.connection.execute("UPDATE chats SET size = ? WHERE sha256 = ?", (size, sha256_hash))
+        except _ChatTooLarge:
+            # Rolled back: the chat is not stored, and an earlier copy of it is left as it was
+            return
+        self._evict(sha256_hash)
+
+    def save_attachment_digests(self, sha256_hash, digests):
+        """Replaces the attachment digests ({name: SHA256}) of a stored chat, if it is stored."""
+        data = json.dumps(digests, ensure_ascii=False).encode("utf-8")
+        with self.lock, self.connection:
+            if self.connection.execute("SELECT 1 FROM chats WHERE sha256 = ?", (sha256_hash,)).fetchone() is not None:
+                self.connection.execute("INSERT OR REPLACE INTO columns VALUES (?, 'attachment_digests', ?)", (sha256_hash, data))
+
+    def _used_bytes(self):
+        """Bytes of the database file in use (pages that are not free)."""
+        page_size = self.connection.execute("PRAGMA page_size").fetchone()[0]
+        page_count = self.connection.execute("PRAGMA page_count").fetchone()[0]
+        free_pages = self.connection.execute("PRAGMA freelist_count").fetchone()[0]
+        return (page_count - free_pages) * page_size
+
+    def _evict(self, keep):
+        """
+        Deletes the least recently opened chats (except keep and the chats still open) until the
+        store fits in max_bytes.
+        """
+        with self.lock:
+            in_use = {texts.sha256_hash for texts in list(self.open_texts)}
+            oldest_first = self.connection.execute("SELECT sha256 FROM chats WHERE sha256 != ? ORDER BY last_used", (keep,)).fetchall()
+            for sha256_hash, in oldest_first:
+                if self._used_bytes() <= self.max_bytes:
+                    break
+                if sha256_hash in in_use:
+                    continue
+                with self.connection:
+                    self._delete(sha256_hash)
+            # Give the freed pages back to the file system
+            self.connection.executescript("PRAGMA incremental_vacuum;")
+
+    def contains(self, sha256_hash):
+        """Whether the chat of sha256_hash is stored."""
+        with self.lock:
+            return self.connection.execute("SELECT 1 FROM chats WHERE sha256 = ?", (sha256_hash,)).fetchone() is not None
+
+    def load(self, sha256_hash):
+        """
+        Opens a stored chat: returns a dict like load_chat's (with "attachments", the attachment
+        name of each linked message position, and "attachment_digests", the SHA256 of each
+        attachment hashed before it was saved, instead of "archive"), or None if it is not stored.
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT format_name, format_pattern, format_flags, day_first, message_count, senders, attachments FROM chats WHERE sha256 = ?",
+                (sha256_hash,),
+            ).fetchone()
+            if row is None:
+                return None
+            columns = dict(self.connection.execute("SELECT name, data FROM columns WHERE sha256 = ?", (sha256_hash,)))
+            with self.connection:
+                self.connection.execute("UPDATE chats SET last_used = ? WHERE sha256 = ?", (time.time(), sha256_hash))
+        format_name, format_pattern, format_flags, day_first, message_count, senders, attachments = row
+        messages = MessageStore(ChatFormat(format_name, re.compile(format_pattern, format_flags), bool(day_first)))
+        for name in self.COLUMNS:
+            getattr(messages, name).frombytes(columns[name])
+        messages.leaf_hashes = bytearray(columns["leaf_hashes"])
+        for name, positions in zip(MESSAGE_TYPES, messages.type_positions):
+            positions.frombytes(columns[f"type_{name}"])
+        messages.domains = json.loads(columns["domains"])
+        messages.domain_ids_by_name = {domain: domain_id for domain_id, domain in enumerate(messages.domains)}
+        messages.texts = StoredTexts(self, sha256_hash, message_count)
+        # The search index reads postings through messages: the texts pin the whole chat
+        self.open_texts.add(messages.texts)
+        messages.senders = json.loads(senders)
+        messages.sender_ids_by_name = {sender: sender_id for sender_id, sender in enumerate(messages.senders)}
+        levels = [columns["leaf_hashes"]]
+        while f"merkle_{len(levels)}" in columns:
+            levels.append(columns[f"merkle_{len(levels)}"])
+        return {
+            "messages": messages,
+            "participants": messages.participants,
+            "search_index": StoredSearchIndex(messages, self, sha256_hash),
+            "merkle_tree": MerkleTree.from_levels(levels),
+            "attachments": {int(position): name for position, name in json.loads(attachments).items()},
+            "attachment_digests": json.loads(columns.get("attachment_digests", b"{}")),
+        }
+
+    def text_block(self, sha256_hash, block):
+        """Texts of the messages of one block (STORE_TEXT_BLOCK_SIZE messages) of a stored chat."""
+        with self.lock:
+            row = self.connection.execute("SELECT data FROM texts WHERE sha256 = ? AND block = ?", (sha256_hash, block)).fetchone()
+        if row is None:
+            raise LookupError(f"El chat {sha256_hash} ya no está en el almacén; vuelva a cargar el archivo.")
+        return json.loads(row[0])
+
+    def postings(self, sha256_hash, token):
+        """Positions of the messages of a stored chat that contain a token (None if none)."""
+        with self.lock:
+            row = self.connection.execute("SELECT positions FROM postings WHERE sha256 = ? AND token = ?", (sha256_hash, token)).fetchone()
+        return None if row is None else array("I", row[0])
+
+    def prefix_postings(self, sha256_hash, prefix):
+        """Positions of each token of a stored chat that starts with prefix (a range scan of the key)."""
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT positions FROM postings WHERE sha256 = ? AND token >= ? AND token < ?",
+                (sha256_hash, prefix, prefix + "\U0010ffff"),
+            ).fetchall()
+        return [array("I", positions) for positions, in rows]
+
+    def all_postings(self, sha256_hash):
+        """Every (token, positions) of a stored chat."""
+        with self.lock:
+            rows = self.connection.execute("SELECT token, positions FROM postings WHERE sha256 = ?", (sha256_hash,)).fetchall()
+        return [(token, array("I", positions)) for token, positions in rows]
+
+class StoredTexts:
+    """
+    Read-only sequence of the message texts of a chat in the ChatStore, used as
+    MessageStore.texts. Texts are read from disk in blocks of STORE_TEXT_BLOCK_SIZE messages
+    when first needed, and the STORE_CACHED_TEXT_BLOCKS most recently used blocks stay in memory.
+    """
+    __slots__ = ("store", "sha256_hash", "length", "blocks", "lock", "__weakref__")
+
+    def __init__(self, store, sha256_hash, length):
+        self.store = store
+        self.sha256_hash = sha256_hash
+        self.length = length
+        self.blocks = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.length
+
+    def _block(self, block):
+        with self.lock:
+            texts = self.blocks.get(block)
+            if texts is not None:
+                self.blocks.move_to_end(block)
+                return texts
+        texts = self.store.text_block(self.sha256_hash, block)
+        with self.lock:
+            self.blocks[block] = texts
+            if len(self.blocks) > STORE_CACHED_TEXT_BLOCKS:
+                self.blocks.popitem(last=False)
+        return texts
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self[p] for p in range(*position.indices(self.length))]
+        if position < 0:
+            position += self.length
+        if not 0 <= position < self.length:
+            raise IndexError("message position out of range")
+        block, offset = divmod(position, STORE_TEXT_BLOCK_SIZE)
+        return self._block(block)[offset]
+
+    def __iter__(self):
+        for block in range(-(-self.length // STORE_TEXT_BLOCK_SIZE)):
+            yield from self._block(block)
+
+    def select(self, positions):
+        """Texts at the given ascending positions, reading each block only once."""
+        selected = []
+        for block, block_positions in itertools.groupby(positions, key=lambda position: position // STORE_TEXT_BLOCK_SIZE):
+            texts = self._block(block)
+            block_start = block * STORE_TEXT_BLOCK_SIZE
+            selected.extend([texts[position - block_start] for position in block_positions])
+        return selected
+
+class StoredPostings:
+    """
+    Postings of a chat in the ChatStore, with the part of the dict interface SearchIndex uses.
+    """
+    __slots__ = ("store", "sha256_hash")
+
+    def __init__(self, store, sha256_hash):
+        self.store = store
+        self.sha256_hash = sha256_hash
+
+    def get(self, token, default=None):
+        positions = self.store.postings(self.sha256_hash, token)
+        return default if positions is None else positions
+
+    def items(self):
+        return self.store.all_postings(self.sha256_hash)
+
+class StoredSearchIndex(SearchIndex):
+    """
+    SearchIndex of a chat in the ChatStore: a query reads only the postings of its tokens.
+    """
+    __slots__ = ("store", "sha256_hash")
+
+    def __init__(self, messages, store, sha256_hash):
+        super().__init__(messages)
+        self.store = store
+        self.sha256_hash = sha256_hash
+        self.postings = StoredPostings(store, sha256_hash)
+
+    def _prefix_positions(self, prefix):
+        matches = set()
+        for positions in self.store.prefix_postings(self.sha256_hash, prefix):
+            matches.update(positions)
+        return array("I", sorted(matches))
+
+@st.cache_resource
+def open_chat_store():
+    """
+    The ChatStore shared by every session, or None if it is disabled (size 0) or cannot be opened.
+    """
+    if CHAT_STORE_MAX_BYTES <= 0:
+        return None
+    try:
+        return ChatStore(CHAT_STORE_PATH, CHAT_STORE_MAX_BYTES)
+    except (OSError, sqlite3.Error):
+        return None
+
+def _ignore_progress(phase, done, total, messages=None):
+    pass
+
+def _chat_size(chat_stream, archive):
+    """Size in bytes of the chat text of an export (without reading it, unless it is converted)."""
+    if archive is not None and not getattr(chat_stream, "utf16", False):
+        return archive.chat_member.file_size
+    size = chat_stream.seek(0, io.SEEK_END)
+    chat_stream.seek(0)
+    return size
+
+def _open_upload(sha256_hash, upload_stream, attachment_digests):
+    """open_chat_export for an ingestion: the archive keeps its digests in attachment_digests."""
+    chat_stream, archive = open_chat_export(upload_stream)
+    if archive is not None:
+        archive.sha256 = sha256_hash
+        if attachment_digests is not None:
+            archive.digests = attachment_digests
+    return chat_stream, archive
+
+def load_chat(sha256_hash, upload_stream, chat_store=None, progress=None, attachment_digests=None):
+    """
+    Ingests an upload: opens it from chat_store if it was already processed ("from_store" is
+    then True), or else parses it and builds its search index and Merkle tree. Returns the
+    chat data dict (messages, participants, search_index, merkle_tree, archive, from_store and
+    encoding, see chat_text_encoding).
+    progress: optional callable(phase, done, total, messages=None) told the advance of each
+    phase of INGEST_PHASES (messages: the MessageStore parsed so far), starting with done = 0;
+    it may raise to cancel.
+    The attachments of a .zip export are not hashed here (see ChatArchive): their digests go to
+    attachment_digests, a dict by (sha256_hash, name), if given.
+    """
+    progress = progress or _ignore_progress
+    chat_stream, archive = _open_upload(sha256_hash, upload_stream, attachment_digests)
+    chat_data = chat_store.load(sha256_hash) if chat_store is not None else None
+    if chat_data is not None:
+        attachments = chat_data.pop("attachments")
+        stored_digests = chat_data.pop("attachment_digests")
+        if archive is not None:
+            archive.by_position = attachments
+            archive.digests.update(((sha256_hash, name), digest) for name, digest in stored_digests.items())
+            archive.close()
+        chat_data["archive"] = archive
+        chat_data["from_store"] = True
+        chat_data["encoding"] = chat_text_encoding(chat_stream)
+        return chat_data
+
+    chat_size = _chat_size(chat_stream, archive)
+    progress("parse", 0, chat_size)
+    messages, participants = parse_chat_stream(
+        chat_stream, progress=lambda messages, bytes_parsed: progress("parse", bytes_parsed, chat_size, messages)
+    )
+    progress("parse", chat_size, chat_size, messages)
+    if archive is not None:
+        archive.link_messages(messages)
+    progress("index", 0, len(messages))
+    search_index = SearchIndex.build(messages, progress=lambda indexed: progress("index", indexed, len(messages)))
+    progress("index", len(messages), len(messages))
+    progress("merkle", 0, len(messages))
+    merkle_tree = MerkleTree(messages.leaf_hashes)
+    progress("merkle", len(messages), len(messages))
+    if archive is not None:
+        archive.close()
+    return {
+        "messages": messages,
+        "participants": participants,
+        "search_index": search_index,
+        "merkle_tree": merkle_tree,
+        "archive": archive,
+        "from_store": False,
+        "encoding": chat_text_encoding(chat_stream),
+    }
+
+def load_chat_update(sha256_hash, upload_stream, base_sha256_hash, base_chat_data, progress=None, attachment_digests=None):
+    """
+    Like load_chat, for a later export of the chat of base_chat_data (the ingested earlier
+    export, whose hash is base_sha256_hash): the shared prefix is reused (messages, index
+    postings and Merkle nodes) and only the new tail is parsed and indexed. The result also
+    has "shared_messages" and "changes" (see diff_chat_messages) against the earlier export.
     """
-    Parses the chat content and returns a list of message dictionaries.
-    It also tries to identify all unique participants.
+    progress = progress or _ignore_progress
+    chat_stream, archive = _open_upload(sha256_hash, upload_stream, attachment_digests)
+    chat_size = _chat_size(chat_stream, archive)
+    base_messages = base_chat_data["messages"]
+    # The hash of a UTF-8 .txt export is the hash of its chat text
+    base_text_sha256 = base_sha256_hash if base_chat_data["archive"] is None and base_chat_data["encoding"] == "utf-8" else None
+    progress("parse", 0, chat_size)
+    messages, start = update_chat_content(
+        base_messages, chat_stream, base_text_sha256,
+        progress=lambda messages, bytes_parsed: progress("parse", bytes_parsed, chat_size, messages),
+    )
+    progress("parse", chat_size, chat_size, messages)
+    if archive is not None:
+        archive.link_messages(messages)
+    progress("index", 0, len(messages))
+    search_index = SearchIndex.extend_from(base_chat_data["search_index"], messages, start)
+    progress("index", len(messages), len(messages))
+    progress("merkle", 0, len(messages))
+    merkle_tree = MerkleTree(messages.leaf_hashes, base_chat_data["merkle_tree"], start)
+    progress("merkle", len(messages), len(messages))
+    if archive is not None:
+        archive.close()
+    return {
+        "messages": messages,
+        "participants": messages.participants,
+        "search_index": search_index,
+        "merkle_tree": merkle_tree,
+        "archive": archive,
+        "from_store": False,
+        "encoding": chat_text_encoding(chat_stream),
+        "shared_messages": start,
+        "changes": diff_chat_messages(base_messages, messages, start),
+    }
+
+class IngestionCancelled(Exception):
+    """Raised from a progress report to stop a BackgroundJob."""
+
+class BackgroundJob:
+    """
+    Work on an upload run in a worker thread, so the page stays responsive. The script thread
+    only polls the job: the advance of each of its phases (progress: {phase: (done, total)}),
+    its state ("running", "done", "failed" with error, or "cancelled") and, when done, result.
+    cancel() stops the worker at its next progress report. timings (a PhaseTimings) measures
+    each phase. Subclasses implement run() (and optionally finish()); start() runs the job
+    (once: starting it again does nothing) and finished is set when its worker is over.
+    """
+    scope = "job"
+    phases = ()
+
+    def __init__(self, key, upload):
+        self.key = key
+        self.name = upload.name
+        self.upload = upload
+        self.progress = dict.fromkeys(self.phases, (0, 0))
+        self.result = None
+        self.error = None
+        self.state = "running"
+        self.timings = PhaseTimings(self.scope, file=upload.name)
+        self.finished = threading.Event()
+        self._cancelled = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._work, name=self.scope, daemon=True)
+            self._thread.start()
+        return self
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def report(self, phase, done, total):
+        """Progress callback of the work. Raises IngestionCancelled once cancelled."""
+        if self._cancelled.is_set():
+            raise IngestionCancelled()
+        if phase != self.timings.phase:
+            self.timings.start(phase)
+        self.progress[phase] = (done, total)
+
+    def _work(self):
+        try:
+            try:
+                result = self.run()
+            except IngestionCancelled:
+                self.state = "cancelled"
+                return
+            except Exception as error:
+                self.error = error
+                self.state = "failed"
+                return
+            finally:
+                self.timings.stop()
+            self.result = result
+            self.state = "done"
+            try:
+                self.finish(result)
+            finally:
+                # The result no longer needs the upload
+                self.upload = None
+        finally:
+            self.finished.set()
+
+    def run(self):
+        raise NotImplementedError
+
+    def finish(self, result):
+        """Work done in the worker thread after the result is shown (the upload is still there)."""
+
+class HashingJob(BackgroundJob):
+    """
+    Computes the file hashes of an upload for one session (key: file_id and algorithms, SHA256
+    always included); result is {algorithm: hex digest}. The IngestionJob of the upload parses
+    it at the same time and waits for this job only to learn its SHA256, so another selection
+    of algorithms only hashes again.
+    """
+    scope = "hashing"
+    phases = ("hash",)
+
+    def __init__(self, key, upload, algorithms):
+        super().__init__(key, upload)
+        self.algorithms = tuple(algorithms)
+
+    def run(self):
+        upload_size = self.upload.size
+        self.report("hash", 0, upload_size)
+        return compute_file_hashes(self.upload, self.algorithms, progress=lambda bytes_read: self.report("hash", bytes_read, upload_size))
+
+class IngestionJob(BackgroundJob):
+    """
+    Ingests an upload: runs load_chat (or load_chat_update against an earlier export, given as
+    base = (base_sha256_hash, base_chat_data)). With its file hashes still unknown (file_hashes
+    None), the upload is parsed while hashing_job hashes it, and the job then waits for that
+    job (see wait_for_hashes): the chat store and the attachment digests are only used once
+    its SHA256 is known. A session starts it keyed by its upload and shares it by content,
+    under (SHA256 of the upload, SHA256 of the earlier export or None), through the ChatCache
+    (see share_ingestion). While it runs, the messages parsed so far (messages,
+    parsed_messages) preview the first page. After the chat is shown, still in the worker
+    thread, the new chat is saved to chat_store and then the attachments of a .zip export not
+    hashed yet are hashed (into attachment_digests, see load_chat) and their digests saved too.
+    timings also measures "open" (opening the export or the chat from the store), "hash"
+    (waiting for the hashes), "save" and "attachments".
+    """
+    scope = "ingestion"
+    phases = ("parse", "index", "merkle")
+
+    def __init__(self, key, upload, file_hashes, chat_store=None, base=None, attachment_digests=None, hashing_job=None):
+        super().__init__(key, upload)
+        self.file_hashes = file_hashes
+        self.chat_store = chat_store
+        self.base = base
+        self.attachment_digests = attachment_digests
+        self.hashing_job = hashing_job
+        self.messages = None
+        self.parsed_messages = 0
+
+    def report(self, phase, done, total, messages=None):
+        super().report(phase, done, total)
+        if messages is not None:
+            self.messages = messages
+            self.parsed_messages = len(messages)
+
+    def run(self):
+        self.timings.start("open")
+        if self.file_hashes is not None:
+            return self._load(self.file_hashes["sha256"], self.chat_store, self.attachment_digests)
+        chat_data = self._load(None, None, None)
+        self.timings.start("hash")
+        self.file_hashes = self.wait_for_hashes()
+        archive = chat_data["archive"]
+        if archive is not None:
+            # Nothing was hashed while parsing: from now on its digests are kept by SHA256
+            archive.sha256 = self.file_hashes["sha256"]
+            if self.attachment_digests is not None:
+                archive.digests = self.attachment_digests
+        return chat_data
+
+    def _load(self, sha256_hash, chat_store, attachment_digests):
+        if self.base is None:
+            return load_chat(sha256_hash, self.upload, chat_store, self.report, attachment_digests)
+        return load_chat_update(sha256_hash, self.upload, *self.base, progress=self.report, attachment_digests=attachment_digests)
+
+    def wait_for_hashes(self):
+        """
+        The file hashes computed by hashing_job, which the session may replace by another one
+        (for other algorithms) while this job waits. Fails like it, and raises
+        IngestionCancelled once this job is cancelled.
+        """
+        while True:
+            hashing_job = self.hashing_job
+            if hashing_job.finished.wait(INGEST_POLL_SECONDS):
+                if hashing_job.state == "done":
+                    return hashing_job.result
+                if hashing_job is self.hashing_job:
+                    if hashing_job.state == "failed":
+                        raise hashing_job.error
+                    raise IngestionCancelled()
+            if self._cancelled.is_set():
+                raise IngestionCancelled()
+
+    def finish(self, chat_data):
+        # The earlier export stays in its own job, not in this one
+        self.base = None
+        sha256_hash = self.file_hashes["sha256"]
+        # Saved like any other chat (a later export included), so it opens from disk next time
+        if self.chat_store is not None and not chat_data["from_store"]:
+            self.timings.start("save")
+            self.chat_store.save(sha256_hash, chat_data, self.file_hashes)
+            self.timings.stop()
+        archive = chat_data["archive"]
+        if archive is not None and len(archive.known_digests()) < len(archive.members):
+            # Some may already be hashed, by a session showing their messages
+            self.timings.start("attachments")
+            archive.reading(self.upload).hash_attachments()
+            if self.chat_store is not None:
+                self.chat_store.save_attachment_digests(sha256_hash, archive.known_digests())
+            self.timings.stop()
+
+class ChatCache:
+    """
+    The IngestionJobs shared by every session (see chat_cache), by key: chats being ingested
+    and ingested chats with their result. Holds at most max_entries jobs: adding one drops the
+    least recently used finished jobs over that (running jobs are kept). A dropped chat is
+    ingested again when asked for, usually from the chat store.
+    """
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._jobs = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """The job of key, or None."""
+        with self._lock:
+            return self._jobs.get(key)
+
+    def ingest(self, key, make_job, restart=False):
+        """
+        The job of key, started from make_job() if there is none (or, with restart, if the one
+        there was cancelled).
+        """
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is None or (restart and job.state == "cancelled"):
+                job = self._jobs[key] = make_job().start()
+                finished = [cached_key for cached_key, cached in self._jobs.items() if cached.state != "running"]
+                for cached_key in finished[:max(len(self._jobs) - self.max_entries, 0)]:
+                    del self._jobs[cached_key]
+            self._jobs.move_to_end(key)
+            return job
+
+@st.cache_resource
+def attachment_digests():
+    """
+    SHA256 of the attachments of the .zip exports hashed so far, shared by every session and
+    ingestion: {(SHA256 of the export, attachment name): hex digest}.
     """
-    lines = chat_content.split('\n')
-    messages = []
-    
-    # Use a set to store unique participant names (excluding "Sistema")
-    detected_participants = set()
+    return {}
 
-    # Regex to identify the start of a WhatsApp message
-    # It handles two main patterns based on the common WhatsApp export format:
-    # 1. DATE, TIME - SENDER: MESSAGE (e.g., "2/7/2025, 20:13 - Marcelo G. Montiel: Hola flor")
-    # 2. DATE, TIME - MESSAGE (for system messages, e.g., "2/7/2025, 20:13 - Los mensajes...")
-    message_regex = re.compile(r"^(\d{1,2}\/\d{1,2}\/\d{4}), (\d{2}:\d{2}) - (?:([^:]+): )?(.*)")
+@st.cache_resource
+def chat_cache():
+    """The ChatCache shared by every session, with at most INGEST_CACHE_MAX_ENTRIES chats."""
+    return ChatCache(INGEST_CACHE_MAX_ENTRIES)
+
+def format_phase_progress(phase, done, total):
+    """Text of the progress bar of an ingestion phase: MB for the byte phases, messages otherwise."""
+    if phase in ("hash", "parse"):
+        return f"{done / 1048576:.1f} de {total / 1048576:.1f} MB"
+    return f"{done} de {total} mensajes"
+
+@st.fragment(run_every=INGEST_POLL_SECONDS)
+def show_ingestion_progress(prefix, hashing_job, job, hashes_known):
+    """
+    Progress panel of the hashing of an upload and of its IngestionJob (see ingest_upload),
+    which run at the same time, refreshed on its own every INGEST_POLL_SECONDS: one bar per
+    phase, a cancel button and the first page of the messages parsed so far. The whole app
+    reruns when the hashing ends (to show the hashes and share the job, unless hashes_known
+    already) and when the job ends.
+    """
+    if job.state != "running" or (hashing_job.state != "running" and not hashes_known):
+        st.rerun()
+    progress = {**hashing_job.progress, **job.progress}
+    for phase, label in INGEST_PHASES.items():
+        done, total = progress.get(phase, (0, 0))
+        st.progress(min(done / total, 1.0) if total else 0.0, text=f"{label}: {format_phase_progress(phase, done, total)}")
+    st.button("Cancelar", key="cancel_ingestion", on_click=cancel_ingestion, args=(prefix, hashing_job, job))
+    if job.parsed_messages:
+        messages = job.messages
+        preview_count = min(job.parsed_messages, st.session_state.get("page_size", PAGE_SIZES[0]))
+        st.caption(f"Vista previa: primeros {preview_count} mensajes; el resto del archivo se sigue procesando.")
+        components.html(
+            build_chat_html(messages, range(preview_count), *messages.participants[:2]),
+            height=CHAT_VIEW_HEIGHT,
+            scrolling=True,
+        )
+
+def cancel_ingestion(prefix, hashing_job, job):
+    """
+    Callback of the "Cancelar" button of the progress panel: stops the hashing and the
+    ingestion of the upload. A shared IngestionJob cancelled here is started again for the
+    other sessions that wait for it, not for this one.
+    """
+    hashing_job.cancel()
+    job.cancel()
+    st.session_state.cancelled_ingestion = st.session_state[prefix + "ingestion"][0]
+
+def stop_ingestion(prefix, key):
+    """
+    Cancels the ingestion this session started last for an upload if it is still running and
+    no longer wanted (it was started for another upload key, see ingest_upload): two
+    ingestions never read the same upload at once.
+    """
+    ingestion = st.session_state[prefix + "ingestion"]
+    if ingestion is not None and ingestion[0] != key:
+        if ingestion[1].state == "running":
+            ingestion[1].cancel()
+        st.session_state[prefix + "ingestion"] = None
+
+def stop_upload(prefix):
+    """Stops hashing and ingesting an upload that was removed (see ingest_upload)."""
+    hashing_job = st.session_state[prefix + "hashing_job"]
+    if hashing_job is not None:
+        hashing_job.cancel()
+        st.session_state[prefix + "hashing_job"] = None
+    stop_ingestion(prefix, None)
+
+def share_ingestion(prefix, upload, file_hashes, chat_store, base):
+    """
+    Once the file hashes of an upload are known, shares the IngestionJob of this session
+    (started keyed by the upload, see ingest_upload) through the ChatCache, re-keyed by
+    content: (SHA256 of the upload, SHA256 of the earlier export or None). The job another
+    session already has for that content is used instead, and so is a new one opening the
+    chat from chat_store if it is stored there and this one is still parsing; this one is
+    then cancelled. Returns the job this session shows.
+    """
+    upload_key, job = st.session_state[prefix + "ingestion"]
+    key = (file_hashes["sha256"], upload_key[1])
+    stored = job.state == "running" and chat_store is not None and chat_store.contains(key[0])
 
-    current_message = None
-    for line in lines:
-        match = message_regex.match(line)
-        if match:
-            # If it's the start of a new message
-            if current_message:
-                messages.append(current_message)
+    def make_job():
+        if job.state == "cancelled" or stored:
+            return IngestionJob(key, upload, file_hashes, chat_store, base, attachment_digests())
+        job.key = key
+        return job
 
-            date, time, sender_group, text = match.groups()
+    shared_job = chat_cache().ingest(key, make_job, restart=True)
+    if shared_job is not job and job.state == "running":
+        job.cancel()
+    st.session_state[prefix + "ingestion"] = (upload_key, shared_job)
+    return shared_job
 
-            # Determine the actual sender
-            sender = sender_group.strip() if sender_group else "Sistema"
+def ingest_upload(prefix, upload, algorithms, base, ingest=True):
+    """
+    Hashes an upload of this session (with algorithms, SHA256 always included) and ingests it
+    (against base, see IngestionJob) in two worker threads that run at the same time: a
+    HashingJob once per upload and selection of algorithms (every widget interaction reruns
+    the script, but the same upload keeps the same file_id), and an IngestionJob keyed by the
+    upload until its SHA256 is known, then shared by content (see share_ingestion). prefix
+    (one of UPLOAD_STATE_PREFIXES) names the session state of the upload: prefix +
+    "hashing_job" and prefix + "ingestion". Without ingest (base is not ready yet), the upload
+    is only hashed. Returns (hashing_job, job or None, file hashes or None until known).
+    """
+    upload_key = (upload.file_id, base[0] if base else None)
+    stop_ingestion(prefix, upload_key if ingest else None)
+    ingestion = st.session_state[prefix + "ingestion"]
+    hashing_key = (upload.file_id, tuple(algorithms))
+    hashing_job = st.session_state[prefix + "hashing_job"]
+    if hashing_job is None or hashing_job.key != hashing_key:
+        previous_hashing_job = hashing_job
+        hashing_job = st.session_state[prefix + "hashing_job"] = HashingJob(hashing_key, upload, algorithms).start()
+        if ingestion is not None:
+            # An ingestion still waiting for the hashes waits for the new job instead
+            ingestion[1].hashing_job = hashing_job
+        if previous_hashing_job is not None:
+            previous_hashing_job.cancel()
+    file_hashes = hashing_job.result if hashing_job.state == "done" else None
+    if not ingest:
+        return hashing_job, None, file_hashes
 
-            current_message = {
-                "date": date,
-                "time": time,
-                "sender": sender,
-                "text": text.strip()
-            }
-            # Add sender to detected participants if it's not a system message
-            if sender != "Sistema":
-                detected_participants.add(sender)
-        elif current_message:
-            # If it's not a new message, it's a continuation of the previous message
-            current_message["text"] += '\n' + line.strip()
+    chat_store = open_chat_store()
+    if ingestion is None:
+        job = IngestionJob(upload_key, upload, None, chat_store, base, attachment_digests(), hashing_job).start()
+        ingestion = st.session_state[prefix + "ingestion"] = (upload_key, job)
+    job = ingestion[1]
+    if file_hashes is not None and st.session_state.cancelled_ingestion != upload_key:
+        job = share_ingestion(prefix, upload, file_hashes, chat_store, base)
+    return hashing_job, job, file_hashes
 
-    # Add the last message if it exists
-    if current_message:
-        messages.append(current_message)
+def restart_ingestion():
+    """Callback of the "Reintentar" button after a cancelled ingestion."""
+    for prefix in UPLOAD_STATE_PREFIXES:
+        st.session_state[prefix + "hashing_job"] = None
+        st.session_state[prefix + "ingestion"] = None
+    st.session_state.cancelled_ingestion = None
 
-    # Return messages and the list of detected participants
-    return messages, list(detected_participants)
+def jump_to_date(messages, visible_positions):
+    """
+    Callback of the "Ir a la fecha" widget: moves the viewer to the page that contains the
+    first message of the chosen date (or of the next date with messages), among the visible
+    positions (all of them, or those of the type filter).
+    """
+    target = st.session_state.jump_date
+    if target is None:
+        return
+    index = bisect.bisect_left(visible_positions, messages.position_of_date(target))
+    st.session_state.chat_page_number = min(index, max(len(visible_positions) - 1, 0)) // st.session_state.page_size + 1
 
-def display_message_bubble(sender_name, text, time, use_green_bubble_style):
+def keep_page_position():
     """
-    Displays a single chat message bubble using Streamlit's markdown.
-    sender_name: The name of the sender to display.
-    text: The message content.
-    time: The message timestamp.
-    use_green_bubble_style: True if it should use the 'my-message' style (green), False for 'other-message' style (white).
+    Callback of the page size selector: keeps the first visible message on screen.
     """
-    # Determine CSS classes based on desired bubble style
-    message_class = "my-message" if use_green_bubble_style else "other-message"
-    sender_color_class = "my-sender-color" if use_green_bubble_style else "other-sender-color"
+    st.session_state.chat_page_number = st.session_state.viewer_position // st.session_state.page_size + 1
 
-    # Handle multimedia and YouTube link placeholders
-    message_text = text
-    if "<Multimedia omitido>" in message_text:
-        message_text = "[Multimedia Omitido]"
-    elif "https://youtube.com/shorts/" in message_text:
-        message_text = f"[Video de YouTube] {message_text}"
+def show_message(position):
+    """
+    Callback of the search results: opens the viewer page of a message and highlights it.
+    The type filter is cleared, so the message is shown among all the others.
+    """
+    st.session_state.type_filter = None
+    st.session_state.domain_filter = None
+    st.session_state.chat_page_number = position // st.session_state.get("page_size", PAGE_SIZES[0]) + 1
+    st.session_state.highlight_position = position
 
-    # HTML structure for a single message bubble
-    st.markdown(f"""
-        <div class="message-bubble {message_class}">
-            <div class="message-sender-name {sender_color_class}">
-                {sender_name}
-            </div>
-            <div>{message_text}</div>
-            <div class="message-time">
-                {time}
-            </div>
-        </div>
-    """, unsafe_allow_html=True)
+def reset_message_filter():
+    """
+    Callback of the message type and domain filters: the filtered messages start at page 1.
+    """
+    st.session_state.chat_page_number = 1
+    st.session_state.highlight_position = None
 
-# --- Streamlit App Layout ---
-st.set_page_config(page_title="Visualizador de Chat de WhatsApp", layout="centered")
+def change_page(step):
+    """
+    Callback of the previous/next page buttons.
+    """
+    st.session_state.chat_page_number += step
 
-st.markdown("""
-    <style>
-        @import url('https://fonts.googleapis.com/css2?family=Inter:wght@400;700&display=swap');
-        /* Import Font Awesome for icons */
-        @import url('https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0-beta3/css/all.min.css');
+def request_profile():
+    """
+    Callback of the "Perfilar" button of the performance panel: the rerun it triggers runs
+    under cProfile and tracemalloc (see run_app).
+    """
+    st.session_state.profile_next_run = True
 
-        html, body, [class*="st-"] {
-            font-family: "Inter", sans-serif;
-            color: #333;
-        }
-        /* El fondo de toda la aplicación (fuera del chat-container) */
-        .stApp {
-            background-color: #f0f2f5; /* Color de fondo general */
-        }
-        /* El contenedor principal del chat, ahora con la imagen de fondo */
-        .chat-container {
-            /*background-image: url('https://i.pinimg.com/736x/3a/2e/99/3a2e99d16f179dae33e2c394be2229fb.jpg'); */
-            background-size: cover;
-            background-position: center;
-            background-attachment: local; /* Permite que el fondo se desplace con el contenido si el contenedor es scrollable */
-            background-repeat: no-repeat;
-            border-radius: 12px;
-            box-shadow: 0 4px 12px rgba(0, 0, 0, 0.1);
-            padding: 20px;
-            margin-top: 20px;
-            border: 1px solid rgba(0, 0, 0, 0.1); /* Borde fino al cuadro de conversación */
-        }
-        .chat-header {
-            background-color: #075e54;
-            color: white;
-            padding: 16px;
-            border-top-left-radius: 12px;
-            border-top-right-radius: 12px;
-            font-weight: bold;
-            text-align: center;
-            margin: -20px -20px 20px -20px; /* Adjust to cover padding */
-        }
-        .chat-messages-area {
-            display: flex;
-            flex-direction: column;
-            overflow-y: auto;
-            max-height: 70vh; /* Max height for the messages area */
-            padding: 20px; /* Padding for the entire message area */
-            background-color: transparent; /* Aseguramos que no tenga color de fondo propio */
+def timing_rows(records):
+    """Rows of the performance panel tables for the records of a PhaseTimings."""
+    return [
+        {
+            "Fase": record["phase"],
+            "Mensajes": record.get("messages"),
+            "Segundos": record["seconds"],
+            "Memoria (MiB)": record.get("rss_mib"),
+            "Variación (MiB)": record.get("rss_delta_mib"),
+            "Pico asignado (MiB)": record.get("traced_peak_mib"),
         }
+        for record in records
+    ]
+
+def show_performance_panel(timings, jobs):
+    """
+    Performance panel (see debug_panel_enabled): the phase timings of this rerun and of the
+    background jobs of the upload (None for a job not started), a button to profile a rerun and
+    the downloads of the last profile.
+    """
+    job_labels = {"hashing": "Hashes", "ingestion": "Procesamiento"}
+    with st.expander("🛠️ Diagnóstico de rendimiento"):
+        st.markdown(f"**Esta re-ejecución:** {timings.total():.3f} s")
+        st.dataframe(timing_rows(timings.records), hide_index=True)
+        for job in jobs:
+            if job is not None and job.timings.records:
+                st.markdown(f"**{job_labels.get(job.scope, job.scope)} de '{html.escape(job.name)}'** (en segundo plano): {job.timings.total():.3f} s")
+                st.dataframe(timing_rows(job.timings.records), hide_index=True)
+        st.caption("Cada fase también se registra como una línea JSON en la salida de errores del servidor.")
+        st.button(
+            "Perfilar una re-ejecución",
+            on_click=request_profile,
+            help="Vuelve a ejecutar la página con cProfile y tracemalloc (más lenta) y ofrece el perfil para descargar. El procesamiento en segundo plano no se incluye.",
+        )
+        if st.session_state.get("profile_error"):
+            st.warning(st.session_state.profile_error)
+        profile_report = st.session_state.get("profile_report")
+        if profile_report is not None:
+            st.caption(f"Último perfil: {profile_report['created']:%H:%M:%S}")
+            st.dataframe(timing_rows(profile_report["timings"]), hide_index=True)
+            prof_col, text_col = st.columns(2)
+            created = f"{profile_report['created']:%Y%m%d-%H%M%S}"
+            prof_col.download_button(
+                "Descargar perfil (.prof)",
+                profile_report["prof"],
+                file_name=f"visualizador-{created}.prof",
+                mime="application/octet-stream",
+            )
+            text_col.download_button(
+                "Descargar resumen (.txt)",
+                profile_report["text"],
+                file_name=f"visualizador-{created}.txt",
+                mime="text/plain",
+            )
+
+# Estilos de las burbujas de mensaje, compartidos por la página y por el documento HTML del chat
+CHAT_BUBBLE_CSS = """
         .message-bubble {
             max-width: 80%;
             padding: 10px 14px;
@@ -174,310 +2725,1410 @@ st.markdown("""
             text-align: right;
             margin-top: 4px;
         }
-        /* Style for the button */
-        .stButton>button {
-            background-color: #25d366;
+        /* Número de mensaje y hash de hoja (Merkle) */
+        .message-leaf {
+            font-family: monospace;
+        }
+"""
+
+# Estilos del documento HTML único con toda la conversación (se muestra dentro de un iframe,
+# que no hereda los estilos de la página)
+CHAT_DOCUMENT_CSS = """
+        @import url('https://fonts.googleapis.com/css2?family=Inter:wght@400;700&display=swap');
+        body {
+            margin: 0;
+            font-family: "Inter", sans-serif;
+            color: #333;
+            background-color: #f0f2f5;
+        }
+        .chat-header {
+            background-color: #075e54;
             color: white;
-            padding: 10px 20px;
-            border-radius: 8px;
+            padding: 16px;
+            border-top-left-radius: 12px;
+            border-top-right-radius: 12px;
             font-weight: bold;
-            cursor: pointer;
-            transition: background-color 0.3s ease;
-            box-shadow: 0 2px 4px rgba(0, 0, 0, 0.2);
-            border: none;
+            text-align: center;
         }
-        .stButton>button:hover {
-            background-color: #1da851;
+        .chat-messages-area {
+            display: flex;
+            flex-direction: column;
+            padding: 20px;
         }
-        /* New style for hash info box */
-        .hash-info-box {
-            background-color: #e7f3ff; /* Light blue for information */
-            border-left: 5px solid #2196F3; /* Blue border on the left */
-            border-radius: 8px;
-            padding: 15px;
-            margin-top: 15px;
-            margin-bottom: 15px;
-            box-shadow: 0 2px 5px rgba(0, 0, 0, 0.1);
-            font-size: 0.9em;
-            color: #333;
-            width: 100%; /* Asegura que ocupe todo el ancho disponible */
+        /* Alignment is done here instead of with one st.columns per message */
+        .message-row {
+            display: flex;
+            justify-content: flex-start;
         }
-        .hash-info-box strong {
-            color: #0056b3;
+        .message-row.right {
+            justify-content: flex-end;
         }
-        .hash-info-box .hash-value {
-            display: inline-block; /* Permite aplicar padding y background sin romper la línea */
-            word-break: break-all; /* Permite que los hashes largos se rompan en cualquier punto */
-            color: #495057; /* Color gris oscuro para los hashes */
-            padding: 0px 0px; /* Espaciado interno para el hash */
-            border-radius: 4px; /* Bordes ligeramente redondeados para el hash */
-            font-size: 0.95em; /* Ligeramente más grande para el hash */
-            margin-left: 5px; /* Pequeño margen para separar del label */
+        .message-text {
+            white-space: pre-wrap;
         }
-        /* Estilo para la firma profesional */
-        .professional-signature {
+        .system-message {
             text-align: center;
-            margin-top: 30px;
-            padding: 15px;
-            background-color: #e9ecef; /* Un gris claro para el fondo */
-            border-radius: 8px;
-            border: 1px solid #ced4da;
-            box-shadow: 0 2px 5px rgba(0, 0, 0, 0.05);
-        }
-        .professional-signature p {
+            font-size: 0.8em;
+            color: #666;
             margin: 5px 0;
-            font-size: 0.95em;
-            color: #495057;
         }
-        .professional-signature strong {
-            color: #212529;
-            font-size: 1.1em;
+        /* Message opened from the search results */
+        .message-row.highlighted .message-bubble {
+            box-shadow: 0 0 0 3px #ffc107;
+        }
+        .system-message.highlighted {
+            background-color: #fff3cd;
+        }
+        /* File information at the top of the batch reports */
+        .report-info {
+            background-color: #e7f3ff;
+            border-left: 5px solid #2196F3;
+            padding: 15px;
+            font-size: 0.9em;
+            word-break: break-all;
         }
-        /* Estilo para la descripción de la herramienta */
-        .tool-description {
-            text-align: justify;
-            margin-top: 10px;
-            margin-bottom: 20px;
-            padding: 10px 20px;
-            background-color: #e6f7ff; /* Un azul muy claro */
-            border-left: 5px solid #007bff; /* Borde azul para destacar */
+        /* Attachments of .zip exports */
+        .attachment-thumb {
+            display: block;
+            max-width: 100%;
             border-radius: 8px;
-            font-size: 0.9em;  /* Puedes eliminar esta línea o ajustarla */
-            color: #333;
-            box-shadow: 0 2px 5px rgba(0, 0, 0, 0.05);
+            margin-bottom: 4px;
         }
-        .tool-description p {
-            font-size: 0.85em; /* Ajusta este valor para hacer la letra más pequeña */
-            margin: 0; /* Elimina el margen por defecto de los párrafos si no lo necesitas */
+        .attachment-info {
+            font-size: 0.75rem;
+            color: #555;
+            word-break: break-all;
         }
-    </style>
-""", unsafe_allow_html=True)
-
-# Título de la aplicación con icono de WhatsApp
-st.markdown("## <i class='fab fa-whatsapp'></i> Visualizador de Chat de WhatsApp", unsafe_allow_html=True)
-
-# Descripción de la herramienta
-st.markdown("""
-    <div class="tool-description">
-        <p> Esta aplicación ha sido diseñada por Marcelo G. Montiel, Analista Universitario de Sistemas - Universidad Tecnológica Nacional, con el propósito de optimizar la visualización de los chats exportados de WhatsApp. Ofreciendo una interfaz gráfica que emula la experiencia original de WhatsApp, esta herramienta facilita una lectura y análisis más eficientes de las conversaciones. Adicionalmente, incorpora funcionalidades técnicas, como el cálculo de hashes, lo cual es de particular relevancia en el ámbito de las Pericias Informáticas para la verificación de la integridad de los datos. El código fuente de esta herramienta se encuentra a disposición para aquellos interesados en su estudio y aplicación, bajo la premisa de:
-        <strong> "Que la sabiduría no sea humillación para tú prójimo. Omar Khayyam".</strong></p> 
-    </div>
-""", unsafe_allow_html=True)
-
-# Initialize session state for alignment if not already set
-if 'invert_alignment' not in st.session_state:
-    st.session_state.invert_alignment = False
-if 'participant1' not in st.session_state:
-    st.session_state.participant1 = None
-if 'participant2' not in st.session_state:
-    st.session_state.participant2 = None
-
-# File uploader for WhatsApp chat .txt file
-uploaded_file = st.file_uploader("Carga tu archivo de chat de WhatsApp (.txt)", type=["txt"])
-st.info("¡Hola! Para empezar, por favor, selecciona un archivo de chat de WhatsApp (.txt).")
-# Button to toggle message alignment
-if st.button("Invertir Posición de Mensajes"):
-    st.session_state.invert_alignment = not st.session_state.invert_alignment
-
-if uploaded_file is not None:
-    # Read the file content
-    file_content_bytes = uploaded_file.read() # Read as bytes for hashing
-    file_content = file_content_bytes.decode("utf-8")
-
-    # Calculate SHA256 and MD5 hashes
-    sha256_hash = hashlib.sha256(file_content_bytes).hexdigest()
-    md5_hash = hashlib.md5(file_content_bytes).hexdigest()
-
-    # Display file information and hashes in a highlighted box using st.expander
-    with st.expander("📊 Información y Hashes del Archivo Cargado", expanded=True):
-        # Utilizar divs para cada línea de información para un mejor control del layout
-        # y asegurar que el label y el valor estén en la misma línea.
-        st.markdown(f"""
-            <div class="hash-info-box">
-                <div><strong>Nombre del archivo:</strong> {uploaded_file.name}</div>
-                <div><strong>Tamaño del archivo:</strong> {uploaded_file.size / 1024:.2f} KB</div>
-                <div><strong>Hash SHA256:</strong> <span class="hash-value">{sha256_hash}</span></div>
-                <div><strong>Hash MD5:</strong> <span class="hash-value">{md5_hash}</span></div>
+""" + CHAT_BUBBLE_CSS
+
+# Altura (en píxeles) del visor de la conversación en modo documento único
+CHAT_VIEW_HEIGHT = 650
+# Modos de visualización de la conversación
+RENDER_MODES = ["Documento único (rápido)", "Clásico (un elemento por mensaje)"]
+
+# Caracteres del hash de hoja que se muestran en cada mensaje (el hash completo queda en el title)
+LEAF_HASH_PREVIEW = 12
+
+_SYSTEM_MESSAGE_HTML = '<div id="m%d" class="system-message%s" title="Mensaje #%d · Hoja Merkle SHA256: %s">%s</div>\n'
+_BUBBLE_HTML = (
+    '<div id="m%d" class="message-row %s%s"><div class="message-bubble %s">'
+    '<div class="message-sender-name %s">%s</div>'
+    '%s<div class="message-text">%s</div>'
+    '<div class="message-time"><span class="message-leaf" title="Hoja Merkle SHA256: %s">#%d · %s</span> · %s</div>'
+    '</div></div>\n'
+)
+
+def format_message_text(text, message_type=TEXT_MESSAGE, domain=None):
+    """
+    Replaces omitted multimedia by its placeholder and marks YouTube links, from the type and
+    link domain of the message (see MessageStore.message_types).
+    """
+    if message_type == MEDIA_MESSAGE:
+        return "[Multimedia Omitido]"
+    if message_type == LINK_MESSAGE and domain in YOUTUBE_DOMAINS:
+        return f"[Video de YouTube] {text}"
+    return text
+
+def build_attachment_html(archive, name):
+    """
+    HTML for an attachment inside a bubble: its thumbnail (images only), name, size and SHA256.
+    """
+    info = archive.members[name]
+    thumbnail = archive.thumbnail(name)
+    image = f'<img class="attachment-thumb" src="{thumbnail}">' if thumbnail else ""
+    return (
+        f'{image}<div class="attachment-info">📎 {html.escape(name)} · {info.file_size / 1024:.1f} KB<br>'
+        f'SHA256: {archive.digest(name)}</div>'
+    )
+
+def build_chat_html(messages, positions, left_participant=None, right_participant=None, highlight_position=None, archive=None, header_html=""):
+    """
+    Builds the given messages as one HTML document, so they reach the browser in a single
+    front-end update (via streamlit.components.v1.html) regardless of how many there are.
+    messages: the MessageStore of the chat. positions: the positions of the messages to show.
+    Messages from right_participant use the green bubble on the right and those from
+    left_participant the beige bubble on the left. Without both participants, every message
+    is shown on the left. Text is HTML-escaped, since the document runs in its own iframe.
+    highlight_position: a message to highlight and scroll to (e.g. opened from a search result).
+    archive: the ChatArchive of a .zip export, to show the attachments of the visible messages.
+    header_html: extra HTML shown under the title (e.g. the file hashes in batch reports).
+    Every message shows its number and the start of its Merkle leaf hash (the full hash on hover).
+    """
+    escape = html.escape
+    senders = messages.senders
+    sender_ids = messages.sender_ids
+    texts = messages.texts
+    timestamps = messages.timestamps
+    message_types = messages.message_types
+    two_sided = bool(left_participant and right_participant)
+    left_id = messages.sender_ids_by_name.get(left_participant) if two_sided else None
+    right_id = messages.sender_ids_by_name.get(right_participant) if two_sided else None
+
+    parts = [
+        "<html><head><meta charset='utf-8'><style>", CHAT_DOCUMENT_CSS, "</style></head><body>",
+        "<div class='chat-header'>Conversación</div>", header_html, "<div class='chat-messages-area'>\n",
+    ]
+    for position in positions:
+        highlight_class = " highlighted" if position == highlight_position else ""
+        sender_id = sender_ids[position]
+        leaf_hex = messages.leaf_hash(position).hex()
+        if sender_id == MessageStore.SYSTEM_SENDER_ID:
+            parts.append(_SYSTEM_MESSAGE_HTML % (position, highlight_class, position + 1, leaf_hex, escape(texts[position])))
+            continue
+        if two_sided:
+            if sender_id == right_id:
+                use_green_bubble_style = True
+            elif sender_id == left_id:
+                use_green_bubble_style = False
+            else:
+                # Fallback for any other unexpected sender in a multi-person chat
+                parts.append(_SYSTEM_MESSAGE_HTML % (position, highlight_class, position + 1, leaf_hex, escape(texts[position])))
+                continue
+        else:
+            use_green_bubble_style = False
+        parts.append(_BUBBLE_HTML % (
+            position,
+            "right" if use_green_bubble_style else "left",
+            highlight_class,
+            "my-message" if use_green_bubble_style else "other-message",
+            "my-sender-color" if use_green_bubble_style else "other-sender-color",
+            escape(senders[sender_id]),
+            build_attachment_html(archive, archive.by_position[position]) if archive and position in archive.by_position else "",
+            escape(format_message_text(texts[position], message_types[position], messages.link_domain(position))),
+            leaf_hex,
+            position + 1,
+            leaf_hex[:LEAF_HASH_PREVIEW],
+            format_timestamp(timestamps[position]),
+        ))
+    parts.append("</div>")
+    if highlight_position in positions:
+        parts.append(f"<script>document.getElementById('m{highlight_position}').scrollIntoView({{block: 'center'}});</script>")
+    parts.append("</body></html>")
+    return "".join(parts)
+
+def display_message_bubble(sender_name, text, time, use_green_bubble_style, message_type=TEXT_MESSAGE, domain=None):
+    """
+    Displays a single chat message bubble using Streamlit's markdown.
+    sender_name: The name of the sender to display.
+    text: The message content.
+    time: The message timestamp.
+    use_green_bubble_style: True if it should use the 'my-message' style (green), False for 'other-message' style (white).
+    message_type, domain: the type code and link domain of the message, for its placeholder.
+    """
+    # Determine CSS classes based on desired bubble style
+    message_class = "my-message" if use_green_bubble_style else "other-message"
+    sender_color_class = "my-sender-color" if use_green_bubble_style else "other-sender-color"
+
+    # Handle multimedia and YouTube link placeholders
+    message_text = format_message_text(text, message_type, domain)
+
+    # HTML structure for a single message bubble
+    st.markdown(f"""
+        <div class="message-bubble {message_class}">
+            <div class="message-sender-name {sender_color_class}">
+                {sender_name}
+            </div>
+            <div>{message_text}</div>
+            <div class="message-time">
+                {time}
             </div>
-        """, unsafe_allow_html=True)
+        </div>
+    """, unsafe_allow_html=True)
 
-    # Parse the chat content and get detected participants
-    messages, detected_participants = parse_chat_content(file_content)
+# --- Modo por lotes (sin interfaz) ---
+# Extensiones de las exportaciones que procesa el modo por lotes
+EXPORT_EXTENSIONS = (".txt", ".zip")
+# Subcomandos de la línea de comandos (sin ellos, el script es la aplicación de Streamlit)
+CLI_COMMANDS = ("batch", "verify", "generate", "benchmark")
+
+def build_manifest_html(manifest):
+    """
+    HTML block with the file information and hashes of a manifest, for the batch reports.
+    """
+    return (
+        "<div class='report-info'>"
+        f"<div><strong>Nombre del archivo:</strong> {html.escape(manifest['file'])}</div>"
+        f"<div><strong>Tamaño del archivo:</strong> {manifest['size']} bytes</div>"
+        + "".join(
+            f"<div><strong>Hash {label}:</strong> {manifest[algorithm]}</div>"
+            for algorithm, label in HASH_ALGORITHMS.items() if algorithm in manifest
+        )
+        + f"<div><strong>Formato:</strong> {html.escape(manifest['format'])} · {manifest['messages']} mensajes</div>"
+        f"<div><strong>Raíz Merkle de los mensajes (SHA256):</strong> {manifest['merkle_root']}</div>"
+        "</div>"
+    )
 
-    # Filter out "Sistema" from detected participants
-    actual_participants = [p for p in detected_participants if p != "Sistema"]
+def process_export(path, output_dir, algorithms=DEFAULT_HASH_ALGORITHMS):
+    """
+    Processes one chat export without Streamlit (runs in a worker process of the batch mode).
+    Writes three files to output_dir, named after the export:
+    <name>.manifest.json: size and hashes (the given algorithms) of the export, and of its
+    attachments for .zip exports,
+    <name>.messages.jsonl: one parsed message per line, with its byte range and Merkle leaf hash,
+    <name>.report.html: the rendered conversation.
+    Returns the manifest.
+    """
+    with MappedFile(path) as export_file:
+        file_hashes = compute_file_hashes(export_file, algorithms)
+        chat_stream, archive = open_chat_export(export_file)
+        messages, participants = parse_chat_stream(chat_stream)
+        if archive is not None:
+            archive.link_messages(messages)
 
-    if not messages:
-        st.error("No se encontraron mensajes en el formato esperado. Asegúrate de que el archivo sea un chat exportado de WhatsApp.")
-    else:
-        # Identify the two main participants for alignment
-        if len(actual_participants) >= 2:
-            # Always pick the first two detected participants for alignment
-            st.session_state.participant1 = actual_participants[0]
-            st.session_state.participant2 = actual_participants[1]
-        elif len(actual_participants) == 1:
-            st.session_state.participant1 = actual_participants[0]
-            st.session_state.participant2 = None # Only one participant
-            st.warning(f"Solo se detectó un participante principal: '{st.session_state.participant1}'. La inversión de posición no tendrá efecto.")
+        manifest = {
+            "file": os.path.basename(path),
+            "size": os.path.getsize(path),
+            **file_hashes,
+            "format": messages.chat_format.name,
+            "messages": len(messages),
+            "participants": participants,
+            "merkle_root": MerkleTree(messages.leaf_hashes).root.hex(),
+        }
+        if archive is not None:
+            manifest["chat_member"] = archive.chat_member.filename
+            manifest["attachments"] = [
+                {"name": name, "size": info.file_size, "sha256": archive.digest(name)}
+                for name, info in sorted(archive.members.items())
+            ]
+
+        output_base = os.path.join(output_dir, os.path.basename(path))
+        with open(output_base + ".messages.jsonl", "w", encoding="utf-8") as dump:
+            for position in range(len(messages)):
+                record = messages.message(position)
+                if archive is not None and position in archive.by_position:
+                    record["attachment"] = archive.by_position[position]
+                dump.write(json.dumps(record, ensure_ascii=False) + "\n")
+        # Same alignment as the app: the first two participants, left and right
+        left_participant = participants[0] if len(participants) >= 2 else None
+        right_participant = participants[1] if len(participants) >= 2 else None
+        with open(output_base + ".report.html", "w", encoding="utf-8") as report:
+            report.write(build_chat_html(
+                messages, range(len(messages)), left_participant, right_participant,
+                archive=archive, header_html=build_manifest_html(manifest),
+            ))
+    with open(output_base + ".manifest.json", "w", encoding="utf-8") as manifest_file:
+        json.dump(manifest, manifest_file, ensure_ascii=False, indent=2)
+    return manifest
+
+# --- Banco de pruebas de rendimiento ---
+# Cantidades de mensajes que mide el banco de pruebas por defecto
+BENCHMARK_SIZES = (10_000, 100_000, 1_000_000)
+# Versión del formato de los resultados (cambia si cambian las etapas o lo que miden)
+BENCHMARK_FORMAT_VERSION = 1
+# Material de los chats sintéticos
+SYNTHETIC_NAMES = ("Ana", "Juan Pérez", "María José", "Beto", "Lucía", "Carlos Gómez", "Sofía", "Diego")
+SYNTHETIC_WORDS = (
+    "hola", "mañana", "reunión", "pago", "$1.500,50", "contrato", "audiencia", "llamame", "dale", "después",
+    "expediente", "ok", "gracias", "jueves", "oficina", "documentos", "café", "número", "transferencia", "😂",
+)
+SYNTHETIC_SYSTEM_MESSAGES = (
+    "Los mensajes y las llamadas están cifrados de extremo a extremo.",
+    "{} cambió el asunto del grupo.",
+    "{} se unió usando el enlace de invitación de este grupo.",
+)
+
+def generate_synthetic_chat(output, message_count, participants=2, multiline_ratio=0.1, media_ratio=0.05, system_ratio=0.01, seed=0):
+    """
+    Writes a synthetic WhatsApp export of message_count messages to the binary stream output, in
+    the default layout (Android, d/m/yyyy, 24 h), for benchmarks. Each message is a system event
+    with probability system_ratio, an omitted media placeholder with probability media_ratio, and
+    otherwise text, which has continuation lines with probability multiline_ratio. The random
+    generator is seeded, so the same arguments always write the same bytes. Raises ValueError when
+    participants is less than 1, since every message needs a sender.
+    """
+    if participants < 1:
+        raise ValueError("participants must be at least 1")
+    rng = random.Random(seed)
+    names = [
+        SYNTHETIC_NAMES[index % len(SYNTHETIC_NAMES)] + (f" {index // len(SYNTHETIC_NAMES) + 1}" if index >= len(SYNTHETIC_NAMES) else "")
+        for index in range(participants)
+    ]
+    timestamp = date_to_timestamp(datetime.date(2024, 1, 1)) + 8 * 3600
+    day_number = None
+    lines = []
+    for count in range(1, message_count + 1):
+        timestamp += rng.randint(5, 900)
+        if timestamp // SECONDS_PER_DAY != day_number:
+            day_number = timestamp // SECONDS_PER_DAY
+            day = datetime.date.fromordinal(EPOCH_ORDINAL + day_number)
+            date_text = f"{day.day}/{day.month}/{day.year}, "
+        seconds = timestamp % SECONDS_PER_DAY
+        header = f"{date_text}{seconds // 3600:02d}:{seconds // 60 % 60:02d} - "
+        draw = rng.random()
+        if draw < system_ratio:
+            lines.append(header + rng.choice(SYNTHETIC_SYSTEM_MESSAGES).format(rng.choice(names)))
+        elif draw < system_ratio + media_ratio:
+            lines.append(f"{header}{rng.choice(names)}: <Multimedia omitido>")
+        else:
+            lines.append(f"{header}{rng.choice(names)}: {' '.join(rng.choices(SYNTHETIC_WORDS, k=rng.randint(1, 12)))}")
+            if rng.random() < multiline_ratio:
+                lines.extend(" ".join(rng.choices(SYNTHETIC_WORDS, k=rng.randint(1, 12))) for _ in range(rng.randint(1, 3)))
+        if count % PROGRESS_INTERVAL == 0:
+            output.write(("\n".join(lines) + "\n").encode("utf-8"))
+            lines = []
+    if lines:
+        output.write(("\n".join(lines) + "\n").encode("utf-8"))
+
+def _hash_export(path, algorithms):
+    """Digests of a file with MultiHasher, for one algorithm at a time."""
+    hasher = MultiHasher(algorithms)
+    with open(path, "rb") as export_file:
+        for chunk in iter(lambda: export_file.read(CHUNK_SIZE), b""):
+            hasher.update(chunk)
+    return hasher.hexdigests()
+
+def _compute_export_hashes(path):
+    """The hashes of an upload, as the app computes them (see compute_file_hashes)."""
+    with open(path, "rb") as export_file:
+        return compute_file_hashes(export_file)
+
+def _read_and_decode(path):
+    """Reads an export line by line and decodes every line, as parsing does before matching."""
+    with open(path, "rb") as export_file:
+        for raw_line in iter_chat_lines(export_file):
+            raw_line.decode("utf-8", "replace")
+
+def _parse_export(path):
+    with open(path, "rb") as export_file:
+        return parse_chat_content(export_file)[0]
+
+def _parse_mapped_export(path):
+    with MappedFile(path) as export_file:
+        return len(parse_mapped_chat(export_file.map)[0])
+
+def benchmark_stages(path, state):
+    """
+    The stages timed by run_benchmark on the export at path, as (name, callable) pairs in order.
+    The parse stage stores its MessageStore in state, for the stages that work on it: the
+    search index, the Merkle tree, the analytics and the HTML of the largest viewer page
+    ("render_page", one rerun of the render loop) and of the whole chat ("render_report", as in
+    the batch reports).
+    """
+    def parse():
+        state["messages"] = _parse_export(path)
+
+    def render(positions):
+        messages = state["messages"]
+        participants = messages.participants
+        return build_chat_html(messages, positions(messages), participants[0], participants[1] if len(participants) > 1 else None)
+
+    return [
+        ("read_decode", lambda: _read_and_decode(path)),
+        ("hash_sha256", lambda: _hash_export(path, ("sha256",))),
+        ("hash_md5", lambda: _hash_export(path, ("md5",))),
+        ("hashes", lambda: _compute_export_hashes(path)),
+        ("parse", parse),
+        ("parse_mapped", lambda: _parse_mapped_export(path)),
+        ("search_index", lambda: SearchIndex.build(state["messages"])),
+        ("merkle", lambda: MerkleTree(state["messages"].leaf_hashes)),
+        ("analytics", lambda: compute_chat_analytics(state["messages"])),
+        ("render_page", lambda: render(lambda messages: range(min(PAGE_SIZES[-1], len(messages))))),
+        ("render_report", lambda: render(lambda messages: range(len(messages)))),
+    ]
+
+def _current_commit():
+    """Short hash of the git commit of this script (with "+" if it has local changes), or None."""
+    directory = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=directory, capture_output=True, text=True, check=True).stdout.strip()
+        changes = subprocess.run(["git", "status", "--porcelain", "--", os.path.basename(__file__)], cwd=directory, capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ("+" if changes.strip() else "")
+
+def run_benchmark(sizes=BENCHMARK_SIZES, repeat=3, work_dir=None, measure_memory=True, report=print, **generator_options):
+    """
+    Times every stage of benchmark_stages on synthetic exports of each size (see
+    generate_synthetic_chat, which takes generator_options). Each stage keeps its best time of
+    repeat runs; then, if measure_memory, one more run under tracemalloc records its peak of
+    Python memory above what was allocated before it (memory maps are not counted).
+    Exports are written to work_dir (a temporary directory by default) and reused from it when
+    they already exist, since the same options always generate the same file.
+    Returns the results as a dict that can be saved as JSON and compared with compare_benchmarks:
+    the environment (commit, Python version, platform), the options and, per size, the export
+    size and {stage: {"seconds", "peak_mib"}}.
+    """
+    options = {"participants": 2, "multiline_ratio": 0.1, "media_ratio": 0.05, "system_ratio": 0.01, "seed": 0, **generator_options}
+    results = {
+        "format": BENCHMARK_FORMAT_VERSION,
+        "commit": _current_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "repeat": repeat,
+        "generator": options,
+        "sizes": {},
+    }
+    with tempfile.TemporaryDirectory() as temporary_dir:
+        directory = work_dir or temporary_dir
+        os.makedirs(directory, exist_ok=True)
+        for size in sizes:
+            option_text = "-".join(str(value) for value in options.values())
+            path = os.path.join(directory, f"sintetico-{size}-{option_text}.txt")
+            if not os.path.exists(path):
+                with open(path + ".tmp", "wb") as output:
+                    generate_synthetic_chat(output, size, **options)
+                os.replace(path + ".tmp", path)
+            stages = {}
+            state = {}
+            for name, stage in benchmark_stages(path, state):
+                best = None
+                for _ in range(repeat):
+                    gc.collect()
+                    started = time.perf_counter()
+                    stage()
+                    elapsed = time.perf_counter() - started
+                    best = elapsed if best is None else min(best, elapsed)
+                stages[name] = {"seconds": round(best, 6), "peak_mib": None}
+                if measure_memory:
+                    gc.collect()
+                    tracemalloc.start()
+                    baseline = tracemalloc.get_traced_memory()[0]
+                    stage()
+                    peak = tracemalloc.get_traced_memory()[1]
+                    tracemalloc.stop()
+                    stages[name]["peak_mib"] = round((peak - baseline) / (1024 * 1024), 2)
+                report(f"{size:>9} {name:<14} {best:9.3f} s" + (f" {stages[name]['peak_mib']:9.1f} MiB" if measure_memory else ""))
+            results["sizes"][str(size)] = {"bytes": os.path.getsize(path), "stages": stages}
+    return results
+
+def compare_benchmarks(base, current):
+    """
+    Lines comparing two run_benchmark results (e.g. of two commits): the time of every stage
+    and size measured in both, and the change relative to base.
+    """
+    lines = [f"{'mensajes':>9} {'etapa':<14} {base.get('commit') or 'base':>10} {current.get('commit') or 'actual':>10}  cambio"]
+    for size, measured in current["sizes"].items():
+        base_stages = base["sizes"].get(size, {}).get("stages", {})
+        for name, stage in measured["stages"].items():
+            if name not in base_stages:
+                continue
+            before = base_stages[name]["seconds"]
+            after = stage["seconds"]
+            change = f"{(after - before) / before:+.1%}" if before else "—"
+            lines.append(f"{size:>9} {name:<14} {before:9.3f}s {after:9.3f}s  {change}")
+    return lines
+
+def cli_main(argv=None):
+    """
+    Command line entry point. "batch INPUT_DIR" processes every .txt/.zip export of a directory,
+    spreading the files over a pool of worker processes (one per CPU core by default).
+    "verify PROOF EXPORT" checks the inclusion proof of a cited message against an export.
+    "generate OUTPUT" writes a synthetic export and "benchmark" times the processing stages on
+    synthetic exports (see run_benchmark), optionally against the results of another commit.
+    Returns the exit code: 0 if every export was processed (or the proof holds), 1 otherwise.
+    """
+    parser = argparse.ArgumentParser(
+        prog="Whatsapp-generalSiningresodenombre4.py",
+        description="Visualizador de Chat de WhatsApp - procesamiento sin interfaz.",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    batch_parser = commands.add_parser("batch", help="Procesa en lote un directorio de chats exportados (.txt o .zip).")
+    batch_parser.add_argument("input_dir", help="Directorio con los chats exportados.")
+    batch_parser.add_argument("-o", "--output-dir", help="Directorio de salida (por defecto, INPUT_DIR/reportes).")
+    batch_parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="Cantidad de procesos (por defecto, uno por núcleo).")
+    batch_parser.add_argument(
+        "-a", "--algorithms",
+        default=",".join(DEFAULT_HASH_ALGORITHMS),
+        help=f"Algoritmos de hash separados por comas, entre: {', '.join(HASH_ALGORITHMS)} (por defecto, sha256,md5).",
+    )
+    verify_parser = commands.add_parser("verify", help="Verifica la prueba de inclusión de un mensaje citado contra el chat exportado.")
+    verify_parser.add_argument("proof_file", help="Prueba de inclusión (.json) descargada del visualizador.")
+    verify_parser.add_argument("export_file", help="Chat exportado (.txt o .zip) del que se citó el mensaje.")
+    generator_arguments = argparse.ArgumentParser(add_help=False)
+    generator_arguments.add_argument("--participants", type=int, default=2, help="Cantidad de participantes (por defecto, 2).")
+    generator_arguments.add_argument("--multiline-ratio", type=float, default=0.1, help="Proporción de mensajes de varias líneas (por defecto, 0.1).")
+    generator_arguments.add_argument("--media-ratio", type=float, default=0.05, help="Proporción de multimedia omitida (por defecto, 0.05).")
+    generator_arguments.add_argument("--system-ratio", type=float, default=0.01, help="Proporción de mensajes del sistema (por defecto, 0.01).")
+    generator_arguments.add_argument("--seed", type=int, default=0, help="Semilla del generador (por defecto, 0).")
+    generate_parser = commands.add_parser("generate", parents=[generator_arguments], help="Genera un chat exportado sintético, para pruebas de rendimiento.")
+    generate_parser.add_argument("output_file", help="Archivo .txt a generar.")
+    generate_parser.add_argument("-n", "--messages", type=int, default=BENCHMARK_SIZES[0], help=f"Cantidad de mensajes (por defecto, {BENCHMARK_SIZES[0]}).")
+    benchmark_parser = commands.add_parser("benchmark", parents=[generator_arguments], help="Mide el tiempo y la memoria de cada etapa del procesamiento sobre chats sintéticos.")
+    benchmark_parser.add_argument(
+        "-s", "--sizes",
+        default=",".join(str(size) for size in BENCHMARK_SIZES),
+        help=f"Cantidades de mensajes separadas por comas (por defecto, {','.join(str(size) for size in BENCHMARK_SIZES)}).",
+    )
+    benchmark_parser.add_argument("-r", "--repeat", type=int, default=3, help="Repeticiones de cada etapa; se conserva la más rápida (por defecto, 3).")
+    benchmark_parser.add_argument("-o", "--output", help="Archivo .json donde guardar los resultados.")
+    benchmark_parser.add_argument("-c", "--compare", help="Resultados (.json) de otra versión contra los que comparar.")
+    benchmark_parser.add_argument("-w", "--work-dir", help="Directorio donde generar (y reutilizar) los chats sintéticos.")
+    benchmark_parser.add_argument("--no-memory", action="store_true", help="No medir la memoria (evita la ejecución adicional con tracemalloc).")
+    args = parser.parse_args(argv)
+    if args.command in ("generate", "benchmark"):
+        if args.participants < 1:
+            parser.error("--participants debe ser al menos 1")
+        generator_options = {
+            "participants": args.participants,
+            "multiline_ratio": args.multiline_ratio,
+            "media_ratio": args.media_ratio,
+            "system_ratio": args.system_ratio,
+            "seed": args.seed,
+        }
+    if args.command == "generate":
+        with open(args.output_file, "wb") as output:
+            generate_synthetic_chat(output, args.messages, **generator_options)
+        print(f"{args.messages} mensajes sintéticos escritos en {args.output_file}")
+        return 0
+    if args.command == "benchmark":
+        sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+        results = run_benchmark(sizes, args.repeat, args.work_dir, not args.no_memory, **generator_options)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as output:
+                json.dump(results, output, ensure_ascii=False, indent=2)
+            print(f"Resultados guardados en {args.output}")
+        if args.compare:
+            with open(args.compare, encoding="utf-8") as base_file:
+                print("\n".join(compare_benchmarks(json.load(base_file), results)))
+        return 0
+    if args.command == "verify":
+        with open(args.proof_file, encoding="utf-8") as proof_file:
+            proof = json.load(proof_file)
+        with MappedFile(args.export_file) as export_file:
+            try:
+                leaf_matches, root_matches, encoding = verify_message_proof(proof, export_file)
+            except KeyError:
+                print(f"El archivo no contiene el chat '{proof['chat_member']}' de la prueba.", file=sys.stderr)
+                return 1
+        if proof.get("encoding", "utf-8") != encoding:
+            print(f"Aviso: la prueba es de una exportación en {proof['encoding'].upper()} y este archivo está en {encoding.upper()}.", file=sys.stderr)
+        print(f"Mensaje #{proof['message_number']} (bytes {proof['byte_start']}-{proof['byte_end']}): "
+              f"hoja {'OK' if leaf_matches else 'NO COINCIDE'}, raíz Merkle {'OK' if root_matches else 'NO COINCIDE'}")
+        return 0 if leaf_matches and root_matches else 1
+
+    algorithms = tuple(name.strip().lower() for name in args.algorithms.split(",") if name.strip())
+    unknown_algorithms = [name for name in algorithms if name not in HASH_ALGORITHMS]
+    if unknown_algorithms:
+        parser.error(f"algoritmos de hash desconocidos: {', '.join(unknown_algorithms)}")
+
+    exports = sorted(
+        entry.path for entry in os.scandir(args.input_dir)
+        if entry.is_file() and entry.name.lower().endswith(EXPORT_EXTENSIONS)
+    )
+    if not exports:
+        print(f"No se encontraron chats exportados (.txt o .zip) en {args.input_dir}", file=sys.stderr)
+        return 1
+    output_dir = args.output_dir or os.path.join(args.input_dir, "reportes")
+    os.makedirs(output_dir, exist_ok=True)
+
+    failures = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        futures = {executor.submit(process_export, path, output_dir, algorithms): path for path in exports}
+        for future in concurrent.futures.as_completed(futures):
+            name = os.path.basename(futures[future])
+            try:
+                manifest = future.result()
+            except Exception as error:
+                failures += 1
+                print(f"ERROR {name}: {error}", file=sys.stderr)
+                continue
+            print(f"OK    {name}  SHA256 {manifest['sha256']}  {manifest['messages']} mensajes")
+    print(f"{len(exports) - failures} de {len(exports)} chats procesados. Resultados en {output_dir}")
+    return 1 if failures else 0
+
+# --- Streamlit App Layout ---
+def main(timings):
+    """
+    Streamlit app: runs on every rerun when started with "streamlit run". Each part of the
+    page is measured as a phase of timings (a PhaseTimings).
+    """
+    timings.start("page")
+    st.set_page_config(page_title="Visualizador de Chat de WhatsApp", layout="centered")
+
+    st.markdown("""
+        <style>
+            @import url('https://fonts.googleapis.com/css2?family=Inter:wght@400;700&display=swap');
+            /* Import Font Awesome for icons */
+            @import url('https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0-beta3/css/all.min.css');
+
+            html, body, [class*="st-"] {
+                font-family: "Inter", sans-serif;
+                color: #333;
+            }
+            /* El fondo de toda la aplicación (fuera del chat-container) */
+            .stApp {
+                background-color: #f0f2f5; /* Color de fondo general */
+            }
+            /* El contenedor principal del chat, ahora con la imagen de fondo */
+            .chat-container {
+                /*background-image: url('https://i.pinimg.com/736x/3a/2e/99/3a2e99d16f179dae33e2c394be2229fb.jpg'); */
+                background-size: cover;
+                background-position: center;
+                background-attachment: local; /* Permite que el fondo se desplace con el contenido si el contenedor es scrollable */
+                background-repeat: no-repeat;
+                border-radius: 12px;
+                box-shadow: 0 4px 12px rgba(0, 0, 0, 0.1);
+                padding: 20px;
+                margin-top: 20px;
+                border: 1px solid rgba(0, 0, 0, 0.1); /* Borde fino al cuadro de conversación */
+            }
+            .chat-header {
+                background-color: #075e54;
+                color: white;
+                padding: 16px;
+                border-top-left-radius: 12px;
+                border-top-right-radius: 12px;
+                font-weight: bold;
+                text-align: center;
+                margin: -20px -20px 20px -20px; /* Adjust to cover padding */
+            }
+            .chat-messages-area {
+                display: flex;
+                flex-direction: column;
+                overflow-y: auto;
+                max-height: 70vh; /* Max height for the messages area */
+                padding: 20px; /* Padding for the entire message area */
+                background-color: transparent; /* Aseguramos que no tenga color de fondo propio */
+            }
+    """ + CHAT_BUBBLE_CSS + """        /* Style for the button */
+            .stButton>button {
+                background-color: #25d366;
+                color: white;
+                padding: 10px 20px;
+                border-radius: 8px;
+                font-weight: bold;
+                cursor: pointer;
+                transition: background-color 0.3s ease;
+                box-shadow: 0 2px 4px rgba(0, 0, 0, 0.2);
+                border: none;
+            }
+            .stButton>button:hover {
+                background-color: #1da851;
+            }
+            /* New style for hash info box */
+            .hash-info-box {
+                background-color: #e7f3ff; /* Light blue for information */
+                border-left: 5px solid #2196F3; /* Blue border on the left */
+                border-radius: 8px;
+                padding: 15px;
+                margin-top: 15px;
+                margin-bottom: 15px;
+                box-shadow: 0 2px 5px rgba(0, 0, 0, 0.1);
+                font-size: 0.9em;
+                color: #333;
+                width: 100%; /* Asegura que ocupe todo el ancho disponible */
+            }
+            .hash-info-box strong {
+                color: #0056b3;
+            }
+            .hash-info-box .hash-value {
+                display: inline-block; /* Permite aplicar padding y background sin romper la línea */
+                word-break: break-all; /* Permite que los hashes largos se rompan en cualquier punto */
+                color: #495057; /* Color gris oscuro para los hashes */
+                padding: 0px 0px; /* Espaciado interno para el hash */
+                border-radius: 4px; /* Bordes ligeramente redondeados para el hash */
+                font-size: 0.95em; /* Ligeramente más grande para el hash */
+                margin-left: 5px; /* Pequeño margen para separar del label */
+            }
+            /* Mapa de calor de la actividad por día y hora */
+            .activity-heatmap {
+                border-collapse: collapse;
+                font-size: 0.7em;
+                margin-bottom: 15px;
+            }
+            .activity-heatmap th, .activity-heatmap td {
+                border: 1px solid #e0e0e0;
+                padding: 2px 4px;
+                text-align: center;
+                min-width: 22px;
+            }
+            .activity-heatmap th {
+                color: #555;
+                font-weight: normal;
+            }
+            /* Estilo para la firma profesional */
+            .professional-signature {
+                text-align: center;
+                margin-top: 30px;
+                padding: 15px;
+                background-color: #e9ecef; /* Un gris claro para el fondo */
+                border-radius: 8px;
+                border: 1px solid #ced4da;
+                box-shadow: 0 2px 5px rgba(0, 0, 0, 0.05);
+            }
+            .professional-signature p {
+                margin: 5px 0;
+                font-size: 0.95em;
+                color: #495057;
+            }
+            .professional-signature strong {
+                color: #212529;
+                font-size: 1.1em;
+            }
+            /* Estilo para la descripción de la herramienta */
+            .tool-description {
+                text-align: justify;
+                margin-top: 10px;
+                margin-bottom: 20px;
+                padding: 10px 20px;
+                background-color: #e6f7ff; /* Un azul muy claro */
+                border-left: 5px solid #007bff; /* Borde azul para destacar */
+                border-radius: 8px;
+                font-size: 0.9em;  /* Puedes eliminar esta línea o ajustarla */
+                color: #333;
+                box-shadow: 0 2px 5px rgba(0, 0, 0, 0.05);
+            }
+            .tool-description p {
+                font-size: 0.85em; /* Ajusta este valor para hacer la letra más pequeña */
+                margin: 0; /* Elimina el margen por defecto de los párrafos si no lo necesitas */
+            }
+        </style>
+    """, unsafe_allow_html=True)
+
+    # Título de la aplicación con icono de WhatsApp
+    st.markdown("## <i class='fab fa-whatsapp'></i> Visualizador de Chat de WhatsApp", unsafe_allow_html=True)
+
+    # Descripción de la herramienta
+    st.markdown("""
+        <div class="tool-description">
+            <p> Esta aplicación ha sido diseñada por Marcelo G. Montiel, Analista Universitario de Sistemas - Universidad Tecnológica Nacional, con el propósito de optimizar la visualización de los chats exportados de WhatsApp. Ofreciendo una interfaz gráfica que emula la experiencia original de WhatsApp, esta herramienta facilita una lectura y análisis más eficientes de las conversaciones. Adicionalmente, incorpora funcionalidades técnicas, como el cálculo de hashes, lo cual es de particular relevancia en el ámbito de las Pericias Informáticas para la verificación de la integridad de los datos. El código fuente de esta herramienta se encuentra a disposición para aquellos interesados en su estudio y aplicación, bajo la premisa de:
+            <strong> "Que la sabiduría no sea humillación para tú prójimo. Omar Khayyam".</strong></p> 
+        </div>
+    """, unsafe_allow_html=True)
+
+    # Initialize session state for alignment if not already set
+    if 'invert_alignment' not in st.session_state:
+        st.session_state.invert_alignment = False
+    if 'participant1' not in st.session_state:
+        st.session_state.participant1 = None
+    if 'participant2' not in st.session_state:
+        st.session_state.participant2 = None
+    for prefix in UPLOAD_STATE_PREFIXES:
+        if prefix + 'hashing_job' not in st.session_state:
+            st.session_state[prefix + 'hashing_job'] = None
+        if prefix + 'ingestion' not in st.session_state:
+            st.session_state[prefix + 'ingestion'] = None
+    if 'cancelled_ingestion' not in st.session_state:
+        st.session_state.cancelled_ingestion = None
+    if 'viewer_file' not in st.session_state:
+        st.session_state.viewer_file = None
+    if 'viewer_position' not in st.session_state:
+        st.session_state.viewer_position = 0
+    if 'highlight_position' not in st.session_state:
+        st.session_state.highlight_position = None
+
+    # File uploader for WhatsApp chat .txt file
+    timings.start("upload")
+    uploaded_file = st.file_uploader("Carga tu archivo de chat de WhatsApp (.txt o .zip con multimedia)", type=["txt", "zip"])
+    if CASE_FILES_DIR:
+        # Exports already on the server are mapped in place instead of uploaded
+        with st.expander("🗄️ Abrir un chat de la carpeta de causas del servidor"):
+            case_file = st.selectbox(
+                "Exportación en el servidor",
+                [None] + list_case_files(CASE_FILES_DIR),
+                format_func=lambda path: "—" if path is None else path,
+                key="case_file",
+            )
+        if uploaded_file is None and case_file is not None:
+            case_path = os.path.join(CASE_FILES_DIR, case_file)
+            status = os.stat(case_path)
+            case_key = (case_path, status.st_size, status.st_mtime_ns)
+            if st.session_state.get("case_file_map", (None,))[0] != case_key:
+                st.session_state.case_file_map = (case_key, MappedFile(case_path))
+            uploaded_file = st.session_state.case_file_map[1]
+    st.info("¡Hola! Para empezar, por favor, selecciona un archivo de chat de WhatsApp (.txt o .zip).")
+    # Button to toggle message alignment
+    if st.button("Invertir Posición de Mensajes"):
+        st.session_state.invert_alignment = not st.session_state.invert_alignment
+
+    if uploaded_file is None:
+        # The upload was removed (and with it the earlier export): stop processing them
+        for prefix in UPLOAD_STATE_PREFIXES:
+            stop_upload(prefix)
+
+    job = None
+    previous_job = None
+
+    if uploaded_file is not None:
+        timings.context["file"] = uploaded_file.name
+        hash_algorithms = st.multiselect(
+            "Algoritmos de hash",
+            list(HASH_ALGORITHMS),
+            default=list(DEFAULT_HASH_ALGORITHMS),
+            format_func=HASH_ALGORITHMS.get,
+            key="hash_algorithms",
+        )
+        # Optional earlier export of the same chat: only the new messages are processed
+        with st.expander("🔁 Comparar con una exportación anterior del mismo chat"):
+            previous_file = st.file_uploader(
+                "Exportación anterior del mismo chat (.txt o .zip)",
+                type=["txt", "zip"],
+                key="previous_upload",
+                help="Los mensajes que no cambiaron se toman de la exportación anterior; solo se procesan los nuevos y se informan los agregados, faltantes o alterados.",
+            )
+        base = None
+        if previous_file is not None:
+            # Processed like the upload, in worker threads shared by content (its hashes are
+            # not shown); the upload is only hashed until it is ready
+            timings.start("previous_export")
+            previous_hashing_job, previous_job, previous_hashes = ingest_upload("previous_", previous_file, (), None)
+            if previous_job.state == "done":
+                previous_data = previous_job.result
+                base = (previous_job.file_hashes["sha256"], previous_data)
+        else:
+            stop_upload("previous_")
+        previous_ready = previous_file is None or base is not None
+
+        # Hash the upload and, meanwhile, parse, index and build the Merkle tree (see
+        # ingest_upload); the ChatCache shares the chat by content with every session
+        timings.start("ingestion")
+        hashing_job, job, file_hashes = ingest_upload("", uploaded_file, hash_algorithms, base, ingest=previous_ready)
+        if file_hashes is not None:
+            # The hashes are shown as soon as they are known, while the chat is processed
+            hash_lines = "".join(
+                f'<div><strong>Hash {label}:</strong> <span class="hash-value">{file_hashes[algorithm]}</span></div>'
+                for algorithm, label in HASH_ALGORITHMS.items() if algorithm in file_hashes
+            )
+
+            # Display file information and hashes in a highlighted box using st.expander
+            with st.expander("📊 Información y Hashes del Archivo Cargado", expanded=True):
+                # Utilizar divs para cada línea de información para un mejor control del layout
+                # y asegurar que el label y el valor estén en la misma línea.
+                st.markdown(f"""
+                    <div class="hash-info-box">
+                        <div><strong>Nombre del archivo:</strong> {uploaded_file.name}</div>
+                        <div><strong>Tamaño del archivo:</strong> {uploaded_file.size / 1024:.2f} KB</div>
+                        {hash_lines}
+                    </div>
+                """, unsafe_allow_html=True)
+
+        # Parsed chat and detected participants (empty until the worker threads are done)
+        chat_data = job.result if job is not None and job.state == "done" else None
+        messages = chat_data["messages"] if chat_data is not None else MessageStore()
+        detected_participants = chat_data["participants"] if chat_data is not None else []
+
+        # Filter out "Sistema" from detected participants
+        actual_participants = [p for p in detected_participants if p != "Sistema"]
+
+        if chat_data is None:
+            # Still processing (or stopped): progress panel instead of the viewer, first of the
+            # earlier export. A failed hashing fails the ingestion waiting for it too
+            if previous_ready:
+                prefix, shown_hashing_job, shown_job, shown_hashes, shown_file = "", hashing_job, job, file_hashes, uploaded_file
+            else:
+                prefix, shown_hashing_job, shown_job, shown_hashes, shown_file = "previous_", previous_hashing_job, previous_job, previous_hashes, previous_file
+            if shown_job.state == "running":
+                if not previous_ready:
+                    st.caption(f"Procesando primero la exportación anterior '{previous_file.name}'.")
+                show_ingestion_progress(prefix, shown_hashing_job, shown_job, shown_hashes is not None)
+            elif shown_job.state == "cancelled":
+                st.warning("Se canceló el procesamiento del chat." if previous_ready else "Se canceló el procesamiento de la exportación anterior.")
+                st.button("Reintentar", on_click=restart_ingestion)
+            else:
+                st.error(f"No se pudo procesar el archivo '{shown_file.name}': {shown_job.error}")
+        elif not messages:
+            st.error("No se encontraron mensajes en el formato esperado. Asegúrate de que el archivo sea un chat exportado de WhatsApp.")
         else:
-            st.session_state.participant1 = None
-            st.session_state.participant2 = None
-            st.warning("No se detectaron suficientes participantes para alinear el chat (se necesitan al menos dos).")
+            # The chat is identified by the SHA256 its job waited for (the session may be hashing
+            # the upload again, with other algorithms)
+            sha256_hash = job.file_hashes["sha256"]
+            # Identify the two main participants for alignment
+            if len(actual_participants) >= 2:
+                # Always pick the first two detected participants for alignment
+                st.session_state.participant1 = actual_participants[0]
+                st.session_state.participant2 = actual_participants[1]
+            elif len(actual_participants) == 1:
+                st.session_state.participant1 = actual_participants[0]
+                st.session_state.participant2 = None # Only one participant
+                st.warning(f"Solo se detectó un participante principal: '{st.session_state.participant1}'. La inversión de posición no tendrá efecto.")
+            else:
+                st.session_state.participant1 = None
+                st.session_state.participant2 = None
+                st.warning("No se detectaron suficientes participantes para alinear el chat (se necesitan al menos dos).")
         
-        # Display identified participants for user info
-        st.info(f"Participantes identificados en el chat: **{', '.join(actual_participants) if actual_participants else 'Ninguno (solo mensajes del sistema)'}**")
+            # Display identified participants for user info
+            st.info(f"Participantes identificados en el chat: **{', '.join(actual_participants) if actual_participants else 'Ninguno (solo mensajes del sistema)'}**")
+            st.caption(f"Formato de exportación detectado: {messages.chat_format.name}")
+            if chat_data["from_store"]:
+                st.caption("Chat abierto desde el almacén persistente: ya había sido procesado, no se volvió a procesar.")
+            if chat_data["encoding"] == "utf-16":
+                st.caption("Exportación en UTF-16: convertida a UTF-8 para analizarla; los rangos de bytes de los mensajes se refieren a esa conversión (los hashes, al archivo original).")
+            if chat_data["archive"] is not None:
+                archive = chat_data["archive"]
+                hashed_count = len(archive.known_digests())
+                st.caption(
+                    f"Archivo .zip: chat leído de '{archive.chat_member.filename}', {len(archive.members)} adjuntos indexados"
+                    + (f" ({hashed_count} con su SHA256 ya calculado; el resto se calcula en segundo plano)." if hashed_count < len(archive.members) else ".")
+                )
 
-        st.markdown("<div class='chat-container'>", unsafe_allow_html=True)
-        st.markdown("<div class='chat-header'>Conversación</div>", unsafe_allow_html=True) # Re-agregado el título "Conversación"
+            if previous_file is not None:
+                timings.start("diff")
+                changes = chat_data["changes"]
+                change_counts = collections.Counter(change[0] for change in changes)
+                with st.expander("🔁 Diferencias con la exportación anterior", expanded=True):
+                    st.markdown(
+                        f"**{chat_data['shared_messages']}** mensajes en común con '{html.escape(previous_file.name)}' (no se volvieron a procesar) · "
+                        f"**{change_counts['added']}** agregados · **{change_counts['missing']}** faltantes · **{change_counts['altered']}** alterados"
+                    )
+                    if changes:
+                        change_labels = {"added": "Agregado", "missing": "Faltante", "altered": "Alterado"}
+                        diff_arguments = (sha256_hash, base[0], changes, previous_data["messages"], messages)
+                        st.dataframe(
+                            [
+                                {
+                                    "Cambio": change_labels[record["change"]],
+                                    "N° anterior": record["old_number"],
+                                    "N° nuevo": record["new_number"],
+                                    "Fecha": record["timestamp"],
+                                    "Remitente": record["sender"],
+                                    "Texto": record["text"],
+                                    "Texto anterior": record.get("old_text"),
+                                }
+                                for record in diff_rows(*diff_arguments)
+                            ],
+                            hide_index=True,
+                        )
+                        if len(changes) > DIFF_ROWS_LIMIT:
+                            st.caption(f"Se muestran las primeras {DIFF_ROWS_LIMIT} diferencias de {len(changes)}.")
+                        # Built when the button is clicked, not on every rerun
+                        st.download_button(
+                            "Descargar diferencias (JSON)",
+                            lambda: diff_json(*diff_arguments),
+                            file_name=f"{uploaded_file.name}.diferencias.json",
+                            mime="application/json",
+                        )
 
-        # Use a container for the scrollable chat messages area
-        with st.container():
-            st.markdown("<div class='chat-messages-area'>", unsafe_allow_html=True)
-            
+            # Árbol de Merkle: cada mensaje citado se puede verificar con su prueba de inclusión
+            timings.start("merkle")
+            merkle_tree = chat_data["merkle_tree"]
+            with st.expander("🌳 Verificación de mensajes (árbol de Merkle)"):
+                st.markdown(
+                    f'<div class="hash-info-box"><div><strong>Raíz Merkle (SHA256):</strong> '
+                    f'<span class="hash-value">{merkle_tree.root.hex()}</span></div></div>',
+                    unsafe_allow_html=True,
+                )
+                st.caption(
+                    "Cada mensaje es una hoja: SHA256(0x00 + bytes del mensaje). La prueba de un mensaje contiene "
+                    "solo los hashes hermanos hasta la raíz y se verifica con: "
+                    "python Whatsapp-generalSiningresodenombre4.py verify PRUEBA.json CHAT"
+                )
+                proof_number = st.number_input("Número de mensaje", min_value=1, max_value=len(messages), step=1, key="proof_message_number")
+                proof_position = proof_number - 1
+                st.markdown(
+                    f"<small>{format_timestamp(messages.timestamps[proof_position])} — "
+                    f"<strong>{html.escape(messages.senders[messages.sender_ids[proof_position]])}</strong> · "
+                    f"bytes {messages.byte_starts[proof_position]}–{messages.byte_ends[proof_position]}<br>"
+                    f"Hoja: <code>{messages.leaf_hash(proof_position).hex()}</code></small>",
+                    unsafe_allow_html=True,
+                )
+                message_proof = build_message_proof(
+                    messages, merkle_tree, proof_position, uploaded_file.name, sha256_hash,
+                    chat_member=chat_data["archive"].chat_member.filename if chat_data["archive"] is not None else None,
+                    encoding=chat_data["encoding"],
+                )
+                proof_col, view_col = st.columns([3, 1])
+                proof_col.download_button(
+                    f"Descargar prueba del mensaje #{proof_number} ({len(message_proof['proof'])} hashes)",
+                    json.dumps(message_proof, ensure_ascii=False, indent=2),
+                    file_name=f"{uploaded_file.name}.mensaje-{proof_number}.proof.json",
+                    mime="application/json",
+                )
+                view_col.button("Ver en el chat", key="proof_show_message", on_click=show_message, args=(proof_position,))
+
+            # Estadísticas de actividad, calculadas una vez por archivo sobre las columnas del chat
+            timings.start("analytics")
+            with st.expander("📈 Actividad del chat"):
+                analytics = chat_analytics(sha256_hash, messages)
+                per_sender = analytics["per_sender"]
+                participant_total = max(int(per_sender[1:].sum()), 1)
+                st.markdown(
+                    f"**{len(messages)}** mensajes en **{analytics['active_days']}** días con actividad · "
+                    f"**{int(per_sender[MessageStore.SYSTEM_SENDER_ID])}** eventos del sistema"
+                )
+                st.dataframe(
+                    [
+                        {
+                            "Participante": messages.senders[sender_id],
+                            "Mensajes": int(per_sender[sender_id]),
+                            "Porcentaje": 100 * int(per_sender[sender_id]) / participant_total,
+                            "Respuestas": int(analytics["response_counts"][sender_id].sum()),
+                            "Mediana de respuesta": format_duration(analytics["response_medians"][sender_id]),
+                            "Percentil 90 de respuesta": format_duration(analytics["response_p90"][sender_id]),
+                        }
+                        for sender_id in sorted(range(1, len(messages.senders)), key=lambda sender_id: -per_sender[sender_id])
+                    ],
+                    column_config={"Porcentaje": st.column_config.ProgressColumn("Porcentaje", format="%.1f%%", min_value=0, max_value=100)},
+                    hide_index=True,
+                )
+                st.markdown("**Mensajes por día de la semana y hora**")
+                st.markdown(build_activity_heatmap_html(analytics["heatmap"]), unsafe_allow_html=True)
+                st.markdown("**Distribución de los tiempos de respuesta**")
+                st.dataframe(
+                    [
+                        {"Participante": messages.senders[sender_id], **{
+                            label: int(count) for (_, label), count in zip(RESPONSE_TIME_BUCKETS, analytics["response_counts"][sender_id])
+                        }}
+                        for sender_id in range(1, len(messages.senders))
+                    ],
+                    hide_index=True,
+                )
+                st.caption("Una respuesta es un mensaje cuyo mensaje anterior (sin contar los del sistema) es de otro participante.")
+                st.markdown("**Silencios más largos**")
+                st.dataframe(
+                    [
+                        {
+                            "Desde": format_timestamp(messages.timestamps[before]),
+                            "Hasta": format_timestamp(messages.timestamps[after]),
+                            "Duración": format_duration(seconds),
+                            "Mensajes": f"#{before + 1} → #{after + 1}",
+                        }
+                        for before, after, seconds in analytics["gaps"]
+                    ],
+                    hide_index=True,
+                )
+
+            # Búsqueda de texto completo sobre el índice construido al procesar el archivo
+            timings.start("search")
+            with st.expander("🔎 Buscar en el chat"):
+                search_query = st.text_input(
+                    "Buscar palabras, \"frases exactas\", teléfonos o montos",
+                    key="search_query",
+                    help="No distingue mayúsculas ni tildes. Use comillas para buscar una frase y * al final de una palabra para buscar por prefijo.",
+                )
+                search_col1, search_col2 = st.columns(2)
+                with search_col1:
+                    search_sender = st.selectbox("Remitente", ["Todos"] + actual_participants, key="search_sender")
+                with search_col2:
+                    search_dates = st.date_input(
+                        "Rango de fechas",
+                        value=(),
+                        min_value=messages.first_date(),
+                        max_value=messages.last_date(),
+                        format="DD/MM/YYYY",
+                        key="search_dates",
+                    )
+                if search_query.strip():
+                    search_results = chat_data["search_index"].search(
+                        search_query,
+                        sender_id=None if search_sender == "Todos" else messages.sender_ids_by_name[search_sender],
+                        start_timestamp=date_to_timestamp(search_dates[0]) if len(search_dates) > 0 else None,
+                        end_timestamp=date_to_timestamp(search_dates[1]) + SECONDS_PER_DAY if len(search_dates) > 1 else None,
+                    )
+                    if len(search_results) > SEARCH_RESULTS_LIMIT:
+                        st.caption(f"{len(search_results)} mensajes encontrados (se muestran los primeros {SEARCH_RESULTS_LIMIT}).")
+                    else:
+                        st.caption(f"{len(search_results)} mensajes encontrados.")
+                    terms_regex = search_terms_regex(parse_search_query(search_query))
+                    for position in search_results[:SEARCH_RESULTS_LIMIT]:
+                        result_col, button_col = st.columns([5, 1])
+                        result_col.markdown(
+                            f"<small>{format_timestamp(messages.timestamps[position])} — "
+                            f"<strong>{html.escape(messages.senders[messages.sender_ids[position]])}</strong></small><br>"
+                            f"{build_search_snippet(messages.texts[position], terms_regex)}",
+                            unsafe_allow_html=True,
+                        )
+                        button_col.button("Ver en el chat", key=f"search_result_{position}", on_click=show_message, args=(position,))
+
+            # Determine who is on the left and who is on the right based on inversion state
+            left_aligned_participant = None
+            right_aligned_participant = None
             if st.session_state.participant1 and st.session_state.participant2:
-                # Determine who is on the left and who is on the right based on inversion state
                 if not st.session_state.invert_alignment:
                     left_aligned_participant = st.session_state.participant1
                     right_aligned_participant = st.session_state.participant2
                 else:
                     left_aligned_participant = st.session_state.participant2
                     right_aligned_participant = st.session_state.participant1
-             #   st.info(f"Mensajes de **{left_aligned_participant}** a la izquierda (burbuja blanca). Mensajes de **{right_aligned_participant}** a la derecha (burbuja verde).")
-                for msg in messages:
-                    # Handle system messages first
-                    if msg["sender"] == "Sistema":
-                        st.markdown(f"""
-                            <div style="text-align: center; font-size: 0.8em; color: #666; margin: 5px 0;">
-                                {msg["text"]}
-                            </div>
-                        """, unsafe_allow_html=True)
-                        continue
-
-                    sender_lower = msg["sender"].lower()
-
-                    if sender_lower == right_aligned_participant.lower():
-                        # Message goes to the right column, uses green bubble style
-                        col1, col2 = st.columns([1, 4]) # Smaller left, larger right
-                        with col2:
-                            display_message_bubble(msg["sender"], msg["text"], f"{msg['date']} {msg['time']}", True) # True for green bubble
-                    elif sender_lower == left_aligned_participant.lower():
-                        # Message goes to the left column, uses white bubble style
-                        col1, col2 = st.columns([4, 1]) # Larger left, smaller right
-                        with col1:
-                            display_message_bubble(msg["sender"], msg["text"], f"{msg['date']} {msg['time']}", False) # False for white bubble
-                    else:
-                        # Fallback for any other unexpected sender in a multi-person chat
-                        st.markdown(f"""
-                            <div style="text-align: center; font-size: 0.8em; color: #666; margin: 5px 0;">
-                                {msg["text"]}
-                            </div>
-                        """, unsafe_allow_html=True)
+
+            timings.start("pagination")
+            render_mode = st.radio("Modo de visualización", RENDER_MODES, horizontal=True, key="render_mode")
+
+            # Paginación: solo se envía al navegador la página visible, así el tiempo de la
+            # primera visualización no depende del largo del chat
+            if st.session_state.viewer_file != sha256_hash:
+                st.session_state.viewer_file = sha256_hash
+                st.session_state.chat_page_number = 1
+                st.session_state.highlight_position = None
+                st.session_state.type_filter = None
+                st.session_state.domain_filter = None
+
+            # Filtro por tipo de mensaje: usa los índices de tipos armados al procesar el archivo,
+            # sin volver a revisar los textos
+            message_type_labels = list(MESSAGE_TYPES.values())
+            type_col, domain_col = st.columns(2)
+            with type_col:
+                type_filter = st.selectbox(
+                    "Tipo de mensaje",
+                    [None] + [message_type for message_type, positions in enumerate(messages.type_positions) if positions],
+                    format_func=lambda message_type: (
+                        f"Todos ({len(messages)})" if message_type is None
+                        else f"{message_type_labels[message_type]} ({len(messages.type_positions[message_type])})"
+                    ),
+                    key="type_filter",
+                    on_change=reset_message_filter,
+                )
+            domain_filter = None
+            if type_filter == LINK_MESSAGE:
+                domain_counts = dict(messages.domain_counts())
+                with domain_col:
+                    domain_filter = st.selectbox(
+                        "Dominio del enlace",
+                        [None] + list(domain_counts),
+                        format_func=lambda domain: "Todos" if domain is None else f"{domain} ({domain_counts[domain]})",
+                        key="domain_filter",
+                        on_change=reset_message_filter,
+                    )
+            visible_positions = range(len(messages)) if type_filter is None else messages.positions_of_type(type_filter, domain_filter)
+
+            nav_col1, nav_col2, nav_col3 = st.columns([1, 1, 1])
+            with nav_col1:
+                page_size = st.selectbox("Mensajes por página", PAGE_SIZES, key="page_size", on_change=keep_page_position)
+            page_count = max(1, -(-len(visible_positions) // page_size))
+            # The page number is dropped with its widget on a rerun without the viewer (e.g. while
+            # the upload is hashed again for another selection of algorithms)
+            st.session_state.chat_page_number = min(max(st.session_state.get("chat_page_number", 1), 1), page_count)
+            with nav_col2:
+                page_number = st.number_input("Página", min_value=1, max_value=page_count, step=1, key="chat_page_number")
+            with nav_col3:
+                st.date_input(
+                    "Ir a la fecha",
+                    value=None,
+                    min_value=messages.first_date(),
+                    max_value=messages.last_date(),
+                    format="DD/MM/YYYY",
+                    key="jump_date",
+                    on_change=jump_to_date,
+                    args=(messages, visible_positions),
+                )
+            page_start = (page_number - 1) * page_size
+            page_end = min(page_start + page_size, len(visible_positions))
+            st.session_state.viewer_position = page_start
+            prev_col, caption_col, next_col = st.columns([1, 3, 1])
+            prev_col.button("◀ Anterior", on_click=change_page, args=(-1,), disabled=page_number <= 1)
+            if type_filter is None:
+                caption_col.caption(f"Mostrando mensajes {page_start + 1}–{page_end} de {len(messages)} (página {page_number} de {page_count})")
             else:
-                # If not enough participants for two-sided alignment, display all messages neutrally
-                for msg in messages:
-                    if msg["sender"] == "Sistema":
-                        st.markdown(f"""
-                            <div style="text-align: center; font-size: 0.8em; color: #666; margin: 5px 0;">
-                                {msg["text"]}
-                            </div>
-                        """, unsafe_allow_html=True)
-                    else:
-                        st.markdown(f"""
-                            <div class="message-bubble other-message">
-                                <div class="message-sender-name other-sender-color">
-                                    {msg["sender"]}
+                caption_col.caption(
+                    f"Mostrando {page_start + 1}–{page_end} de {len(visible_positions)} mensajes de tipo "
+                    f"'{message_type_labels[type_filter]}'{f' ({domain_filter})' if domain_filter else ''} (página {page_number} de {page_count})"
+                )
+            next_col.button("Siguiente ▶", on_click=change_page, args=(1,), disabled=page_number >= page_count)
+            page_positions = visible_positions[page_start:page_end]
+
+        if messages and render_mode == RENDER_MODES[0]:
+            # The visible page goes to the browser as a single HTML document
+            timings.start("render_document", messages=len(page_positions))
+            archive = chat_data["archive"]
+            if archive is not None and any(position in archive.by_position for position in page_positions):
+                # The thumbnails are read from this session's upload: the cached chat keeps no zip
+                archive = archive.reading(uploaded_file)
+            components.html(
+                build_chat_html(
+                    messages, page_positions, left_aligned_participant, right_aligned_participant,
+                    highlight_position=st.session_state.highlight_position,
+                    archive=archive,
+                ),
+                height=CHAT_VIEW_HEIGHT,
+                scrolling=True,
+            )
+        elif messages:
+            # One st.markdown call per message
+            timings.start("render_classic", messages=len(page_positions))
+            st.markdown("<div class='chat-container'>", unsafe_allow_html=True)
+            st.markdown("<div class='chat-header'>Conversación</div>", unsafe_allow_html=True) # Re-agregado el título "Conversación"
+
+            # Use a container for the scrollable chat messages area
+            with st.container():
+                st.markdown("<div class='chat-messages-area'>", unsafe_allow_html=True)
+            
+                if left_aligned_participant and right_aligned_participant:
+                    left_sender_id = messages.sender_ids_by_name[left_aligned_participant]
+                    right_sender_id = messages.sender_ids_by_name[right_aligned_participant]
+                 #   st.info(f"Mensajes de **{left_aligned_participant}** a la izquierda (burbuja blanca). Mensajes de **{right_aligned_participant}** a la derecha (burbuja verde).")
+                    for position in page_positions:
+                        sender_id = messages.sender_ids[position]
+                        msg_text = messages.texts[position]
+                        # Handle system messages first
+                        if sender_id == MessageStore.SYSTEM_SENDER_ID:
+                            st.markdown(f"""
+                                <div style="text-align: center; font-size: 0.8em; color: #666; margin: 5px 0;">
+                                    {msg_text}
                                 </div>
-                                <div>{msg["text"]}</div>
-                                <div class="message-time">
-                                    {msg['date']} {msg['time']}
+                            """, unsafe_allow_html=True)
+                            continue
+
+                        if sender_id == right_sender_id:
+                            # Message goes to the right column, uses green bubble style
+                            col1, col2 = st.columns([1, 4]) # Smaller left, larger right
+                            with col2:
+                                display_message_bubble(messages.senders[sender_id], msg_text, format_timestamp(messages.timestamps[position]), True, messages.message_types[position], messages.link_domain(position)) # True for green bubble
+                        elif sender_id == left_sender_id:
+                            # Message goes to the left column, uses white bubble style
+                            col1, col2 = st.columns([4, 1]) # Larger left, smaller right
+                            with col1:
+                                display_message_bubble(messages.senders[sender_id], msg_text, format_timestamp(messages.timestamps[position]), False, messages.message_types[position], messages.link_domain(position)) # False for white bubble
+                        else:
+                            # Fallback for any other unexpected sender in a multi-person chat
+                            st.markdown(f"""
+                                <div style="text-align: center; font-size: 0.8em; color: #666; margin: 5px 0;">
+                                    {msg_text}
+                                </div>
+                            """, unsafe_allow_html=True)
+                else:
+                    # If not enough participants for two-sided alignment, display all messages neutrally
+                    for position in page_positions:
+                        sender_id = messages.sender_ids[position]
+                        if sender_id == MessageStore.SYSTEM_SENDER_ID:
+                            st.markdown(f"""
+                                <div style="text-align: center; font-size: 0.8em; color: #666; margin: 5px 0;">
+                                    {messages.texts[position]}
+                                </div>
+                            """, unsafe_allow_html=True)
+                        else:
+                            st.markdown(f"""
+                                <div class="message-bubble other-message">
+                                    <div class="message-sender-name other-sender-color">
+                                        {messages.senders[sender_id]}
+                                    </div>
+                                    <div>{messages.texts[position]}</div>
+                                    <div class="message-time">
+                                        {format_timestamp(messages.timestamps[position])}
+                                    </div>
                                 </div>
-                            </div>
-                        """, unsafe_allow_html=True)
+                            """, unsafe_allow_html=True)
 
-            st.markdown("</div>", unsafe_allow_html=True) # Close chat-messages-area
+                st.markdown("</div>", unsafe_allow_html=True) # Close chat-messages-area
         
-        st.markdown("</div>", unsafe_allow_html=True) # Close chat-container
-#else:
- #   st.info("¡Hola! Para empezar, por favor, selecciona un archivo de chat de WhatsApp (.txt).")
-
-# HTML/JS para el contador de visitas de Firebase
-firebase_counter_html = """
-<script src="https://www.gstatic.com/firebasejs/11.6.1/firebase-app.js"></script>
-<script src="https://www.gstatic.com/firebasejs/11.6.1/firebase-auth.js"></script>
-<script src="https://www.gstatic.com/firebasejs/11.6.1/firebase-firestore.js"></script>
-<div id="visit_counter_display" style="font-size: 0.9em; color: #555; text-align: center; margin-top: 10px;">Cargando visitas...</div>
-<script>
-    // Asegurarse de que Streamlit esté listo antes de ejecutar el script
-    window.addEventListener('load', function() {
-        // Acceder a las variables globales proporcionadas por el entorno de Canvas
-        // Usar un fallback seguro en caso de que las variables no estén definidas
-        const firebaseConfig = JSON.parse(window.__firebase_config || '{}');
-        const appId = window.__app_id || 'default-app-id';
-        const initialAuthToken = window.__initial_auth_token;
-
-        // Verificar si la configuración de Firebase es válida
-        if (Object.keys(firebaseConfig).length === 0) {
-            console.error("Configuración de Firebase no encontrada. No se puede inicializar Firebase.");
-            document.getElementById('visit_counter_display').innerText = "Contador no disponible (configuración Firebase faltante).";
-            return;
-        }
+            st.markdown("</div>", unsafe_allow_html=True) # Close chat-container
+    #else:
+     #   st.info("¡Hola! Para empezar, por favor, selecciona un archivo de chat de WhatsApp (.txt).")
 
-        // Inicializar Firebase
-        const app = firebase_app.initializeApp(firebaseConfig);
-        const auth = firebase_auth.getAuth(app);
-        const db = firebase_firestore.getFirestore(app);
-
-        async function updateVisitCounter() {
-            try {
-                // Iniciar sesión anónimamente si no hay token personalizado
-                if (initialAuthToken) {
-                    await firebase_auth.signInWithCustomToken(auth, initialAuthToken);
-                } else {
-                    await firebase_auth.signInAnonymously(auth);
-                }
+    # HTML/JS para el contador de visitas de Firebase
+    firebase_counter_html = """
+    <script src="https://www.gstatic.com/firebasejs/11.6.1/firebase-app.js"></script>
+    <script src="https://www.gstatic.com/firebasejs/11.6.1/firebase-auth.js"></script>
+    <script src="https://www.gstatic.com/firebasejs/11.6.1/firebase-firestore.js"></script>
+    <div id="visit_counter_display" style="font-size: 0.9em; color: #555; text-align: center; margin-top: 10px;">Cargando visitas...</div>
+    <script>
+        // Asegurarse de que Streamlit esté listo antes de ejecutar el script
+        window.addEventListener('load', function() {
+            // Acceder a las variables globales proporcionadas por el entorno de Canvas
+            // Usar un fallback seguro en caso de que las variables no estén definidas
+            const firebaseConfig = JSON.parse(window.__firebase_config || '{}');
+            const appId = window.__app_id || 'default-app-id';
+            const initialAuthToken = window.__initial_auth_token;
+
+            // Verificar si la configuración de Firebase es válida
+            if (Object.keys(firebaseConfig).length === 0) {
+                console.error("Configuración de Firebase no encontrada. No se puede inicializar Firebase.");
+                document.getElementById('visit_counter_display').innerText = "Contador no disponible (configuración Firebase faltante).";
+                return;
+            }
 
-                // Referencia al documento del contador en Firestore
-                // La ruta sigue las reglas de seguridad: /artifacts/{appId}/public/data/app_visits/counter
-                const counterDocRef = firebase_firestore.doc(db, `artifacts/${appId}/public/data/app_visits/counter`);
-
-                // Usar una transacción para incrementar el contador de forma segura
-                await firebase_firestore.runTransaction(db, async (transaction) => {
-                    const sfDoc = await transaction.get(counterDocRef);
-                    // Obtener el conteo actual o 0 si no existe
-                    const newCount = (sfDoc.exists ? sfDoc.data().count : 0) + 1;
-                    // Actualizar el documento con el nuevo conteo
-                    transaction.set(counterDocRef, { count: newCount }, { merge: true });
-                });
-
-                // Configurar un listener en tiempo real para el contador
-                // Esto asegura que el contador se actualice si otros usuarios lo incrementan
-                firebase_firestore.onSnapshot(counterDocRef, (docSnapshot) => {
-                    if (docSnapshot.exists()) {
-                        const currentCount = docSnapshot.data().count;
-                        document.getElementById('visit_counter_display').innerText = `Visitas totales: ${currentCount}`;
+            // Inicializar Firebase
+            const app = firebase_app.initializeApp(firebaseConfig);
+            const auth = firebase_auth.getAuth(app);
+            const db = firebase_firestore.getFirestore(app);
+
+            async function updateVisitCounter() {
+                try {
+                    // Iniciar sesión anónimamente si no hay token personalizado
+                    if (initialAuthToken) {
+                        await firebase_auth.signInWithCustomToken(auth, initialAuthToken);
                     } else {
-                        document.getElementById('visit_counter_display').innerText = `Visitas totales: 0`;
+                        await firebase_auth.signInAnonymously(auth);
                     }
-                }, (error) => {
-                    console.error("Error al escuchar el contador de visitas:", error);
-                    document.getElementById('visit_counter_display').innerText = "Error al cargar el contador de visitas.";
-                });
-
-            } catch (error) {
-                console.error("Error al inicializar o incrementar el contador:", error);
-                document.getElementById('visit_counter_display').innerText = "Error al cargar el contador.";
+
+                    // Referencia al documento del contador en Firestore
+                    // La ruta sigue las reglas de seguridad: /artifacts/{appId}/public/data/app_visits/counter
+                    const counterDocRef = firebase_firestore.doc(db, `artifacts/${appId}/public/data/app_visits/counter`);
+
+                    // Usar una transacción para incrementar el contador de forma segura
+                    await firebase_firestore.runTransaction(db, async (transaction) => {
+                        const sfDoc = await transaction.get(counterDocRef);
+                        // Obtener el conteo actual o 0 si no existe
+                        const newCount = (sfDoc.exists ? sfDoc.data().count : 0) + 1;
+                        // Actualizar el documento con el nuevo conteo
+                        transaction.set(counterDocRef, { count: newCount }, { merge: true });
+                    });
+
+                    // Configurar un listener en tiempo real para el contador
+                    // Esto asegura que el contador se actualice si otros usuarios lo incrementan
+                    firebase_firestore.onSnapshot(counterDocRef, (docSnapshot) => {
+                        if (docSnapshot.exists()) {
+                            const currentCount = docSnapshot.data().count;
+                            document.getElementById('visit_counter_display').innerText = `Visitas totales: ${currentCount}`;
+                        } else {
+                            document.getElementById('visit_counter_display').innerText = `Visitas totales: 0`;
+                        }
+                    }, (error) => {
+                        console.error("Error al escuchar el contador de visitas:", error);
+                        document.getElementById('visit_counter_display').innerText = "Error al cargar el contador de visitas.";
+                    });
+
+                } catch (error) {
+                    console.error("Error al inicializar o incrementar el contador:", error);
+                    document.getElementById('visit_counter_display').innerText = "Error al cargar el contador.";
+                }
             }
-        }
 
-        updateVisitCounter(); // Llamar a la función para iniciar el contador
-    });
-</script>
-"""
-# Información profesional al final de la aplicación
-st.markdown("""
-    <div class="professional-signature">
-        <p>Diseñado por <strong>Marcelo G. Montiel</strong></p>
-        <p>Analista Universitario de Sistemas - Universidad Tecnológica Nacional</p>
-        <p>San Miguel de Tucumán, Tucumán, Argentina</p>
-    </div>
-""", unsafe_allow_html=True)
+            updateVisitCounter(); // Llamar a la función para iniciar el contador
+        });
+    </script>
+    """
+    timings.stop()
+    if debug_panel_enabled():
+        show_performance_panel(timings, (st.session_state.previous_hashing_job, previous_job, st.session_state.hashing_job, job))
+
+    # Información profesional al final de la aplicación
+    st.markdown("""
+        <div class="professional-signature">
+            <p>Diseñado por <strong>Marcelo G. Montiel</strong></p>
+            <p>Analista Universitario de Sistemas - Universidad Tecnológica Nacional</p>
+            <p>San Miguel de Tucumán, Tucumán, Argentina</p>
+        </div>
+    """, unsafe_allow_html=True)
+
+def run_app():
+    """
+    Runs a rerun of the app. When the performance panel asked for it (profile_next_run), the
+    rerun runs under cProfile and tracemalloc, holding profiling_lock, its report is kept in
+    st.session_state (profile_report, see build_profile_report) and the page is rerun to offer
+    it. If another rerun is being profiled, or another profiler (e.g. a debugger) is active,
+    the rerun runs without profiling and profile_error says why.
+    """
+    timings = PhaseTimings("rerun")
+    if not (st.session_state.pop("profile_next_run", False) and debug_panel_enabled()):
+        main(timings)
+        return
+    lock = profiling_lock()
+    if not lock.acquire(blocking=False):
+        st.session_state.profile_error = "Otra sesión está perfilando una re-ejecución; vuelva a intentarlo en unos segundos."
+        main(timings)
+        return
+    try:
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError as error:
+            # Since Python 3.12 only one profiler can be active at a time
+            st.session_state.profile_error = f"No se pudo iniciar cProfile: {error}"
+            main(timings)
+            return
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        timings.context["profiled"] = True
+        timings.traced = True
+        try:
+            try:
+                main(timings)
+            finally:
+                profiler.disable()
+            snapshot = tracemalloc.take_snapshot()
+        finally:
+            if started_tracing:
+                tracemalloc.stop()
+    finally:
+        lock.release()
+    st.session_state.profile_error = None
+    st.session_state.profile_report = build_profile_report(profiler, snapshot, timings)
+    st.rerun()
+
+if __name__ == "__main__":
+    # "python Whatsapp-generalSiningresodenombre4.py batch ..." runs without Streamlit;
+    # "streamlit run Whatsapp-generalSiningresodenombre4.py" runs the app
+    if sys.argv[1:2] and sys.argv[1] in CLI_COMMANDS:
+        sys.exit(cli_main(sys.argv[1:]))
+    run_app()
@@ -0,0 +1,156 @@
+import importlib.util
+import io
+import os
+
+import pytest
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Whatsapp-generalSiningresodenombre4.py")
+spec = importlib.util.spec_from_file_location("visualizador", APP_PATH)
+app = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(app)
+
+SENDERS = ("Marcelo G. Montiel", "Flor", "Ñandú Pérez")
+TEXTS = (
+    "Hola, ¿cómo estás?",
+    "Mañana a las 9 en el año nuevo\nsigue en otra línea",
+    "Mirá https://www.ejemplo.com.ar/nota?id=3",
+    "Contrato final.pdf (archivo adjunto)",
+    "IMG-20250702-WA0001.jpg (archivo adjunto)",
+    "Ok 👍",
+)
+
+
+def chat_lines(count, first=0):
+    """count messages of a chat, one day every 7 messages, starting at message first."""
+    lines = []
+    for number in range(first, first + count):
+        day, minute = divmod(number, 7)
+        header = f"{day % 28 + 1}/7/2025, {10 + minute}:{number % 60:02d} - "
+        if number % 50 == 0:
+            lines.append(f"{header}Se cambió el asunto del grupo\n")
+        else:
+            lines.append(f"{header}{SENDERS[number % len(SENDERS)]}: {TEXTS[number % len(TEXTS)]} #{number}\n")
+    return lines
+
+
+def upload(data, name="chat.txt"):
+    stream = io.BytesIO(data)
+    stream.name = name
+    return stream
+
+
+def ingest(data):
+    """Hashes and fully ingests an export, as the app does for a new upload."""
+    sha256_hash = app.compute_file_hashes(upload(data), ())["sha256"]
+    return sha256_hash, app.load_chat(sha256_hash, upload(data))
+
+
+def column_values(messages):
+    """Every column of a MessageStore as plain values, the texts decoded."""
+    values = {name: getattr(messages, name) for name in app.MessageStore.__slots__ if name not in ("chat_format", "texts")}
+    values["texts"] = list(messages.texts)
+    values["chat_format"] = messages.chat_format.name
+    return values
+
+
+def postings(search_index):
+    return {token: list(positions) for token, positions in search_index.postings.items()}
+
+
+def assert_same_chat(chat_data, expected):
+    assert column_values(chat_data["messages"]) == column_values(expected["messages"])
+    assert postings(chat_data["search_index"]) == postings(expected["search_index"])
+    assert chat_data["merkle_tree"].levels == expected["merkle_tree"].levels
+
+
+@pytest.mark.parametrize("change", ["appended", "continued", "altered"])
+@pytest.mark.parametrize("base_from_store", [False, True])
+def test_update_matches_a_full_parse(tmp_path, change, base_from_store):
+    earlier = chat_lines(300)
+    later = chat_lines(300) + chat_lines(120, first=300)
+    if change == "continued":
+        # The last message of the earlier export goes on with more lines in the later one
+        later[299] = later[299] + "una línea más\n"
+    elif change == "altered":
+        later[151] = later[151].replace("#151", "#151 (editado)")
+    earlier_data, later_data = "".join(earlier).encode("utf-8"), "".join(later).encode("utf-8")
+
+    base_sha256_hash, base_chat_data = ingest(earlier_data)
+    if base_from_store:
+        chat_store = app.ChatStore(str(tmp_path / "chats.sqlite3"), 1 << 30)
+        chat_store.save(base_sha256_hash, base_chat_data)
+        base_chat_data = {**chat_store.load(base_sha256_hash), "archive": None, "encoding": "utf-8"}
+    sha256_hash, expected = ingest(later_data)
+    chat_data = app.load_chat_update(sha256_hash, upload(later_data), base_sha256_hash, base_chat_data)
+
+    assert_same_chat(chat_data, expected)
+    # The last shared message is always parsed again
+    assert chat_data["shared_messages"] == {"appended": 299, "continued": 299, "altered": 150}[change]
+    changes = {"appended": [], "continued": [("altered", 299, 299)], "altered": [("altered", 151, 151)]}[change]
+    added = [("added", None, position) for position in range(300, 420)]
+    assert chat_data["changes"] == changes + added
+
+
+def test_message_store_prefix_is_a_shorter_parse():
+    data = "".join(chat_lines(420)).encode("utf-8")
+    messages, _ = app.parse_chat_content(data)
+    shorter, _ = app.parse_chat_content(data[:messages.byte_starts[150]])
+    assert column_values(messages.prefix(150)) == column_values(shorter)
+
+
+def test_merkle_tree_reuses_the_shared_nodes():
+    leaves = b"".join(app.merkle_leaf_hash(b"%d" % number) for number in range(1000))
+    base = app.MerkleTree(leaves[:700 * app.MERKLE_HASH_SIZE])
+    for shared_leaves in (0, 1, 511, 512, 699, 700):
+        tree = app.MerkleTree(leaves, base, shared_leaves)
+        assert tree.levels == app.MerkleTree(leaves).levels
+
+
+def test_search_index_extend_from_matches_a_full_build():
+    messages, _ = app.parse_chat_content("".join(chat_lines(420)).encode("utf-8"))
+    base = app.SearchIndex.build(messages.prefix(150))
+    index = app.SearchIndex.extend_from(base, messages, 150)
+    assert postings(index) == postings(app.SearchIndex.build(messages))
+    assert list(index.search("contrato final")) == list(app.SearchIndex.build(messages).search("contrato final"))
+
+
+@pytest.mark.parametrize("line_end", ["\n", "\r\n"])
+def test_stream_and_mapped_parsers_agree(line_end):
+    lines = chat_lines(420)
+    # An invalid UTF-8 byte and trailing spaces, which both parsers must handle alike
+    lines[10] = lines[10].replace("#10", "#10 \udcff  ")
+    data = line_end.join(line.rstrip("\n") for line in lines).encode("utf-8", "surrogateescape") + line_end.encode()
+    streamed, streamed_participants = app.parse_chat_content(upload(data))
+    mapped, mapped_participants = app.parse_mapped_chat(data)
+    assert column_values(mapped) == column_values(streamed)
+    assert mapped_participants == streamed_participants
+    assert "�" in streamed.texts[10]
+
+
+def test_chat_store_round_trip(tmp_path):
+    data = "".join(chat_lines(420)).encode("utf-8")
+    file_hashes = app.compute_file_hashes(upload(data))
+    sha256_hash = file_hashes["sha256"]
+    chat_data = app.load_chat(sha256_hash, upload(data))
+    store_path = str(tmp_path / "chats.sqlite3")
+    app.ChatStore(store_path, 1 << 30).save(sha256_hash, chat_data, file_hashes)
+
+    # Opened again, as after a restart: the schema version is kept, so is the chat
+    chat_store = app.ChatStore(store_path, 1 << 30)
+    assert chat_store.contains(sha256_hash)
+    stored = app.load_chat(sha256_hash, upload(data), chat_store)
+    assert stored["from_store"]
+    assert_same_chat(stored, chat_data)
+    assert stored["participants"] == chat_data["participants"]
+    for query in ("contrato final", "año", "ejemplo"):
+        assert list(stored["search_index"].search(query)) == list(chat_data["search_index"].search(query))
+
+
+def test_chat_store_skips_a_chat_larger_than_the_store(tmp_path):
+    data = "".join(chat_lines(420)).encode("utf-8")
+    sha256_hash, chat_data = ingest(data)
+    chat_store = app.ChatStore(str(tmp_path / "chats.sqlite3"), 1024)
+    chat_store.save(sha256_hash, chat_data)
+    assert not chat_store.contains(sha256_hash)
+    for table in app.ChatStore.TABLES:
+        assert chat_store.connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone() == (0,)
@@ -0,0 +1,90 @@
+import codecs
+import importlib.util
+import io
+import json
+import os
+import zipfile
+
+import pytest
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Whatsapp-generalSiningresodenombre4.py")
+spec = importlib.util.spec_from_file_location("visualizador", APP_PATH)
+app = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(app)
+
+CHAT_TEXT = (
+    "2/7/2025, 20:13 - Marcelo G. Montiel: Hola flor\n"
+    "2/7/2025, 20:14 - Flor: ¿Cómo estás? Mañana a las 9\n"
+    "sigue en otra línea\n"
+    "3/7/2025, 08:01 - Marcelo G. Montiel: Bien 👍\n"
+)
+
+
+def write_proof(tmp_path, export_path, position, chat_member=None):
+    """Ingests an export as the app does and writes the proof of one of its messages."""
+    with app.MappedFile(export_path) as export_file:
+        file_hashes = app.compute_file_hashes(export_file)
+        chat_data = app.load_chat(file_hashes["sha256"], export_file)
+        proof = app.build_message_proof(
+            chat_data["messages"], chat_data["merkle_tree"], position, export_file.name, file_hashes["sha256"],
+            chat_member=chat_member, encoding="utf-16" if export_file.utf16 else "utf-8",
+        )
+    proof_path = tmp_path / "proof.json"
+    proof_path.write_text(json.dumps(proof, ensure_ascii=False), encoding="utf-8")
+    return proof, proof_path
+
+
+@pytest.mark.parametrize("codec", ["utf-16-le", "utf-16-be"])
+def test_utf16_proof_round_trip(tmp_path, codec):
+    bom = codecs.BOM_UTF16_LE if codec == "utf-16-le" else codecs.BOM_UTF16_BE
+    export_path = tmp_path / "chat16.txt"
+    export_path.write_bytes(bom + CHAT_TEXT.encode(codec))
+
+    proof, proof_path = write_proof(tmp_path, export_path, 1)
+    assert proof["encoding"] == "utf-16"
+    assert proof["text"] == "¿Cómo estás? Mañana a las 9\nsigue en otra línea"
+    assert app.cli_main(["verify", str(proof_path), str(export_path)]) == 0
+
+    # The same chat re-encoded (or altered) no longer matches
+    export_path.write_bytes(bom + CHAT_TEXT.replace("a las 9", "a las 8").encode(codec))
+    assert app.cli_main(["verify", str(proof_path), str(export_path)]) == 1
+
+
+def test_zip_proof_uses_its_chat_member(tmp_path):
+    export_path = tmp_path / "chat.zip"
+    with zipfile.ZipFile(export_path, "w") as archive:
+        archive.writestr("WhatsApp Chat/_chat.txt", CHAT_TEXT)
+        archive.writestr("notas.txt", "otro texto, más largo que el chat " * 10)
+
+    proof, proof_path = write_proof(tmp_path, export_path, 2, chat_member="WhatsApp Chat/_chat.txt")
+    assert app.cli_main(["verify", str(proof_path), str(export_path)]) == 0
+
+    proof["chat_member"] = "no-existe.txt"
+    proof_path.write_text(json.dumps(proof, ensure_ascii=False), encoding="utf-8")
+    assert app.cli_main(["verify", str(proof_path), str(export_path)]) == 1
+
+
+@pytest.mark.parametrize("zipped", [False, True])
+def test_utf16_upload_proof_verifies_against_the_file(tmp_path, zipped):
+    chat_bytes = codecs.BOM_UTF16_LE + CHAT_TEXT.encode("utf-16-le")
+    export_path = tmp_path / ("chat16.zip" if zipped else "chat16.txt")
+    if zipped:
+        with zipfile.ZipFile(export_path, "w") as archive:
+            archive.writestr("_chat.txt", chat_bytes)
+    else:
+        export_path.write_bytes(chat_bytes)
+
+    # An upload is an in-memory stream, not a MappedFile: the BOM is detected on it too
+    upload = io.BytesIO(export_path.read_bytes())
+    upload.name = export_path.name
+    file_hashes = app.compute_file_hashes(upload)
+    chat_data = app.load_chat(file_hashes["sha256"], upload)
+    assert chat_data["encoding"] == "utf-16"
+    assert len(chat_data["messages"]) == 3
+    proof = app.build_message_proof(
+        chat_data["messages"], chat_data["merkle_tree"], 1, upload.name, file_hashes["sha256"],
+        chat_member="_chat.txt" if zipped else None, encoding=chat_data["encoding"],
+    )
+    proof_path = tmp_path / "proof.json"
+    proof_path.write_text(json.dumps(proof, ensure_ascii=False), encoding="utf-8")
+    assert app.cli_main(["verify", str(proof_path), str(export_path)]) == 0